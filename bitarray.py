@@ -1,7 +1,7 @@
 class BitArray:
     """
     Container to manipulate bit in python.
-    Main methods: write_bit, write_char, read_bit, read_char
+    Main methods: write_bit, write_bits, write_char, read_bit, read_bits, read_char
     Reference:
     - https://github.com/scott-griffiths/bitstring
     """
@@ -17,6 +17,7 @@ class BitArray:
         bit_array = BitArray()
         bit_array.bit_offset_w = num_bit
         bit_array.raw_array = bytearray(input_bytes)
+        bit_array.byte_length = len(bit_array.raw_array)
         return bit_array
 
     def to_bytes(self) -> bytes:
@@ -47,27 +48,35 @@ class BitArray:
         """
         self.check_full()
         if bit:
-            idx_byte = int(self.bit_offset_w / 8)
-            idx_bit = self.bit_offset_w - 8 * idx_byte
-            self.raw_array[idx_byte] |= (0b10000000 >> idx_bit)
+            self.raw_array[self.bit_offset_w >> 3] |= (0b10000000 >> (self.bit_offset_w & 7))
         self.bit_offset_w += 1
 
+    def write_bits(self, value: int, num_bit: int) -> None:
+        """
+        append the `num_bit` lowest bits of `value`, most significant first
+        """
+        value &= (1 << num_bit) - 1
+        num_free = self.byte_length * 8 - self.bit_offset_w  # free bits of last byte
+        if num_free:
+            if num_bit <= num_free:
+                self.raw_array[-1] |= value << (num_free - num_bit)
+                self.bit_offset_w += num_bit
+                return
+            num_bit -= num_free
+            self.raw_array[-1] |= value >> num_bit
+            value &= (1 << num_bit) - 1
+            self.bit_offset_w += num_free
+        num_pad = -num_bit % 8
+        num_byte = (num_bit + num_pad) >> 3
+        self.raw_array += (value << num_pad).to_bytes(num_byte, "big")
+        self.byte_length += num_byte
+        self.bit_offset_w += num_bit
+
     def write_char(self, char: str) -> None:
         """
         append an ascii character at the end of bit array
         """
-        # convert char to int
-        char_ascii = ord(char)
-        if self.bit_offset_w == self.byte_length * 8:
-            # quick method if array is already in chunck of byte
-            self.raw_array.append(char_ascii)
-            self.byte_length += 1
-            self.bit_offset_w += 8
-        else:
-        # get each bit of char from left to right and append it
-            for i in range(8):
-                bit = 0b00000001 & (char_ascii >> (7-i))
-                self.write_bit(bit)
+        self.write_bits(ord(char), 8)
 
     def reset_read_head(self):
         self.bit_offset_r = 0
@@ -78,20 +87,24 @@ class BitArray:
 
     def read_bit(self):
         self.check_out_range()
-        idx_byte = int(self.bit_offset_r / 8)
-        idx_bit = self.bit_offset_r - 8 * idx_byte
-        bit = (self.raw_array[idx_byte] >> (7-idx_bit)) & 0b00000001
+        bit = (self.raw_array[self.bit_offset_r >> 3] >> (7 - (self.bit_offset_r & 7))) & 1
         self.bit_offset_r += 1
         return bit
 
+    def read_bits(self, num_bit: int) -> int:
+        """
+        read `num_bit` bits as an unsigned int, most significant first
+        """
+        idx_end = self.bit_offset_r + num_bit
+        if idx_end > self.bit_offset_w:
+            raise IndexError("Read bit out of range")
+        idx_byte_end = (idx_end + 7) >> 3
+        chunk = int.from_bytes(self.raw_array[self.bit_offset_r >> 3:idx_byte_end], "big")
+        self.bit_offset_r = idx_end
+        return (chunk >> (idx_byte_end * 8 - idx_end)) & ((1 << num_bit) - 1)
+
     def read_char(self):
-        char_ascii = 0
-        for i in range(8):
-            bit = self.read_bit()
-            if bit:
-                char_ascii ^= (0b10000000 >> i)
-        char = chr(char_ascii)  # str(unichr(char_ascii)) for python2
-        return char
+        return chr(self.read_bits(8))  # str(unichr(char_ascii)) for python2
 
 
 class SimpleArray:
@@ -111,6 +124,10 @@ class SimpleArray:
     def write_bit(self, bit: int):
         self.raw_array.append(bit)
 
+    def write_bits(self, value: int, num_bit: int):
+        for i in range(num_bit - 1, -1, -1):
+            self.write_bit((value >> i) & 1)
+
     def write_char(self, char: str):
         self.write_bit(char)
 
@@ -122,6 +139,12 @@ class SimpleArray:
         self.bit_offset_r += 1
         return bit
 
+    def read_bits(self, num_bit: int) -> int:
+        value = 0
+        for _ in range(num_bit):
+            value = (value << 1) | self.read_bit()
+        return value
+
     def read_char(self) -> str:
         return self.read_bit()
 
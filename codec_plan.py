@@ -0,0 +1,451 @@
+import struct
+
+from record_class import Record
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+basic_structures = {
+    "int8": ("b", 1),
+    "uint8": ("B", 1),
+    "int16": ("h", 2),
+    "uint16": ("H", 2),
+    "int32": ("i", 4),
+    "uint32": ("I", 4),
+    "float": ("f", 4),
+    "double": ("d", 8),
+    "bool": ("?", 1)
+}
+
+# integer types written as varints in compact mode: (zigzag, min, max)
+varint_types = {
+    "int16": (True, -(1 << 15), (1 << 15) - 1),
+    "uint16": (False, 0, (1 << 16) - 1),
+    "int32": (True, -(1 << 31), (1 << 31) - 1),
+    "uint32": (False, 0, (1 << 32) - 1),
+}
+
+# length prefix of strings and variable lists
+length_codec = struct.Struct("<H")
+# length prefix of records in a stream of variable-size records
+record_length_codec = struct.Struct("<I")
+
+# Layout of a fixed-size value inside a fused run:
+# ("scalar", type_code), ("array", size, sub_layout),
+# ("struct", ((var_name, sub_layout), ...), type_name)
+scalar_layouts = {
+    type_code: ("scalar", type_code) for type_code, _ in basic_structures.values()
+}
+
+# little-endian numpy dtypes of the basic type codes
+numpy_types = {
+    "b": "i1", "B": "u1", "h": "<i2", "H": "<u2", "i": "<i4", "I": "<u4",
+    "f": "<f4", "d": "<f8", "?": "?"
+}
+
+
+def repeat_format(fmt: str, num: int) -> str:
+    """
+    Format string of `num` consecutive values of format `fmt`
+    """
+    if len(fmt) == 1:
+        return "{:d}{:s}".format(num, fmt)
+    return fmt * num
+
+
+def bitmap_size(num: int) -> int:
+    """
+    Size in bytes of `num` packed bits
+    """
+    return (num + 7) >> 3
+
+
+def flatten(layout: tuple, value, out: list) -> None:
+    """
+    Append the scalars of a fixed-size value to `out` in pack order
+    """
+    kind = layout[0]
+    if kind == "scalar":
+        out.append(value)
+    elif kind == "array":
+        size, sub_layout = layout[1], layout[2]
+        if len(value) != size:
+            raise ValueError("Expect list of size {}, got {}".format(
+                size, len(value)))
+        if sub_layout[0] == "scalar":
+            out.extend(value)
+        else:
+            for item in value:
+                flatten(sub_layout, item, out)
+    elif isinstance(value, Record):
+        for var_name, sub_layout in layout[1]:
+            flatten(sub_layout, getattr(value, var_name), out)
+    else:
+        for var_name, sub_layout in layout[1]:
+            flatten(sub_layout, value[var_name], out)
+
+
+def unflatten(layout: tuple, flat: tuple, idx: int, record_class=None):
+    """
+    Rebuild a fixed-size value from the unpacked scalars starting at `idx`.
+    Structs are rebuilt as dicts, or as records if `record_class` maps a
+    struct name to its record class.
+    Return the value and the index of the next scalar.
+    """
+    kind = layout[0]
+    if kind == "scalar":
+        return flat[idx], idx + 1
+    if kind == "array":
+        size, sub_layout = layout[1], layout[2]
+        if sub_layout[0] == "scalar":
+            return tuple(flat[idx:idx+size]), idx + size
+        items = []
+        for _ in range(size):
+            item, idx = unflatten(sub_layout, flat, idx, record_class)
+            items.append(item)
+        return tuple(items), idx
+    if record_class is not None:
+        values = []
+        for _, sub_layout in layout[1]:
+            item, idx = unflatten(sub_layout, flat, idx, record_class)
+            values.append(item)
+        return record_class(layout[2])(*values), idx
+    value = {}
+    for var_name, sub_layout in layout[1]:
+        value[var_name], idx = unflatten(sub_layout, flat, idx)
+    return value, idx
+
+
+def numpy_dtype(layout: tuple):
+    """
+    Packed little-endian numpy dtype of a fixed-size layout
+    """
+    if np is None:
+        raise ImportError("numpy is required for the array codec")
+    kind = layout[0]
+    if kind == "scalar":
+        return np.dtype(numpy_types[layout[1]])
+    if kind == "array":
+        return np.dtype((numpy_dtype(layout[2]), (layout[1],)))
+    return np.dtype([(var_name, numpy_dtype(sub_layout))
+                     for var_name, sub_layout in layout[1]])
+
+
+class StructPlan:
+    """
+    Precompiled codec plan of a struct.
+    The `self.steps` variable is a list of steps, each one of:
+    - ("fixed", codec, fields): a run of consecutive fixed-size fields
+      [(var_name, layout)] packed by the single struct.Struct `codec`
+    - ("string", var_name)
+    - ("struct", var_name, type_name, plan): nested struct of variable size
+    - ("list", var_name, type_name, list_size, plan, basic): variable list,
+      or fixed list of variable-size elements, `plan` being the StructPlan
+      of the elements or None, and `basic` the (type_code, type_size) of a
+      basic element type or None; both None for strings
+    If every field is fixed-size, `self.codec` and `self.layout` describe
+    the whole struct, otherwise they are None.
+    `self.static_size` is the total size of the fixed runs and
+    `self.min_size` the smallest encoded size of the struct, which bounds
+    the number of items a list of the struct can hold in the remaining data.
+    Structs compiled with `compact` (see compact_codec.CompactCodec) are
+    never fixed-size and have two more kinds of steps:
+    - ("bitmap", size, var_names): the bool fields packed into `size` bytes
+    - ("varint", var_name, type_name): an integer wider than a byte
+    `self.flat_names` lists the field names when every field is a scalar,
+    so that a record maps one-to-one onto the values of `self.codec`.
+    `self.fields` describes each field on its own, for random access:
+    [(var_name, type_name, is_list, list_size, codec, layout)], with the
+    struct.Struct `codec` and `layout` of fixed-size fields, None otherwise.
+    `self.prefix_offsets` are the offsets of the fields, relative to the start
+    of the struct, as far as they do not depend on the data.
+    The `*_func` variables are the generated codec functions of the struct,
+    if any (see codegen.StructCodegen).
+    """
+    def __init__(self, name: str, steps: list, fmt: str | None, layout: tuple | None,
+                 fields: list, compact: bool = False):
+        self.name = name
+        self.steps = steps
+        self.compact = compact
+        self.fields = fields
+        self.field_names = tuple(field[0] for field in fields)
+        self.field_index = {field[0]: idx for idx, field in enumerate(fields)}
+        self.prefix_offsets = [0]
+        for field in fields:
+            if field[4] is None:
+                break
+            self.prefix_offsets.append(self.prefix_offsets[-1] + field[4].size)
+        self.static_size = sum(step[1].size if step[0] == "fixed" else step[1]
+                               for step in steps if step[0] in ("fixed", "bitmap"))
+        self.fmt = fmt
+        self.layout = layout
+        self.codec = struct.Struct("<" + fmt) if fmt is not None else None
+        self.flat_names = None
+        if layout is not None and all(sub[0] == "scalar" for _, sub in layout[1]):
+            self.flat_names = tuple(var_name for var_name, _ in layout[1])
+        self.min_size = None
+        self.size_func = None
+        self.encode_func = None
+        self.size_record_func = None
+        self.encode_record_func = None
+        self.decode_func = None
+        self.decode_record_func = None
+
+    def resolve(self, plans: dict) -> None:
+        """
+        Link the steps of nested structs and lists to the plans of their
+        types, and the steps of lists of basic types to their type code
+        """
+        steps = []
+        for step in self.steps:
+            if step[0] == "struct":
+                step = step + (plans[step[2]],)
+            elif step[0] == "list":
+                step = step + (plans.get(step[2]), basic_structures.get(step[2]))
+            steps.append(step)
+        self.steps = steps
+
+    def compute_min_size(self) -> int:
+        if self.min_size is None and self.compact:
+            self.min_size = self.compute_compact_min_size()
+        if self.min_size is None:
+            size = self.static_size
+            for step in self.steps:
+                kind = step[0]
+                if kind == "string":
+                    size += length_codec.size
+                elif kind == "struct":
+                    size += step[3].compute_min_size()
+                elif kind == "list":
+                    if not step[3]:
+                        size += length_codec.size
+                    elif step[4] is not None:
+                        size += step[3] * step[4].compute_min_size()
+                    else:
+                        size += step[3] * length_codec.size
+            self.min_size = size
+        return self.min_size
+
+    def compute_compact_min_size(self) -> int:
+        # varints and lengths take at least a byte
+        size = self.static_size
+        for step in self.steps:
+            kind = step[0]
+            if kind in ("varint", "string"):
+                size += 1
+            elif kind == "struct":
+                size += step[3].compute_min_size()
+            elif kind == "list":
+                type_name, list_size, plan = step[2], step[3], step[4]
+                if not list_size:
+                    size += 1
+                elif type_name == "bool":
+                    size += bitmap_size(list_size)
+                elif type_name in basic_structures and type_name not in varint_types:
+                    size += list_size * basic_structures[type_name][1]
+                elif plan is not None:
+                    size += list_size * plan.compute_min_size()
+                else:
+                    size += list_size
+        return size
+
+    @staticmethod
+    def compile_protocol(protocol: dict, compact=False) -> dict:
+        """
+        Validate the protocol, then compile every ParsedStruct into a
+        StructPlan linked to the plans of its nested structs.
+        `compact` is True to compile every struct in compact mode, or the
+        names of the structs to compile in compact mode.
+        """
+        StructPlan.validate_protocol(protocol)
+        compact_names = StructPlan.compact_names(protocol, compact)
+        # compact structs are never fixed-size
+        fixed_cache = dict.fromkeys(compact_names)
+        plans = {}
+        for name in protocol:
+            if name in compact_names:
+                plans[name] = StructPlan.compile_compact_struct(protocol, name, fixed_cache)
+            else:
+                plans[name] = StructPlan.compile_struct(protocol, name, fixed_cache)
+        for plan in plans.values():
+            plan.resolve(plans)
+        for plan in plans.values():
+            plan.compute_min_size()
+        return plans
+
+    @staticmethod
+    def compact_names(protocol: dict, compact) -> set:
+        if compact is True:
+            return set(protocol)
+        if not compact:
+            return set()
+        compact_names = set(compact)
+        for name in compact_names:
+            if name not in protocol:
+                raise KeyError("Unrecognized strucut name: {}".format(name))
+        return compact_names
+
+    @staticmethod
+    def validate_protocol(protocol: dict) -> None:
+        """
+        Check that every struct has fields, that every field type is defined,
+        that field names are unique within a struct, and that no struct
+        contains itself other than through a variable list, which would
+        make its size infinite
+        """
+        for name, parsed_struct in protocol.items():
+            if not parsed_struct.fields:
+                raise ValueError("Struct {} has no field".format(name))
+            var_names = set()
+            for (var_name, type_name, _, _) in parsed_struct.fields:
+                if var_name in var_names:
+                    raise ValueError("Duplicate field {} in struct {}".format(var_name, name))
+                var_names.add(var_name)
+                if (type_name != "string" and type_name not in basic_structures
+                        and type_name not in protocol):
+                    raise KeyError("Unrecognized strucut name: {} (field {} of struct {})".format(
+                        type_name, var_name, name))
+        checked = set()
+
+        def check_cycle(name: str, path: list) -> None:
+            if name in checked:
+                return
+            if name in path:
+                cycle = path[path.index(name):] + [name]
+                raise ValueError("Struct {} contains itself: {}".format(name, " -> ".join(cycle)))
+            path.append(name)
+            for (_, type_name, is_list, list_size) in protocol[name].fields:
+                if type_name in protocol and (list_size or not is_list):
+                    check_cycle(type_name, path)
+            path.pop()
+            checked.add(name)
+
+        for name in protocol:
+            check_cycle(name, [])
+
+    @staticmethod
+    def fixed_layout(protocol: dict, type_name: str, fixed_cache: dict):
+        """
+        Return (fmt, layout) of a fixed-size type, or None if the
+        encoded size of the type depends on the data
+        """
+        if type_name == "string":
+            return None
+        if type_name in basic_structures:
+            type_code = basic_structures[type_name][0]
+            return type_code, scalar_layouts[type_code]
+        if type_name in fixed_cache:
+            return fixed_cache[type_name]
+        if type_name not in protocol:
+            raise KeyError("Unrecognized strucut name: {}".format(type_name))
+        fmt = ""
+        fields = []
+        rst = None
+        for (var_name, type_name_, is_list, list_size) in protocol[type_name].fields:
+            field_fixed = StructPlan.field_layout(
+                protocol, type_name_, is_list, list_size, fixed_cache)
+            if field_fixed is None:
+                break
+            fmt += field_fixed[0]
+            fields.append((var_name, field_fixed[1]))
+        else:
+            rst = (fmt, ("struct", tuple(fields), type_name))
+        fixed_cache[type_name] = rst
+        return rst
+
+    @staticmethod
+    def field_layout(protocol: dict, type_name: str, is_list: bool,
+                     list_size: int, fixed_cache: dict):
+        """
+        Return (fmt, layout) of a fixed-size field, or None
+        """
+        if is_list and not list_size:
+            return None
+        elem_fixed = StructPlan.fixed_layout(protocol, type_name, fixed_cache)
+        if elem_fixed is None or not is_list:
+            return elem_fixed
+        elem_fmt, elem_layout = elem_fixed
+        return (repeat_format(elem_fmt, list_size),
+                ("array", list_size, elem_layout))
+
+    @staticmethod
+    def compile_struct(protocol: dict, name: str, fixed_cache: dict):
+        steps = []
+        fields = []
+        run_fmt = ""
+        run_fields = []
+        for (var_name, type_name, is_list, list_size) in protocol[name].fields:
+            field_fixed = StructPlan.field_layout(
+                protocol, type_name, is_list, list_size, fixed_cache)
+            if field_fixed is not None:
+                fields.append((var_name, type_name, is_list, list_size,
+                               struct.Struct("<" + field_fixed[0]), field_fixed[1]))
+            else:
+                fields.append((var_name, type_name, is_list, list_size, None, None))
+            if field_fixed is not None:
+                run_fmt += field_fixed[0]
+                run_fields.append((var_name, field_fixed[1]))
+                continue
+            if run_fields:
+                steps.append(("fixed", struct.Struct("<" + run_fmt), run_fields))
+                run_fmt = ""
+                run_fields = []
+            if is_list:
+                steps.append(("list", var_name, type_name, list_size))
+            elif type_name == "string":
+                steps.append(("string", var_name))
+            else:
+                steps.append(("struct", var_name, type_name))
+        if run_fields:
+            steps.append(("fixed", struct.Struct("<" + run_fmt), run_fields))
+        struct_fixed = StructPlan.fixed_layout(protocol, name, fixed_cache)
+        if struct_fixed is None:
+            return StructPlan(name, steps, None, None, fields)
+        return StructPlan(name, steps, struct_fixed[0], struct_fixed[1], fields)
+
+    @staticmethod
+    def compile_compact_struct(protocol: dict, name: str, fixed_cache: dict):
+        """
+        Compile a struct in compact mode: bool fields go to the leading
+        bitmap, wider integers to varints, and the runs of int8, uint8,
+        float, double and nested fixed-size structs are packed as usual
+        """
+        steps = []
+        fields = []
+        bool_names = []
+        run_fmt = ""
+        run_fields = []
+        for (var_name, type_name, is_list, list_size) in protocol[name].fields:
+            fields.append((var_name, type_name, is_list, list_size, None, None))
+            if not is_list and type_name == "bool":
+                bool_names.append(var_name)
+                continue
+            if is_list and type_name in basic_structures or type_name in varint_types:
+                # lists of basic types and wider integers have compact encodings
+                field_fixed = None
+            else:
+                field_fixed = StructPlan.field_layout(
+                    protocol, type_name, is_list, list_size, fixed_cache)
+            if field_fixed is not None:
+                run_fmt += field_fixed[0]
+                run_fields.append((var_name, field_fixed[1]))
+                continue
+            if run_fields:
+                steps.append(("fixed", struct.Struct("<" + run_fmt), run_fields))
+                run_fmt = ""
+                run_fields = []
+            if is_list:
+                steps.append(("list", var_name, type_name, list_size))
+            elif type_name in varint_types:
+                steps.append(("varint", var_name, type_name))
+            elif type_name == "string":
+                steps.append(("string", var_name))
+            else:
+                steps.append(("struct", var_name, type_name))
+        if run_fields:
+            steps.append(("fixed", struct.Struct("<" + run_fmt), run_fields))
+        if bool_names:
+            steps.insert(0, ("bitmap", bitmap_size(len(bool_names)), tuple(bool_names)))
+        return StructPlan(name, steps, None, None, fields, compact=True)
@@ -0,0 +1,521 @@
+from codec_plan import basic_structures, length_codec
+from record_class import is_attribute_name
+
+
+class StructCodegen:
+    """
+    Generate straight-line Python source for the codecs of every struct
+    of a compiled protocol ({name: StructPlan}):
+    - size_struct<idx>(obj) -> int
+    - encode_struct<idx>(obj, buffer, offset) -> offset
+    - size_record_struct<idx>(record) and encode_record_struct<idx>(record,
+      buffer, offset), reading the fields of records (see
+      record_class.Record) as attributes
+    - decode_struct<idx>(data, offset) -> (dict, offset)
+    - decode_record_struct<idx>(data, offset) -> (record, offset)
+    `idx` being the index of the struct in the protocol, so that no struct
+    name can clash with the other globals of the generated module.
+    Nested structs are inlined, fixed runs are packed by a single
+    struct.Struct call and loops are only emitted for variable lists.
+    A struct is called rather than inlined inside itself, so recursive
+    structs still compile, and so is a struct nested deeper than
+    INLINE_DEPTH, which bounds the size of the generated code.
+    The generated module only depends on `struct`, `codec_plan` and
+    `record_class`, and exposes the functions in the tables `size_funcs`,
+    `encode_funcs`, `size_record_funcs`, `encode_record_funcs`,
+    `decode_funcs` and `decode_record_funcs`, along with
+    `record_classes`, which makes the record class of a struct on first
+    use (see record_class.LazyRecordClasses). A record decoder binds the
+    classes it builds to module globals on its first call, then allocates
+    records with `object.__new__` and fills their slots directly, which
+    skips both the class lookup and the call of `__init__`.
+    Structs in compact mode, and the structs containing them, are left
+    to the interpreter (see `codegen_structs`).
+    """
+    # arrays of structs inside a fixed run are unrolled up to this size
+    UNROLL_LIMIT = 8
+    INLINE_DEPTH = 2
+
+    def __init__(self, plans: dict):
+        self.plans = plans
+        self.names = self.codegen_structs(plans)
+        self.idents = {}
+        for idx, name in enumerate(plans):
+            self.idents[name] = "struct{:d}".format(idx)
+        self.codecs = {}  # {format: constant name}
+        self.attrs = False  # fields are read as attributes (records)
+        self.record_names = []  # structs built by the record decoder being generated
+        self.layouts = {}  # {repr(layout): constant name}
+        self.num_var = 0
+
+    @staticmethod
+    def codegen_structs(plans: dict) -> list:
+        """
+        Names of the structs that get generated codecs: those not in compact
+        mode and not reaching a compact struct
+        """
+        excluded = {name for name, plan in plans.items() if plan.compact}
+        changed = bool(excluded)
+        while changed:
+            changed = False
+            for name, plan in plans.items():
+                if name in excluded:
+                    continue
+                for step in plan.steps:
+                    if step[0] in ("struct", "list") and step[2] in excluded:
+                        excluded.add(name)
+                        changed = True
+                        break
+        return [name for name in plans if name not in excluded]
+
+    def generate(self) -> str:
+        funcs = []
+        for name in self.names:
+            funcs += self.gen_size(name, False)
+            funcs += self.gen_encode(name, False)
+            funcs += self.gen_size(name, True)
+            funcs += self.gen_encode(name, True)
+            funcs += self.gen_decode(name, False)
+            funcs += self.gen_decode(name, True)
+        lines = [
+            "# Generated by codegen.StructCodegen, do not edit",
+            "import struct",
+            "from codec_plan import length_codec, flatten, unflatten",
+            "from record_class import LazyRecordClasses",
+            "",
+            "new = object.__new__",
+        ]
+        lines.append("record_classes = LazyRecordClasses({{{}}})".format(", ".join(
+            "{!r}: {!r}".format(name, self.plans[name].field_names) for name in self.names)))
+        lines.append("record_globals = {{{}}}".format(", ".join(
+            "{!r}: 'record_{}'".format(name, self.idents[name]) for name in self.names)))
+        for fmt, codec_name in self.codecs.items():
+            lines.append("{} = struct.Struct({!r})".format(codec_name, fmt))
+        for layout, layout_name in self.layouts.items():
+            lines.append("{} = {}".format(layout_name, layout))
+        lines += [
+            "",
+            "",
+            "def bind_record_classes(names):",
+            "    for name in names:",
+            "        globals()[record_globals[name]] = record_classes[name]",
+        ]
+        lines += funcs
+        lines.append("")
+        for table, prefix in (("size_funcs", "size_"), ("encode_funcs", "encode_"),
+                              ("size_record_funcs", "size_record_"),
+                              ("encode_record_funcs", "encode_record_"),
+                              ("decode_funcs", "decode_"),
+                              ("decode_record_funcs", "decode_record_")):
+            lines.append("{} = {{{}}}".format(table, ", ".join(
+                "{!r}: {}{}".format(name, prefix, self.idents[name]) for name in self.names)))
+        return "\n".join(lines) + "\n"
+
+    def new_var(self, prefix: str) -> str:
+        self.num_var += 1
+        return "{}{:d}".format(prefix, self.num_var)
+
+    def codec_name(self, fmt: str) -> str:
+        if fmt not in self.codecs:
+            self.codecs[fmt] = "codec_{:d}".format(len(self.codecs))
+        return self.codecs[fmt]
+
+    def layout_name(self, layout: tuple) -> str:
+        key = repr(layout)
+        if key not in self.layouts:
+            self.layouts[key] = "layout_{:d}".format(len(self.layouts))
+        return self.layouts[key]
+
+    def is_called(self, type_name: str, stack: tuple) -> bool:
+        """
+        Whether the struct at the end of `stack` is called instead of inlined
+        """
+        return type_name in stack[:-1] or len(stack) > self.INLINE_DEPTH
+
+    @staticmethod
+    def at(offset: int) -> str:
+        return "offset + {:d}".format(offset) if offset else "offset"
+
+    def item(self, src: str, var_name: str) -> str:
+        if not self.attrs:
+            return "{}[{!r}]".format(src, var_name)
+        if is_attribute_name(var_name):
+            return "{}.{}".format(src, var_name)
+        # no record has such a field, the function only has to compile
+        return "getattr({}, {!r})".format(src, var_name)
+
+    def func_prefix(self, kind: str) -> str:
+        return kind + "_record_" if self.attrs else kind + "_"
+
+    # size
+
+    def gen_size(self, name: str, record: bool) -> list:
+        self.attrs = record
+        body = []
+        size = self.emit_size(name, "obj", body, "    ", (name,))
+        return (["", "", "def {}{}(obj):".format(self.func_prefix("size"), self.idents[name]),
+                 "    size = {:d}".format(size)] + body + ["    return size"])
+
+    def emit_size(self, type_name: str, src: str, lines: list, ind: str, stack: tuple) -> int:
+        """
+        Emit the statements adding the variable part of the size to `size`,
+        return the constant part
+        """
+        if type_name == "string":
+            if not src.isidentifier():
+                var = self.new_var("t")
+                lines.append("{}{} = {}".format(ind, var, src))
+                src = var
+            lines.append("{}size += len({}) if {}.isascii() else len({}.encode(\"UTF-8\"))".format(
+                ind, src, src, src))
+            return length_codec.size
+        if type_name in basic_structures:
+            return basic_structures[type_name][1]
+        if self.is_called(type_name, stack):
+            lines.append("{}size += {}{}({})".format(
+                ind, self.func_prefix("size"), self.idents[type_name], src))
+            return 0
+        plan = self.plans[type_name]
+        size = plan.static_size
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "fixed":
+                continue
+            if kind == "string":
+                size += self.emit_size("string", self.item(src, step[1]), lines, ind, stack)
+            elif kind == "struct":
+                var = self.new_var("t")
+                lines.append("{}{} = {}".format(ind, var, self.item(src, step[1])))
+                size += self.emit_size(step[2], var, lines, ind, stack + (step[2],))
+            else:
+                size += self.emit_size_list(step[2], step[3], self.item(src, step[1]),
+                                            lines, ind, stack)
+        return size
+
+    def emit_size_list(self, type_name: str, list_size: int, src: str, lines: list,
+                       ind: str, stack: tuple) -> int:
+        size = 0 if list_size else length_codec.size
+        plan = self.plans.get(type_name)
+        if type_name in basic_structures:
+            lines.append("{}size += {:d} * len({})".format(
+                ind, basic_structures[type_name][1], src))
+        elif plan is not None and plan.codec is not None:
+            lines.append("{}size += {:d} * len({})".format(ind, plan.codec.size, src))
+        else:
+            var = self.new_var("item")
+            lines.append("{}for {} in {}:".format(ind, var, src))
+            body = []
+            size_item = self.emit_size(type_name, var, body, ind + "    ",
+                                       stack + (type_name,))
+            if size_item:
+                body.append("{}    size += {:d}".format(ind, size_item))
+            lines += body or [ind + "    pass"]
+        return size
+
+    # encode
+
+    def gen_encode(self, name: str, record: bool) -> list:
+        self.attrs = record
+        lines = ["", "", "def {}{}(obj, buffer, offset):".format(
+            self.func_prefix("encode"), self.idents[name])]
+        self.emit_encode(name, "obj", lines, "    ", (name,))
+        lines.append("    return offset")
+        return lines
+
+    def emit_encode(self, type_name: str, src: str, lines: list, ind: str, stack: tuple) -> None:
+        """
+        Emit the statements writing `src` at `offset` and moving `offset`
+        past it
+        """
+        if type_name == "string":
+            self.emit_encode_string(src, lines, ind)
+            return
+        if self.is_called(type_name, stack):
+            lines.append("{}offset = {}{}({}, buffer, offset)".format(
+                ind, self.func_prefix("encode"), self.idents[type_name], src))
+            return
+        pending = 0
+        for step in self.plans[type_name].steps:
+            kind = step[0]
+            if kind == "fixed":
+                codec = step[1]
+                args = []
+                for var_name, layout in step[2]:
+                    self.emit_flatten(layout, self.item(src, var_name), args, lines, ind)
+                lines.append("{}{}.pack_into(buffer, {}, {})".format(
+                    ind, self.codec_name(codec.format), self.at(pending), ", ".join(args)))
+                pending += codec.size
+                continue
+            if pending:
+                lines.append("{}offset += {:d}".format(ind, pending))
+                pending = 0
+            if kind == "string":
+                self.emit_encode_string(self.item(src, step[1]), lines, ind)
+            elif kind == "struct":
+                var = self.new_var("t")
+                lines.append("{}{} = {}".format(ind, var, self.item(src, step[1])))
+                self.emit_encode(step[2], var, lines, ind, stack + (step[2],))
+            else:
+                self.emit_encode_list(step[2], step[3], self.item(src, step[1]),
+                                      lines, ind, stack)
+        if pending:
+            lines.append("{}offset += {:d}".format(ind, pending))
+
+    def emit_flatten(self, layout: tuple, src: str, args: list, lines: list, ind: str) -> None:
+        """
+        Append the pack arguments of the fixed-size value `src` to `args`
+        """
+        kind = layout[0]
+        if kind == "scalar":
+            args.append(src)
+            return
+        var = self.new_var("t")
+        lines.append("{}{} = {}".format(ind, var, src))
+        if kind == "struct":
+            for var_name, sub_layout in layout[1]:
+                self.emit_flatten(sub_layout, self.item(var, var_name), args, lines, ind)
+            return
+        size, sub_layout = layout[1], layout[2]
+        self.emit_check_size(var, size, lines, ind)
+        if sub_layout[0] == "scalar":
+            args.append("*" + var)
+        elif size <= self.UNROLL_LIMIT:
+            for idx in range(size):
+                self.emit_flatten(sub_layout, "{}[{:d}]".format(var, idx), args, lines, ind)
+        else:
+            var_flat = self.new_var("f")
+            lines.append("{}{} = []".format(ind, var_flat))
+            lines.append("{}flatten({}, {}, {})".format(
+                ind, self.layout_name(layout), var, var_flat))
+            args.append("*" + var_flat)
+
+    @staticmethod
+    def emit_check_size(src: str, size: int, lines: list, ind: str) -> None:
+        lines.append("{}if len({}) != {:d}:".format(ind, src, size))
+        lines.append("{}    raise ValueError(\"Expect list of size {:d}, got {{}}\""
+                     ".format(len({})))".format(ind, size, src))
+
+    def emit_encode_string(self, src: str, lines: list, ind: str) -> None:
+        var = self.new_var("t")
+        num = self.new_var("n")
+        lines += [
+            "{}{} = {}.encode(\"UTF-8\")".format(ind, var, src),
+            "{}{} = len({})".format(ind, num, var),
+            "{}length_codec.pack_into(buffer, offset, {})".format(ind, num),
+            "{}buffer[offset + {:d}:offset + {:d} + {}] = {}".format(
+                ind, length_codec.size, length_codec.size, num, var),
+            "{}offset += {:d} + {}".format(ind, length_codec.size, num),
+        ]
+
+    def emit_encode_list(self, type_name: str, list_size: int, src: str, lines: list,
+                         ind: str, stack: tuple) -> None:
+        var = self.new_var("t")
+        lines.append("{}{} = {}".format(ind, var, src))
+        if list_size:
+            num = "{:d}".format(list_size)
+            self.emit_check_size(var, list_size, lines, ind)
+        else:
+            num = self.new_var("n")
+            lines.append("{}{} = len({})".format(ind, num, var))
+            lines.append("{}length_codec.pack_into(buffer, offset, {})".format(ind, num))
+            lines.append("{}offset += {:d}".format(ind, length_codec.size))
+        if type_name in basic_structures:
+            type_code, type_size = basic_structures[type_name]
+            lines.append("{}struct.pack_into(\"<%d{}\" % {}, buffer, offset, *{})".format(
+                ind, type_code, num, var))
+            lines.append("{}offset += {:d} * {}".format(ind, type_size, num))
+            return
+        var_item = self.new_var("item")
+        lines.append("{}for {} in {}:".format(ind, var_item, var))
+        plan = self.plans.get(type_name)
+        if plan is not None and plan.codec is not None:
+            args = []
+            self.emit_flatten(plan.layout, var_item, args, lines, ind + "    ")
+            lines.append("{}    {}.pack_into(buffer, offset, {})".format(
+                ind, self.codec_name(plan.codec.format), ", ".join(args)))
+            lines.append("{}    offset += {:d}".format(ind, plan.codec.size))
+        else:
+            self.emit_encode(type_name, var_item, lines, ind + "    ", stack + (type_name,))
+
+    # decode
+
+    def gen_decode(self, name: str, record: bool) -> list:
+        self.attrs = False
+        self.record_names = []
+        prefix = "decode_record_" if record else "decode_"
+        lines = ["", "", "def {}{}(data, offset):".format(prefix, self.idents[name])]
+        body = []
+        value = self.emit_decode(name, body, "    ", (name,), record)
+        if record:
+            lines.append("    try:")
+            for type_name in self.record_names:
+                lines.append("        cls_{} = record_{}".format(
+                    self.idents[type_name], self.idents[type_name]))
+            lines += [
+                "    except NameError:",
+                "        bind_record_classes({!r})".format(tuple(self.record_names)),
+                "        return decode_record_{}(data, offset)".format(self.idents[name]),
+            ]
+        lines += body
+        lines.append("    return {}, offset".format(value))
+        return lines
+
+    def record_class(self, type_name: str) -> str:
+        """
+        Local variable holding the record class of the struct
+        """
+        if type_name not in self.record_names:
+            self.record_names.append(type_name)
+        return "cls_{}".format(self.idents[type_name])
+
+    def emit_decode(self, type_name: str, lines: list, ind: str, stack: tuple,
+                    record: bool) -> str:
+        """
+        Emit the statements decoding a value at `offset` and moving `offset`
+        past it, return the expression of the value
+        """
+        if type_name == "string":
+            return self.emit_decode_string(lines, ind)
+        if self.is_called(type_name, stack):
+            var = self.new_var("v")
+            lines.append("{}{}, offset = {}{}(data, offset)".format(
+                ind, var, "decode_record_" if record else "decode_", self.idents[type_name]))
+            return var
+        plan = self.plans[type_name]
+        values = []
+        pending = 0
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "fixed":
+                codec = step[1]
+                var = self.new_var("f")
+                lines.append("{}{} = {}.unpack_from(data, {})".format(
+                    ind, var, self.codec_name(codec.format), self.at(pending)))
+                pending += codec.size
+                idx = 0
+                for _, layout in step[2]:
+                    value, idx = self.unflatten_expr(layout, var, idx, record)
+                    values.append(value)
+                continue
+            if pending:
+                lines.append("{}offset += {:d}".format(ind, pending))
+                pending = 0
+            if kind == "string":
+                values.append(self.emit_decode_string(lines, ind))
+            elif kind == "struct":
+                values.append(self.emit_decode(step[2], lines, ind, stack + (step[2],), record))
+            else:
+                values.append(self.emit_decode_list(step[2], step[3], lines, ind, stack, record))
+        if pending:
+            lines.append("{}offset += {:d}".format(ind, pending))
+        if record and all(is_attribute_name(var_name) for var_name in plan.field_names):
+            var = self.new_var("r")
+            lines.append("{}{} = new({})".format(ind, var, self.record_class(type_name)))
+            for var_name, value in zip(plan.field_names, values):
+                lines.append("{}{}.{} = {}".format(ind, var, var_name, value))
+            return var
+        return self.struct_expr(type_name, plan.field_names, values, record)
+
+    def struct_expr(self, type_name: str, field_names: tuple, values: list,
+                    record: bool) -> str:
+        if record:
+            return "{}({})".format(self.record_class(type_name), ", ".join(values))
+        return "{{{}}}".format(", ".join(
+            "{!r}: {}".format(var_name, value) for var_name, value in zip(field_names, values)))
+
+    def unflatten_expr(self, layout: tuple, src: str, idx: int, record: bool) -> tuple:
+        """
+        Expression of the fixed-size value unpacked in `src` from `idx`,
+        and the index of the next scalar
+        """
+        kind = layout[0]
+        if kind == "scalar":
+            return "{}[{:d}]".format(src, idx), idx + 1
+        if kind == "struct":
+            values = []
+            for _, sub_layout in layout[1]:
+                value, idx = self.unflatten_expr(sub_layout, src, idx, record)
+                values.append(value)
+            return self.struct_expr(layout[2], tuple(var_name for var_name, _ in layout[1]),
+                                    values, record), idx
+        size, sub_layout = layout[1], layout[2]
+        if sub_layout[0] == "scalar":
+            return "{}[{:d}:{:d}]".format(src, idx, idx + size), idx + size
+        if size > self.UNROLL_LIMIT:
+            value = "unflatten({}, {}, {:d}{})[0]".format(
+                self.layout_name(layout), src, idx,
+                ", record_classes.__getitem__" if record else "")
+            return value, self.num_scalar(layout) + idx
+        items = []
+        for _ in range(size):
+            item, idx = self.unflatten_expr(sub_layout, src, idx, record)
+            items.append(item)
+        return "({},)".format(", ".join(items)), idx
+
+    @staticmethod
+    def num_scalar(layout: tuple) -> int:
+        kind = layout[0]
+        if kind == "scalar":
+            return 1
+        if kind == "array":
+            return layout[1] * StructCodegen.num_scalar(layout[2])
+        return sum(StructCodegen.num_scalar(sub_layout) for _, sub_layout in layout[1])
+
+    def emit_decode_string(self, lines: list, ind: str) -> str:
+        var = self.new_var("v")
+        num = self.new_var("n")
+        end = self.new_var("e")
+        lines += [
+            "{}{} = length_codec.unpack_from(data, offset)[0]".format(ind, num),
+            "{}{} = offset + {:d} + {}".format(ind, end, length_codec.size, num),
+            "{}if {} > len(data):".format(ind, end),
+            "{}    raise ValueError(\"String of {{}} bytes exceeds serialized data\""
+            ".format({}))".format(ind, num),
+            "{}{} = str(data[offset + {:d}:{}], \"UTF-8\")".format(
+                ind, var, length_codec.size, end),
+            "{}offset = {}".format(ind, end),
+        ]
+        return var
+
+    def emit_decode_list(self, type_name: str, list_size: int, lines: list, ind: str,
+                         stack: tuple, record: bool) -> str:
+        var = self.new_var("v")
+        if list_size:
+            num = "{:d}".format(list_size)
+        else:
+            num = self.new_var("n")
+            lines.append("{}{} = length_codec.unpack_from(data, offset)[0]".format(ind, num))
+            lines.append("{}offset += {:d}".format(ind, length_codec.size))
+        if type_name in basic_structures:
+            type_code, type_size = basic_structures[type_name]
+            lines.append("{}{} = struct.unpack_from(\"<%d{}\" % {}, data, offset)".format(
+                ind, var, type_code, num))
+            lines.append("{}offset += {:d} * {}".format(ind, type_size, num))
+            return var
+        plan = self.plans.get(type_name)
+        if plan is not None and plan.codec is not None:
+            end = self.new_var("e")
+            var_flat = self.new_var("f")
+            value = self.unflatten_expr(plan.layout, var_flat, 0, record)[0]
+            lines += [
+                "{}{} = offset + {:d} * {}".format(ind, end, plan.codec.size, num),
+                "{}if {} > len(data):".format(ind, end),
+                "{}    raise ValueError(\"List of {{}} items exceeds serialized data\""
+                ".format({}))".format(ind, num),
+                "{}{} = tuple([{} for {} in {}.iter_unpack(data[offset:{}])])".format(
+                    ind, var, value, var_flat, self.codec_name(plan.codec.format), end),
+                "{}offset = {}".format(ind, end),
+            ]
+            return var
+        if not list_size:
+            min_size = plan.min_size if plan is not None else length_codec.size
+            lines.append("{}if {} * {:d} > len(data) - offset:".format(ind, num, min_size))
+            lines.append("{}    raise ValueError(\"List of {{}} items exceeds serialized data\""
+                         ".format({}))".format(ind, num))
+        var_items = self.new_var("items")
+        lines.append("{}{} = []".format(ind, var_items))
+        lines.append("{}for _ in range({}):".format(ind, num))
+        value = self.emit_decode(type_name, lines, ind + "    ", stack + (type_name,), record)
+        lines.append("{}    {}.append({})".format(ind, var_items, value))
+        lines.append("{}{} = tuple({})".format(ind, var, var_items))
+        return var
@@ -0,0 +1,313 @@
+from operator import getitem
+import struct
+
+from codec_plan import basic_structures, varint_types, bitmap_size, flatten, unflatten
+from record_class import Record
+
+# lengths of strings and variable lists are unsigned varints up to 64 bits
+MAX_LENGTH = (1 << 64) - 1
+
+
+def zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def varint_size(value: int) -> int:
+    return (value.bit_length() + 6) // 7 or 1
+
+
+def pack_varint_into(buffer, offset: int, value: int) -> int:
+    while value >= 0x80:
+        buffer[offset] = (value & 0x7F) | 0x80
+        value >>= 7
+        offset += 1
+    buffer[offset] = value
+    return offset + 1
+
+
+def unpack_varint_from(data, offset: int) -> tuple:
+    value = 0
+    shift = 0
+    num_byte = len(data)
+    while True:
+        if offset >= num_byte:
+            raise ValueError("Varint exceeds serialized data")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+        if shift > 63:
+            raise ValueError("Varint longer than 64 bits")
+
+
+def encode_int(type_name: str, value: int) -> int:
+    """
+    Unsigned varint value of an integer of `type_name`
+    """
+    signed, value_min, value_max = varint_types[type_name]
+    if not value_min <= value <= value_max:
+        raise struct.error("{} requires {} <= number <= {}, got {}".format(
+            type_name, value_min, value_max, value))
+    return zigzag(value) if signed else value
+
+
+def decode_int(type_name: str, value: int) -> int:
+    """
+    Inverse of `encode_int`, raise ValueError if the integer does not fit in `type_name`
+    """
+    signed, value_min, value_max = varint_types[type_name]
+    if signed:
+        value = unzigzag(value)
+    if not value_min <= value <= value_max:
+        raise ValueError("{} requires {} <= number <= {}, got {}".format(
+            type_name, value_min, value_max, value))
+    return value
+
+
+class CompactCodec:
+    """
+    Codec of the structs compiled in compact mode (see StructPlan):
+    - integers wider than a byte are varints, zigzag-encoded if signed
+    - the bool fields of a struct are packed into a bitmap in front of it,
+      and bool lists into bits
+    - lengths of strings and variable lists are varints, up to 64 bits
+    - int8, uint8, float, double and nested plain fixed-size structs are
+      packed as in the default encoding
+    Nested structs are encoded in their own mode.
+    """
+    def __init__(self, proto_parser):
+        self.proto_parser = proto_parser
+
+    def calc_size(self, obj_data, plan) -> int:
+        proto_parser = self.proto_parser
+        get = getattr if isinstance(obj_data, Record) else getitem
+        size = plan.static_size
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "varint":
+                size += varint_size(encode_int(step[2], get(obj_data, step[1])))
+            elif kind == "string":
+                size += self.calc_string_size(get(obj_data, step[1]))
+            elif kind == "list":
+                size += self.calc_list_size(get(obj_data, step[1]), step[2], step[3], step[4])
+            elif kind == "struct":
+                size += proto_parser.calc_plan_size(get(obj_data, step[1]), step[3])
+        return size
+
+    @staticmethod
+    def calc_string_size(string_data: str) -> int:
+        if string_data.isascii():
+            size = len(string_data)
+        else:
+            size = len(string_data.encode(encoding="UTF-8", errors="strict"))
+        return varint_size(size) + size
+
+    def calc_list_size(self, list_data, type_name: str, list_size: int, plan) -> int:
+        num = len(list_data)
+        size = 0 if list_size else varint_size(num)
+        if type_name == "bool":
+            return size + bitmap_size(num)
+        if type_name in varint_types:
+            for item in list_data:
+                size += varint_size(encode_int(type_name, item))
+            return size
+        if type_name in basic_structures:
+            return size + basic_structures[type_name][1] * num
+        if type_name == "string":
+            for item in list_data:
+                size += self.calc_string_size(item)
+            return size
+        for item in list_data:
+            size += self.proto_parser.calc_plan_size(item, plan)
+        return size
+
+    def serialize_into(self, obj_data, plan, buffer, offset: int) -> int:
+        proto_parser = self.proto_parser
+        get = getattr if isinstance(obj_data, Record) else getitem
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "bitmap":
+                bits = 0
+                for idx, var_name in enumerate(step[2]):
+                    if get(obj_data, var_name):
+                        bits |= 1 << idx
+                buffer[offset:offset + step[1]] = bits.to_bytes(step[1], "little")
+                offset += step[1]
+            elif kind == "fixed":
+                values = []
+                for var_name, layout in step[2]:
+                    flatten(layout, get(obj_data, var_name), values)
+                codec = step[1]
+                codec.pack_into(buffer, offset, *values)
+                offset += codec.size
+            elif kind == "varint":
+                offset = pack_varint_into(buffer, offset,
+                                          encode_int(step[2], get(obj_data, step[1])))
+            elif kind == "string":
+                offset = self.serialize_string_into(get(obj_data, step[1]), buffer, offset)
+            elif kind == "list":
+                offset = self.serialize_list_into(get(obj_data, step[1]), step[2], step[3],
+                                                  step[4], buffer, offset)
+            else:
+                offset = proto_parser.serialize_plan_into(get(obj_data, step[1]), step[3],
+                                                          buffer, offset)
+        return offset
+
+    @staticmethod
+    def serialize_string_into(string_data: str, buffer, offset: int) -> int:
+        data_b = string_data.encode(encoding="UTF-8", errors="strict")
+        offset = pack_varint_into(buffer, offset, len(data_b))
+        buffer[offset:offset + len(data_b)] = data_b
+        return offset + len(data_b)
+
+    def serialize_list_into(self, list_data, type_name: str, list_size: int, plan,
+                            buffer, offset: int) -> int:
+        num = len(list_data)
+        if not list_size:
+            if num > MAX_LENGTH:
+                raise ValueError("List of {} items is too long".format(num))
+            offset = pack_varint_into(buffer, offset, num)
+        elif num != list_size:
+            raise ValueError("Expect list of size {}, got {}".format(list_size, num))
+        if type_name == "bool":
+            bits = 0
+            for idx, item in enumerate(list_data):
+                if item:
+                    bits |= 1 << idx
+            size = bitmap_size(num)
+            buffer[offset:offset + size] = bits.to_bytes(size, "little")
+            return offset + size
+        if type_name in varint_types:
+            for item in list_data:
+                offset = pack_varint_into(buffer, offset, encode_int(type_name, item))
+            return offset
+        if type_name in basic_structures:
+            type_code, type_size = basic_structures[type_name]
+            struct.pack_into("<{:d}{:s}".format(num, type_code), buffer, offset, *list_data)
+            return offset + type_size * num
+        if type_name == "string":
+            for item in list_data:
+                offset = self.serialize_string_into(item, buffer, offset)
+            return offset
+        for item in list_data:
+            offset = self.proto_parser.serialize_plan_into(item, plan, buffer, offset)
+        return offset
+
+    def load(self, plan, data, offset: int, record: bool) -> tuple:
+        proto_parser = self.proto_parser
+        record_class = proto_parser.record_class if record else None
+        var_data = {}
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "bitmap":
+                if offset + step[1] > len(data):
+                    raise ValueError("Bitmap exceeds serialized data")
+                bits = int.from_bytes(data[offset:offset + step[1]], "little")
+                offset += step[1]
+                for idx, var_name in enumerate(step[2]):
+                    var_data[var_name] = bool(bits >> idx & 1)
+            elif kind == "fixed":
+                codec = step[1]
+                flat = codec.unpack_from(data, offset)
+                offset += codec.size
+                idx = 0
+                for var_name, layout in step[2]:
+                    var_data[var_name], idx = unflatten(layout, flat, idx, record_class)
+            elif kind == "varint":
+                value, offset = unpack_varint_from(data, offset)
+                var_data[step[1]] = decode_int(step[2], value)
+            elif kind == "string":
+                var_data[step[1]], offset = self.load_string(data, offset)
+            elif kind == "list":
+                var_data[step[1]], offset = self.load_list(step[2], step[3], step[4],
+                                                           data, offset, record)
+            else:
+                var_data[step[1]], offset = proto_parser.load_plan(step[3], data, offset,
+                                                                   record)
+        if record:
+            return proto_parser.record_class(plan.name)(
+                *[var_data[var_name] for var_name in plan.field_names]), offset
+        return {var_name: var_data[var_name] for var_name in plan.field_names}, offset
+
+    @staticmethod
+    def load_string(data, offset: int) -> tuple:
+        string_size, offset = unpack_varint_from(data, offset)
+        idx_r = offset + string_size
+        if idx_r > len(data):
+            raise ValueError("String of {} bytes exceeds serialized data".format(string_size))
+        return str(data[offset:idx_r], encoding="UTF-8", errors="strict"), idx_r
+
+    def load_list(self, type_name: str, list_size: int, plan, data, offset: int,
+                  record: bool) -> tuple:
+        if not list_size:
+            list_size, offset = unpack_varint_from(data, offset)
+        if type_name == "bool":
+            size = bitmap_size(list_size)
+            if offset + size > len(data):
+                raise ValueError("List of {} items exceeds serialized data".format(list_size))
+            bits = int.from_bytes(data[offset:offset + size], "little")
+            return tuple(bool(bits >> idx & 1) for idx in range(list_size)), offset + size
+        if type_name in basic_structures and type_name not in varint_types:
+            type_code, type_size = basic_structures[type_name]
+            list_data = struct.unpack_from("<{:d}{:s}".format(list_size, type_code),
+                                           data, offset)
+            return list_data, offset + type_size * list_size
+        if list_size * (plan.min_size if plan is not None else 1) > len(data) - offset:
+            # every item takes at least a byte
+            raise ValueError("List of {} items exceeds serialized data".format(list_size))
+        list_data = []
+        if type_name in varint_types:
+            for _ in range(list_size):
+                value, offset = unpack_varint_from(data, offset)
+                list_data.append(decode_int(type_name, value))
+        elif type_name == "string":
+            for _ in range(list_size):
+                item, offset = self.load_string(data, offset)
+                list_data.append(item)
+        else:
+            load_plan = self.proto_parser.load_plan
+            for _ in range(list_size):
+                item, offset = load_plan(plan, data, offset, record)
+                list_data.append(item)
+        return tuple(list_data), offset
+
+    def skip(self, plan, data, offset: int) -> int:
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "bitmap":
+                offset += step[1]
+            elif kind == "fixed":
+                offset += step[1].size
+            elif kind == "varint":
+                offset = unpack_varint_from(data, offset)[1]
+            elif kind == "string":
+                string_size, offset = unpack_varint_from(data, offset)
+                offset += string_size
+            elif kind == "list":
+                offset = self.skip_list(step[2], step[3], step[4], data, offset)
+            else:
+                offset = self.proto_parser.skip_plan(step[3], data, offset)
+        return offset
+
+    def skip_list(self, type_name: str, list_size: int, plan, data, offset: int) -> int:
+        if not list_size:
+            list_size, offset = unpack_varint_from(data, offset)
+        if type_name == "bool":
+            return offset + bitmap_size(list_size)
+        if type_name in basic_structures and type_name not in varint_types:
+            return offset + basic_structures[type_name][1] * list_size
+        for _ in range(list_size):
+            if type_name in varint_types:
+                offset = unpack_varint_from(data, offset)[1]
+            elif type_name == "string":
+                string_size, offset = unpack_varint_from(data, offset)
+                offset += string_size
+            else:
+                offset = self.proto_parser.skip_plan(plan, data, offset)
+        return offset
@@ -1,5 +1,11 @@
 from bitarray import BitArray, SimpleArray
+from collections import Counter
+import heapq
 import struct
+from proto_profile import timed_stage
+
+# frame header of HuffmanStreamWriter: flag, body size
+frame_header_codec = struct.Struct("<BI")
 
 class Huffman:
     """
@@ -10,9 +16,9 @@ class Huffman:
     """
     class Node:
         def __init__(self, char: str, freq: int):
-            self.char = char  # the ascii character to encode
+            self.char = char  # the ascii character, or byte as an int, to encode
             self.freq = freq  # frequency of the char in the input string
-            self.code = ""    # the Huffman code of this char
+            self.code = None  # the Huffman code of this char: (code, length)
             self.is_leaf = False
             self.left = None
             self.right = None
@@ -20,105 +26,318 @@ class Huffman:
         def __repr__(self) -> str:
             return "char: {}, freq: {}, code: {}".format(self.char, self.freq, self.code)
 
+    MAX_CODE_LENGTH = 31  # stored on 5 bits by the canonical header
+
+    class DecodeTable:
+        """
+        Lookup table to decode a Huffman coded bit stream several bits at a time.
+        `self.table` is indexed by the next `self.table_bits` bits of input and
+        holds (char, code_length) of the code starting with these bits.
+        Codes longer than `self.table_bits` are looked up bit by bit in
+        `self.long_codes` ({(code, code_length): (char, code_length)}).
+        `self.binary` tells whether the chars are bytes (int) instead of str.
+        """
+        TABLE_BITS = 12
+
+        def __init__(self, codes: dict):
+            """
+            `codes`: dict of {char: (code, code_length)}, code as an int
+            """
+            if not codes:
+                raise ValueError("Empty Huffman code table")
+            self.binary = isinstance(next(iter(codes)), int)
+            self.max_length = max(length for _, length in codes.values())
+            self.table_bits = min(self.max_length, self.TABLE_BITS)
+            self.table = [None] * (1 << self.table_bits)
+            self.long_codes = {}
+            for char, (code, length) in codes.items():
+                if length > self.table_bits:
+                    self.long_codes[(code, length)] = (char, length)
+                    continue
+                shift = self.table_bits - length
+                idx_l = code << shift
+                self.table[idx_l:idx_l + (1 << shift)] = [(char, length)] * (1 << shift)
+
+        def decode(self, raw: bytes, num_bit: int, start_bit: int = 0) -> list:
+            """
+            Decode `num_bit` bits of `raw` from bit `start_bit` into a list of chars
+            """
+            table = self.table
+            table_bits = self.table_bits
+            long_codes = self.long_codes
+            max_length = self.max_length
+            num_byte = len(raw)
+            chars = []
+            append = chars.append
+            acc = 0  # unread bits, the oldest at the most significant end
+            acc_bits = 0
+            idx_byte = start_bit // 8
+            if start_bit % 8:
+                acc_bits = 8 - start_bit % 8
+                acc = raw[idx_byte] & ((1 << acc_bits) - 1)
+                idx_byte += 1
+            bits_left = num_bit
+            while bits_left > 0:
+                while acc_bits < table_bits:
+                    acc = (acc << 8) | (raw[idx_byte] if idx_byte < num_byte else 0)
+                    idx_byte += 1
+                    acc_bits += 8
+                entry = table[acc >> (acc_bits - table_bits)]
+                if entry is None:
+                    length = table_bits
+                    while entry is None:
+                        length += 1
+                        if length > max_length:
+                            raise ValueError("Invalid Huffman code in input")
+                        if acc_bits < length:
+                            acc = (acc << 8) | (raw[idx_byte] if idx_byte < num_byte else 0)
+                            idx_byte += 1
+                            acc_bits += 8
+                        entry = long_codes.get((acc >> (acc_bits - length), length))
+                char, length = entry
+                append(char)
+                acc_bits -= length
+                bits_left -= length
+                acc &= (1 << acc_bits) - 1
+            if bits_left < 0:
+                raise ValueError("Huffman coded input ends in the middle of a code")
+            return chars
+
+        def decode_text(self, raw: bytes, num_bit: int, start_bit: int = 0) -> str | bytes:
+            """
+            Same as `decode`, joined into a str, or bytes for a binary code
+            """
+            return Huffman.join_symbols(self.decode(raw, num_bit, start_bit), self.binary)
+
+
+    BYTE_ALPHABET = range(256)
 
     @staticmethod
-    def stats_input(input: str) -> dict:
+    def write_symbol(bit_array: BitArray | SimpleArray, char) -> None:
+        """
+        Write an ascii character, or a byte given as an int, on 8 bits
         """
-        Statistic the frequence of each charactor in the string
+        bit_array.write_bits(char if isinstance(char, int) else ord(char), 8)
+
+    @staticmethod
+    def read_symbol(bit_array: BitArray | SimpleArray, binary: bool = False):
+        value = bit_array.read_bits(8)
+        return value if binary else chr(value)
+
+    @staticmethod
+    def join_symbols(chars: list, binary: bool = False) -> str | bytes:
+        return bytes(chars) if binary else "".join(chars)
+
+    @staticmethod
+    def stats_input(input: str | bytes) -> dict:
+        """
+        Statistic the frequence of each charactor in the string, or of each
+        byte (as an int) in bytes input
         Return a dict of {char : freq}. 
-        The dict is sorted so that highest is at front
+        The dict is sorted so that highest is at front, ties by char
         """
-        dict_freq = {}
-        for char in input:
-            if char in dict_freq:
-                dict_freq[char] += 1
-            else:
-                dict_freq[char] = 1
-        dict_freq = sorted(dict_freq.items(), key=lambda x:x[1], reverse=True)
+        dict_freq = sorted(Counter(input).items(), key=lambda x: (-x[1], x[0]))
         return dict(dict_freq)
 
     @staticmethod
-    def insert_node(nodes_list: list[Node], node: Node):
+    def build_tree(input: str | bytes):
         """
-        Insert the node into the nodes_list while maintaining the ordering of the list
+        Build the Huffman tree from an input string or bytes
         """
-        freq = node.freq
-        for idx in range(len(nodes_list)):
-            freq_cur = nodes_list[idx].freq
-            if freq_cur <= freq:
-                nodes_list.insert(idx, node)
-                return
-        nodes_list.append(node)
+        return Huffman.build_tree_from_freq(Huffman.stats_input(input))
 
     @staticmethod
-    def build_tree(input: str):
+    def build_tree_from_freq(dict_freq: dict):
         """
-        Build the Huffman tree from an input string
+        Build the Huffman tree from the frequence of each char ({char: freq}).
+        The two least frequent nodes are merged first; ties are broken by char
+        for leaves and by creation order for merged nodes, so that the tree
+        only depends on the frequences.
         """
-        dict_freq = Huffman.stats_input(input)
-        nodes_list = []
-        for char, freq in dict_freq.items():
+        if len(dict_freq) == 0:
+            raise ValueError("Cannot build Huffman tree from empty input")
+        heap = []
+        for char, freq in sorted(dict_freq.items(), key=lambda x: (x[1], x[0])):
             node = Huffman.Node(char, freq)
             node.is_leaf = True
-            nodes_list.append(node)
-
-        while len(nodes_list) != 1:
-            first_node = nodes_list.pop()
-            second_node = nodes_list.pop()
+            heap.append((freq, len(heap), node))
+        heapq.heapify(heap)
+        order = len(heap)
+        while len(heap) != 1:
+            first_node = heapq.heappop(heap)[2]
+            second_node = heapq.heappop(heap)[2]
             node = Huffman.Node("", first_node.freq + second_node.freq)
             node.right = first_node
             node.left = second_node
-            Huffman.insert_node(nodes_list, node)
-
-        return nodes_list[0]
+            heapq.heappush(heap, (node.freq, order, node))
+            order += 1
+        return heap[0][2]
 
     @staticmethod
     def get_codes(root: Node) -> dict:
         """
-        Get the Huffman dict ({char: Huffman code}) from Huffman tree
+        Get the Huffman dict ({char: (code, length)}) from Huffman tree,
+        with the code as an int
         """
+        if root.is_leaf:
+            root.code = (0, 1)
+            return {root.char: root.code}
         dict_code = {}
-        node_stack = []
-        node_stack.append(root)
-        position_stack = []
-        position_stack.append("")
+        node_stack = [(root, 0, 0)]
         while len(node_stack) != 0:
-            node = node_stack.pop()
-            position = position_stack.pop()
-            node.code = position
-            dict_code[node.char] = node.code
-            if node.left:
-                node_stack.append(node.left)
-                position_stack.append(position + "0")
-            if node.right:
-                node_stack.append(node.right)
-                position_stack.append(position + "1")
-        dict_code.pop("")
+            node, code, length = node_stack.pop()
+            if node.is_leaf:
+                node.code = (code, length)
+                dict_code[node.char] = node.code
+            else:
+                node_stack.append((node.left, code << 1, length + 1))
+                node_stack.append((node.right, (code << 1) | 1, length + 1))
         return dict_code
 
     @staticmethod
-    def encode_input(dict_code: dict, text_input: str, to_bitarray = True) -> BitArray | SimpleArray:
+    def get_code_lengths(root: Node) -> dict:
+        """
+        Get the code length of each char ({char: length}) from Huffman tree
+        """
+        return {char: length for char, (_, length) in Huffman.get_codes(root).items()}
+
+    @staticmethod
+    def canonical_codes(code_lengths: dict) -> dict:
+        """
+        Derive the canonical Huffman codes ({char: (code, length)}) from the
+        code lengths: chars sorted by (length, char) take consecutive codes
+        """
+        codes = {}
+        code = 0
+        length_prev = 0
+        for char, length in sorted(code_lengths.items(), key=lambda x: (x[1], x[0])):
+            code <<= length - length_prev
+            codes[char] = (code, length)
+            code += 1
+            length_prev = length
+        return codes
+
+    @staticmethod
+    def encode_code_lengths(code_lengths: dict, bit_array: BitArray) -> None:
+        """
+        Write the canonical Huffman header: the max code length (5 bits),
+        the number of codes of each length 1..max (min(length, 8) + 1 bits),
+        then the chars sorted by (length, char), 8 bits each
+        """
+        max_length = max(code_lengths.values())
+        if max_length > Huffman.MAX_CODE_LENGTH:
+            raise ValueError("Huffman code of {} bits is too long".format(max_length))
+        num_codes = [0] * (max_length + 1)
+        for length in code_lengths.values():
+            num_codes[length] += 1
+        bit_array.write_bits(max_length, 5)
+        for length in range(1, max_length + 1):
+            bit_array.write_bits(num_codes[length], min(length, 8) + 1)
+        for char, _ in sorted(code_lengths.items(), key=lambda x: (x[1], x[0])):
+            Huffman.write_symbol(bit_array, char)
+
+    @staticmethod
+    def decode_code_lengths(bit_array: BitArray, binary: bool = False) -> dict:
+        """
+        Inverse of `encode_code_lengths`. Raise ValueError if the code lengths
+        break the Kraft inequality or a char is repeated, as in corrupt input.
+        """
+        max_length = bit_array.read_bits(5)
+        num_codes = [0] * (max_length + 1)
+        for length in range(1, max_length + 1):
+            num_codes[length] = bit_array.read_bits(min(length, 8) + 1)
+        if sum(num << (max_length - length) for length, num in enumerate(num_codes)) \
+                > 1 << max_length:
+            raise ValueError("Huffman code lengths break the Kraft inequality")
+        code_lengths = {}
+        for length in range(1, max_length + 1):
+            for _ in range(num_codes[length]):
+                code_lengths[Huffman.read_symbol(bit_array, binary)] = length
+        if len(code_lengths) != sum(num_codes):
+            raise ValueError("Repeated char in Huffman code lengths")
+        return code_lengths
+
+    @staticmethod
+    def pack_canonical(code_lengths: dict, text_input: str | bytes) -> bytes:
+        """
+        Pack the canonical Huffman header and the encoded text in one bit array:
+        the number of padding bits at the end (3 bits), the header, the text
+        """
+        bit_array = BitArray()
+        bit_array.write_bits(0, 3)
+        Huffman.encode_code_lengths(code_lengths, bit_array)
+        Huffman.write_codes(Huffman.canonical_codes(code_lengths), text_input, bit_array)
+        num_pad = -len(bit_array) % 8
+        bit_array.raw_array[0] |= num_pad << 5
+        return bit_array.to_bytes()
+
+    @staticmethod
+    def write_codes(codes: dict, text_input: str | bytes, bit_array: BitArray) -> None:
+        """
+        Append the codes ({char: (code, length)}) of the text to the bit array
+        """
+        acc = 0
+        acc_bits = 0
+        for char in text_input:
+            code, length = codes[char]
+            acc = (acc << length) | code
+            acc_bits += length
+            if acc_bits >= 64:
+                bit_array.write_bits(acc, acc_bits)
+                acc = 0
+                acc_bits = 0
+        bit_array.write_bits(acc, acc_bits)
+
+    @staticmethod
+    def unpack_canonical(input_bytes: bytes, binary: bool = False) -> tuple[dict, BitArray]:
+        """
+        Read the header of `pack_canonical` output, `binary` if bytes were packed.
+        Return the code lengths and the bit array with the read head at the text.
+        """
+        bit_array = BitArray.from_bytes(input_bytes, 8 * len(input_bytes))
+        num_pad = input_bytes[0] >> 5
+        bit_array.bit_offset_w -= num_pad
+        bit_array.bit_offset_r = 3
+        code_lengths = Huffman.decode_code_lengths(bit_array, binary)
+        return code_lengths, bit_array
+
+    @staticmethod
+    def decode_canonical(code_lengths: dict, text_encode: BitArray) -> str | bytes:
+        """
+        Decode the text from the read head of `text_encode` to its end
+        """
+        decode_table = Huffman.DecodeTable(Huffman.canonical_codes(code_lengths))
+        start_bit = text_encode.bit_offset_r
+        return decode_table.decode_text(text_encode.raw_array,
+                                        text_encode.bit_offset_w - start_bit, start_bit)
+
+    @staticmethod
+    def encode_input(dict_code: dict, text_input: str | bytes, to_bitarray = True) -> BitArray | SimpleArray:
         """
         Use Huffman dict to encode input text
         """
         if to_bitarray:
             text_encode = BitArray()
-        else:
-            text_encode = SimpleArray()
+            Huffman.write_codes(dict_code, text_input, text_encode)
+            return text_encode
+        text_encode = SimpleArray()
         for char in text_input:
-            huff_code = dict_code[char]
-            for ch in huff_code:
-                bit = int(ch == "1")
-                text_encode.write_bit(bit)
+            text_encode.write_bits(*dict_code[char])
         return text_encode
 
     @staticmethod
-    def decode_input(root: Node, text_encode: BitArray | SimpleArray) -> str:
-        text_decode = ""
+    def decode_input(root: Node, text_encode: BitArray | SimpleArray) -> str | bytes:
+        decode_table = Huffman.DecodeTable(Huffman.get_codes(root))
+        if isinstance(text_encode, BitArray):
+            return decode_table.decode_text(text_encode.raw_array, text_encode.bit_offset_w)
+        text_decode = []
         idx_cur = 0
         idx_max = len(text_encode)
         while idx_cur < idx_max:
             node = root
+            if node.is_leaf:  # single char, coded on one bit
+                text_encode.read_bit()
+                idx_cur += 1
             while not node.is_leaf:
                 if text_encode.read_bit():
                     node = node.right
@@ -126,8 +345,8 @@ class Huffman:
                 else:
                     node = node.left
                     idx_cur += 1
-            text_decode += node.char
-        return text_decode
+            text_decode.append(node.char)
+        return Huffman.join_symbols(text_decode, decode_table.binary)
 
 
     @staticmethod
@@ -142,7 +361,7 @@ class Huffman:
             node = stack.pop()
             if node.is_leaf:
                 tree_encode.write_bit(1)
-                tree_encode.write_char(node.char)
+                Huffman.write_symbol(tree_encode, node.char)
             else:
                 tree_encode.write_bit(0)
                 stack.append(node.right)
@@ -150,15 +369,15 @@ class Huffman:
         return tree_encode
 
     @staticmethod
-    def decode_tree(bit_reader: BitArray | SimpleArray) -> Node:
+    def decode_tree(bit_reader: BitArray | SimpleArray, binary: bool = False) -> Node:
         bit_cur = bit_reader.read_bit()
         if bit_cur:
-            node = Huffman.Node(bit_reader.read_char(), 0)
+            node = Huffman.Node(Huffman.read_symbol(bit_reader, binary), 0)
             node.is_leaf = True
             return node
         else:
-            left = Huffman.decode_tree(bit_reader)
-            right = Huffman.decode_tree(bit_reader)
+            left = Huffman.decode_tree(bit_reader, binary)
+            right = Huffman.decode_tree(bit_reader, binary)
             node = Huffman.Node("", 0)
             node.left = left
             node.right = right
@@ -190,6 +409,251 @@ class Huffman:
                        "read bytes: {}, total bytes: {}".format(idx_r, len(input_bytes)))
         return [tree, text]
 
+    @staticmethod
+    def compress(text_input: str | bytes, canonical: bool = False, profiler=None) -> bytes:
+        """
+        Huffman encode the text, packed with its tree, or with `canonical`,
+        with its code lengths only.
+        The stages are timed by `profiler` (see proto_profile.ProtoProfiler)
+        if given: stats, tree_build, encode, pack.
+        """
+        with timed_stage(profiler, "stats", "encode") as stage:
+            dict_freq = Huffman.stats_input(text_input)
+            stage.num_byte = len(text_input)
+        with timed_stage(profiler, "tree_build", "encode") as stage:
+            huffman_tree = Huffman.build_tree_from_freq(dict_freq)
+            stage.num_byte = len(text_input)
+        if canonical:
+            with timed_stage(profiler, "encode", "encode") as stage:
+                code_lengths = Huffman.get_code_lengths(huffman_tree)
+                packed = Huffman.pack_canonical(code_lengths, text_input)
+                stage.num_byte = len(text_input)
+            return packed
+        with timed_stage(profiler, "encode", "encode") as stage:
+            dict_code = Huffman.get_codes(huffman_tree)
+            text_encode_bitarray = Huffman.encode_input(dict_code, text_input)
+            stage.num_byte = len(text_input)
+        with timed_stage(profiler, "pack", "encode") as stage:
+            tree_encode_bitarray = Huffman.encode_tree(huffman_tree)
+            packed = Huffman.pack_tree_and_text_bitarray(tree_encode_bitarray,
+                                                         text_encode_bitarray)
+            stage.num_byte = len(packed)
+        return packed
+
+    @staticmethod
+    def decompress(input_bytes: bytes, canonical: bool = False, binary: bool = False,
+                   profiler=None) -> str | bytes:
+        """
+        Inverse of `compress`, `binary` if bytes were compressed.
+        The stages are timed by `profiler` if given: unpack, tree_build, decode.
+        """
+        if canonical:
+            with timed_stage(profiler, "unpack", "decode") as stage:
+                code_lengths, text_encode = Huffman.unpack_canonical(input_bytes, binary)
+                stage.num_byte = len(input_bytes)
+            with timed_stage(profiler, "decode", "decode") as stage:
+                text_decode = Huffman.decode_canonical(code_lengths, text_encode)
+                stage.num_byte = len(text_decode)
+            return text_decode
+        with timed_stage(profiler, "unpack", "decode") as stage:
+            tree_encode, text_encode = Huffman.unpack_tree_and_text_bitarray(input_bytes)
+            stage.num_byte = len(input_bytes)
+        with timed_stage(profiler, "tree_build", "decode") as stage:
+            tree = Huffman.decode_tree(tree_encode, binary)
+            stage.num_byte = len(tree_encode.raw_array)
+        with timed_stage(profiler, "decode", "decode") as stage:
+            text_decode = Huffman.decode_input(tree, text_encode)
+            stage.num_byte = len(text_decode)
+        return text_decode
+
+class HuffmanModel:
+    """
+    Canonical Huffman code trained on a corpus and shared by many messages,
+    so that neither the tree nor the tables are rebuilt or shipped per message.
+    """
+    HEX_ALPHABET = "0123456789abcdef"
+
+    def __init__(self, model_id: int, code_lengths: dict):
+        self.model_id = model_id
+        self.code_lengths = code_lengths
+        self.codes = Huffman.canonical_codes(code_lengths)
+        self.decode_table = Huffman.DecodeTable(self.codes)
+        self.binary = self.decode_table.binary
+
+    @staticmethod
+    def train(model_id: int, corpus, alphabet=HEX_ALPHABET):
+        """
+        Train a model on an iterable of texts, or of bytes with
+        `alphabet=Huffman.BYTE_ALPHABET`.
+        Every char of `alphabet` gets a code even if absent from the corpus.
+        """
+        dict_freq = Counter(alphabet)
+        for text_input in corpus:
+            dict_freq.update(text_input)
+        huffman_tree = Huffman.build_tree_from_freq(dict_freq)
+        return HuffmanModel(model_id, Huffman.get_code_lengths(huffman_tree))
+
+    def compress(self, text_input: str | bytes) -> bytes:
+        """
+        Encode the text as the number of padding bits at the end (3 bits)
+        followed by the codes
+        """
+        bit_array = BitArray()
+        bit_array.write_bits(0, 3)
+        try:
+            Huffman.write_codes(self.codes, text_input, bit_array)
+        except KeyError as e:
+            raise ValueError("Char {} is not in Huffman model {}".format(
+                e, self.model_id)) from None
+        num_pad = -len(bit_array) % 8
+        bit_array.raw_array[0] |= num_pad << 5
+        return bit_array.to_bytes()
+
+    def decompress(self, input_bytes: bytes) -> str | bytes:
+        num_bit = 8 * len(input_bytes) - (input_bytes[0] >> 5) - 3
+        return self.decode_table.decode_text(input_bytes, num_bit, 3)
+
+    def to_bytes(self) -> bytes:
+        bit_array = BitArray()
+        Huffman.encode_code_lengths(self.code_lengths, bit_array)
+        return struct.pack("<H?", self.model_id, self.binary) + bit_array.to_bytes()
+
+    @staticmethod
+    def from_bytes(input_bytes: bytes):
+        model_id, binary = struct.unpack("<H?", input_bytes[0:3])
+        bit_array = BitArray.from_bytes(input_bytes[3:], 8 * (len(input_bytes) - 3))
+        return HuffmanModel(model_id, Huffman.decode_code_lengths(bit_array, binary))
+
+    def save(self, filename: str) -> None:
+        with open(filename, "wb") as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def load(filename: str):
+        with open(filename, "rb") as f:
+            return HuffmanModel.from_bytes(f.read())
+
+
+def read_exact(file, num_byte: int) -> bytes:
+    """
+    Read exactly `num_byte` bytes from a file-like object (which may return
+    short reads), or fewer if the end of file is reached
+    """
+    chunks = []
+    while num_byte > 0:
+        chunk = file.read(num_byte)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        num_byte -= len(chunk)
+    return b"".join(chunks)
+
+
+class HuffmanStreamWriter:
+    """
+    Compress a byte stream into a sequence of independent frames, so that
+    neither the writer nor the reader needs the whole stream in memory.
+    Stream layout: MAGIC, then frames of flag (uint8), body size (uint32), body.
+    A body is the `Huffman.pack_canonical` output of the frame (flag 0), or
+    the id of a shared binary HuffmanModel (uint16) followed by
+    `HuffmanModel.compress` output (flag 1).
+    The underlying file is not closed by `close`.
+    """
+    MAGIC = b"HUFS"
+    FRAME_SIZE = 1 << 16
+
+    def __init__(self, file, frame_size: int = FRAME_SIZE, model: HuffmanModel = None):
+        if model is not None and not model.binary:
+            raise ValueError("Huffman model {} does not code bytes".format(model.model_id))
+        self.file = file
+        self.frame_size = frame_size
+        self.model = model
+        self.buffer = bytearray()
+        self.file.write(self.MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            self.write_frame(bytes(self.buffer[:self.frame_size]))
+            del self.buffer[:self.frame_size]
+
+    def flush(self) -> None:
+        """
+        Emit the buffered data as a (short) frame
+        """
+        if self.buffer:
+            self.write_frame(bytes(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+    def write_frame(self, data: bytes) -> None:
+        if self.model is not None:
+            flag = 1
+            body = struct.pack("<H", self.model.model_id) + self.model.compress(data)
+        else:
+            flag = 0
+            code_lengths = Huffman.get_code_lengths(Huffman.build_tree(data))
+            body = Huffman.pack_canonical(code_lengths, data)
+        self.file.write(frame_header_codec.pack(flag, len(body)))
+        self.file.write(body)
+
+
+class HuffmanStreamReader:
+    """
+    Decompress the frames written by HuffmanStreamWriter one at a time.
+    `models`: {model_id: HuffmanModel} of the models frames may reference.
+    """
+    def __init__(self, file, models: dict = None):
+        self.file = file
+        self.models = models if models is not None else {}
+        magic = read_exact(file, len(HuffmanStreamWriter.MAGIC))
+        if magic != HuffmanStreamWriter.MAGIC:
+            raise ValueError("Not a Huffman stream: {}".format(magic))
+
+    def __iter__(self):
+        while True:
+            data = self.read_frame()
+            if data is None:
+                return
+            yield data
+
+    def read_frame(self) -> bytes | None:
+        """
+        Decompress the next frame, or return None at the end of the stream
+        """
+        header = read_exact(self.file, frame_header_codec.size)
+        if not header:
+            return None
+        if len(header) != frame_header_codec.size:
+            raise ValueError("Truncated Huffman frame header")
+        flag, num_byte = frame_header_codec.unpack(header)
+        body = read_exact(self.file, num_byte)
+        if len(body) != num_byte:
+            raise ValueError("Truncated Huffman frame: expect {} bytes, got {}".format(
+                num_byte, len(body)))
+        if flag == 0:
+            code_lengths, text_encode = Huffman.unpack_canonical(body, binary=True)
+            return Huffman.decode_canonical(code_lengths, text_encode)
+        if flag == 1:
+            model_id = struct.unpack("<H", body[0:2])[0]
+            if model_id not in self.models:
+                raise KeyError("Unregistered Huffman model id: {}".format(model_id))
+            return self.models[model_id].decompress(body[2:])
+        raise ValueError("Unknown Huffman frame flag: {}".format(flag))
+
+    def read(self) -> bytes:
+        return b"".join(self)
+
+
 def test_huffman(text_input):
     dict_freq = Huffman.stats_input(text_input)
     huffman_tree = Huffman.build_tree(text_input)
@@ -1,3 +1,10 @@
+import re
+
+# "Name { fields };" and "type[size] var_name"
+struct_pattern = re.compile(r"\s*([A-Za-z_]\w*)\s*\{([^{}]*)\}\s*;\s*")
+field_pattern = re.compile(r"([A-Za-z_]\w*)(?:\s*(\[\s*\d*\s*\])\s*|\s+)([A-Za-z_]\w*)")
+
+
 class ParsedStruct:
     """
     Stores the parsed fields in an struct.
@@ -25,26 +32,49 @@ class ParsedStruct:
             self.fields.append((var_name, type_name, is_list, list_size))
 
     @staticmethod
-    def parse_struct(proto: str):
+    def from_fields(name: str, fields: list):
         """
-        Read a struct from the proto
+        Rebuild a ParsedStruct from its `fields`
         """
-        name, proto_left = proto.split("{", 1)
-        name = name.strip()
-        body, proto_left = proto_left.split("}", 1)
-        fields = body.split(";")[:-1]
-        type_var_pairs = []
-        for field in fields:
-            type_var_pair = field.strip().split()
-            if len(type_var_pair) == 1:
-                idx = type_var_pair[0].find("]")
-                type_name = type_var_pair[0][0:idx+1]
-                variable_name = type_var_pair[0][idx+1:]
-                type_var_pair = [type_name, variable_name]
-            type_var_pairs.append(type_var_pair)
-        proto_left = proto_left.split(";", 1)[1].strip()
-        parsed_struct = ParsedStruct(name, type_var_pairs)
-        return parsed_struct, proto_left
+        parsed_struct = ParsedStruct(name, [])
+        parsed_struct.fields = [tuple(field) for field in fields]
+        return parsed_struct
+
+    @staticmethod
+    def parse_protocol(proto: str) -> list:
+        """
+        Read every struct of the proto in a single left-to-right scan
+        """
+        parsed_structs = []
+        pos = 0
+        while pos < len(proto):
+            match = struct_pattern.match(proto, pos)
+            if match is None:
+                raise ValueError("Syntax error at line {}: expect a struct".format(
+                    ParsedStruct.line_number(proto, pos)))
+            name, body = match.groups()
+            fields = body.split(";")
+            if fields[-1].strip():
+                raise ValueError("Syntax error at line {}: missing ';' in struct {}".format(
+                    ParsedStruct.line_number(proto, match.end(2)), name))
+            type_var_pairs = []
+            for field in fields[:-1]:
+                field_match = field_pattern.fullmatch(field.strip())
+                if field_match is None:
+                    raise ValueError("Syntax error in struct {}: invalid field {!r}".format(
+                        name, field.strip()))
+                type_name, list_suffix, var_name = field_match.groups()
+                if list_suffix is not None:
+                    type_name += "".join(list_suffix.split())
+                type_var_pairs.append((type_name, var_name))
+            parsed_structs.append(ParsedStruct(name, type_var_pairs))
+            pos = match.end()
+        return parsed_structs
+
+    @staticmethod
+    def line_number(proto: str, pos: int) -> int:
+        pos += len(proto[pos:]) - len(proto[pos:].lstrip())
+        return proto.count("\n", 0, pos) + 1
 
     def __str__(self):
         s_name = "Struct name: {}".format(self.name)
@@ -57,8 +87,5 @@ class ParsedStruct:
 if __name__ == "__main__":
     with open("player.proto") as f:
         proto = f.read()
-    protocol = []
-    while len(proto) > 0:
-        parsed_struct, proto = ParsedStruct.parse_struct(proto)
-        protocol.append(parsed_struct)
+    protocol = ParsedStruct.parse_protocol(proto)
     print(protocol)
\ No newline at end of file
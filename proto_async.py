@@ -0,0 +1,220 @@
+import asyncio
+
+from codec_plan import record_length_codec
+from proto_parser import ProtoParser
+
+
+class AsyncProtoWriter:
+    """
+    Write records of one struct to an asyncio StreamWriter.
+    Plain records use the stream format of ProtoWriter: fixed-size structs
+    back to back, other structs prefixed by their uint32 size. With
+    `compressed`, every record is the uint32-prefixed output of
+    `ProtoParser.dumpComp`.
+    Records are batched in a buffer, sent when it reaches `batch_size`,
+    and every send waits for the transport to drain, which applies the
+    backpressure of the peer. The StreamWriter is not closed by `close`.
+    """
+    BATCH_SIZE = 1 << 16
+
+    def __init__(self, proto_parser: ProtoParser, strucut_name: str,
+                 writer: asyncio.StreamWriter, compressed: bool = False,
+                 canonical: bool = False, binary: bool = False,
+                 batch_size: int = BATCH_SIZE):
+        self.proto_parser = proto_parser
+        self.strucut_name = strucut_name
+        self.writer = writer
+        self.plan = proto_parser.plans[strucut_name]
+        self.compressed = compressed
+        self.canonical = canonical
+        self.binary = binary
+        self.batch_size = batch_size
+        self.buffer = bytearray()
+
+    def encode(self, obj_data: dict) -> None:
+        """
+        Append the framed record to the buffer without sending it
+        """
+        if self.compressed:
+            payload = self.proto_parser.dumpComp(self.strucut_name, obj_data,
+                                                 self.canonical, self.binary)
+        else:
+            payload = self.proto_parser.dump_bytes(self.strucut_name, obj_data)
+            if self.plan.codec is not None:
+                self.buffer += payload
+                return
+        self.buffer += record_length_codec.pack(len(payload))
+        self.buffer += payload
+
+    async def write(self, obj_data: dict) -> None:
+        self.encode(obj_data)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def write_many(self, objs) -> None:
+        for obj_data in objs:
+            self.encode(obj_data)
+            if len(self.buffer) >= self.batch_size:
+                await self.flush()
+
+    async def flush(self) -> None:
+        if self.buffer:
+            self.writer.write(bytes(self.buffer))
+            self.buffer.clear()
+        await self.writer.drain()
+
+    async def close(self) -> None:
+        await self.flush()
+
+
+class AsyncProtoReader:
+    """
+    Incrementally decode the records written by AsyncProtoWriter (or
+    ProtoWriter, when not `compressed`) from an asyncio StreamReader:
+    `async for obj_data in reader`.
+    Every read of up to `readahead` bytes decodes the records it completes
+    as one batch. A batch larger than `offload_size` bytes is decoded in
+    `executor` (the default executor of the loop if None), so large
+    decodes do not block the event loop.
+    """
+    READAHEAD = 1 << 16
+    OFFLOAD_SIZE = 1 << 18
+
+    def __init__(self, proto_parser: ProtoParser, strucut_name: str,
+                 reader: asyncio.StreamReader, compressed: bool = False,
+                 canonical: bool = False, binary: bool = False, record: bool = False,
+                 readahead: int = READAHEAD, offload_size: int = OFFLOAD_SIZE,
+                 executor=None):
+        self.proto_parser = proto_parser
+        self.strucut_name = strucut_name
+        self.reader = reader
+        self.plan = proto_parser.plans[strucut_name]
+        self.compressed = compressed
+        self.canonical = canonical
+        self.binary = binary
+        self.record = record
+        self.readahead = readahead
+        self.offload_size = offload_size
+        self.executor = executor
+        self.pending = bytearray()  # start of the next, incomplete record
+        self.num_need = 0  # number of bytes missing to complete it
+
+    def decode_batch(self, payloads: list) -> list:
+        proto_parser = self.proto_parser
+        if self.compressed:
+            return [proto_parser.loadComp(self.strucut_name, bytes(payload), self.canonical,
+                                          self.binary, self.record)
+                    for payload in payloads]
+        objs = []
+        for payload in payloads:
+            obj_data, idx_end = proto_parser.load_struct(self.strucut_name, payload, 0,
+                                                         self.record)
+            if idx_end != len(payload):
+                raise ValueError("Record size {} does not match decoded size {}".format(
+                    len(payload), idx_end))
+            objs.append(obj_data)
+        return objs
+
+    def split(self, data: bytes, offset: int) -> tuple:
+        """
+        Cut the complete records of `data` from `offset`. Return their
+        payloads, the offset of the first incomplete record and the number
+        of bytes it still misses.
+        """
+        data_view = memoryview(data)
+        payloads = []
+        codec = self.plan.codec if not self.compressed else None
+        while True:
+            if codec is not None:
+                idx_r = offset + codec.size
+                if idx_r > len(data):
+                    return payloads, offset, idx_r - len(data)
+                payloads.append(data_view[offset:idx_r])
+            else:
+                idx_l = offset + record_length_codec.size
+                if idx_l > len(data):
+                    return payloads, offset, idx_l - len(data)
+                idx_r = idx_l + record_length_codec.unpack_from(data, offset)[0]
+                if idx_r > len(data):
+                    return payloads, offset, idx_r - len(data)
+                payloads.append(data_view[idx_l:idx_r])
+            offset = idx_r
+
+    async def read_batch(self) -> list:
+        """
+        Return the next batch of records, or an empty list at the end of
+        the stream
+        """
+        data = self.pending
+        while True:
+            chunk = await self.reader.read(max(self.readahead, self.num_need))
+            if not chunk:
+                if data:
+                    raise ValueError("Truncated record: {} trailing bytes".format(len(data)))
+                return []
+            data += chunk
+            payloads, offset, self.num_need = self.split(data, 0)
+            if payloads:
+                break
+        self.pending = data[offset:]
+        if offset > self.offload_size:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.decode_batch, payloads)
+        return self.decode_batch(payloads)
+
+    async def __aiter__(self):
+        while True:
+            objs = await self.read_batch()
+            if not objs:
+                return
+            for obj_data in objs:
+                yield obj_data
+
+    async def read_all(self) -> list:
+        return [obj_data async for obj_data in self]
+
+
+if __name__ == "__main__":
+    # exchange records over a local TCP connection
+    async def demo() -> None:
+        proto_parser = ProtoParser()
+        proto_parser.buildDesc("player.proto")
+        objs = [{
+            "name": "骨精灵",
+            "id": idx,
+            "married": False,
+            "friends": tuple(range(idx % 50)),
+            "position": (134.5, 0.0, 23.25),
+            "pet": {"name": "骨精灵的小可爱",
+                    "skill": ({"id": 1, "level": 10}, {"id": 2, "level": 99})}
+        } for idx in range(2000)]
+        for compressed in (False, True):
+            received = []
+            finished = asyncio.Event()
+
+            async def handle(reader, writer):
+                try:
+                    async for obj_data in AsyncProtoReader(proto_parser, "Player", reader,
+                                                           compressed=compressed,
+                                                           canonical=True):
+                        received.append(obj_data)
+                finally:
+                    writer.close()
+                    finished.set()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            proto_writer = AsyncProtoWriter(proto_parser, "Player", writer,
+                                            compressed=compressed, canonical=True)
+            await proto_writer.write_many(objs)
+            await proto_writer.close()
+            writer.close()
+            await writer.wait_closed()
+            await finished.wait()
+            server.close()
+            await server.wait_closed()
+            print("compressed={}: {} records received, identical: {}".format(
+                compressed, len(received), received == objs))
+
+    asyncio.run(demo())
@@ -0,0 +1,262 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from bitarray import BitArray
+from huffman import Huffman
+from proto_parser import ProtoParser
+
+proto_dir = os.path.dirname(os.path.abspath(__file__))
+
+# workloads: (proto file, struct, record generator arguments)
+workloads = {
+    "simple_tiny": ("simple.proto", "Player", {"num_friend": 0, "name_size": 1}),
+    "simple_small": ("simple.proto", "Player", {"num_friend": 8, "name_size": 8}),
+    "player_tiny": ("player.proto", "Player", {"num_friend": 0, "name_size": 1}),
+    "player_small": ("player.proto", "Player", {"num_friend": 8, "name_size": 8}),
+    "player_large": ("player.proto", "Player", {"num_friend": 2000, "name_size": 64}),
+    "player_huge": ("player.proto", "Player", {"num_friend": 60000, "name_size": 1000}),
+}
+# text of the repeated name, mixing ASCII and multi-byte UTF-8
+name_chars = "骨精灵abcdefgh"
+
+
+def make_name(rng: random.Random, size: int) -> str:
+    return "".join(rng.choice(name_chars) for _ in range(size))
+
+
+def make_player(rng: random.Random, strucut_name: str, proto_parser: ProtoParser,
+                num_friend: int, name_size: int) -> dict:
+    """
+    Synthetic record shaped like the Player of player.proto or simple.proto
+    """
+    obj_data = {
+        "name": make_name(rng, name_size),
+        "id": rng.randrange(1 << 31),
+        "married": rng.random() < 0.5,
+        "friends": tuple(rng.randrange(1 << 31) for _ in range(num_friend)),
+        "position": tuple(float(rng.randrange(-4096, 4096)) / 4 for _ in range(3)),
+    }
+    if "pet" in proto_parser.plans[strucut_name].field_index:
+        obj_data["pet"] = {
+            "name": make_name(rng, max(1, name_size // 2)),
+            "skill": tuple({"id": rng.randrange(1 << 31), "level": rng.randrange(1 << 16)}
+                           for _ in range(2)),
+        }
+    return obj_data
+
+
+def measure(func, min_time: float) -> tuple:
+    """
+    Call `func` until `min_time` seconds have passed, at least once.
+    Return the number of calls and the elapsed seconds.
+    """
+    gc.collect()
+    num_call = 0
+    batch = 1
+    elapsed = 0.0
+    while elapsed < min_time:
+        start = time.perf_counter()
+        for _ in range(batch):
+            func()
+        elapsed += time.perf_counter() - start
+        num_call += batch
+        batch *= 2
+    return num_call, elapsed
+
+
+def measure_peak(func) -> int:
+    """
+    Peak memory in bytes allocated by one call of `func`
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class ProtoBenchmark:
+    """
+    Benchmark the codec, compression, BitArray and Huffman paths on
+    synthetic workloads. Every case reports ops/sec, MB/s of its input,
+    the peak memory of one call and, for compression, the ratio of the
+    compressed size to the serialized size.
+    """
+    MIN_TIME = 0.2
+
+    def __init__(self, min_time: float = MIN_TIME, seed: int = 0,
+                 names: list | None = None, memory: bool = True):
+        self.min_time = min_time
+        self.seed = seed
+        self.names = names if names is not None else list(workloads)
+        self.memory = memory
+        self.parsers = {}
+        self.results = []
+
+    def parser(self, filename: str) -> ProtoParser:
+        if filename not in self.parsers:
+            proto_parser = ProtoParser()
+            proto_parser.buildDesc(os.path.join(proto_dir, filename))
+            self.parsers[filename] = proto_parser
+        return self.parsers[filename]
+
+    def run_case(self, workload: str, case: str, func, num_byte: int, **extra) -> dict:
+        num_call, elapsed = measure(func, self.min_time)
+        result = {
+            "workload": workload,
+            "case": case,
+            "bytes": num_byte,
+            "calls": num_call,
+            "seconds": elapsed,
+            "ops_per_sec": num_call / elapsed,
+            "mb_per_sec": num_call * num_byte / elapsed / 1e6,
+        }
+        if self.memory:
+            result["peak_memory"] = measure_peak(func)
+        result.update(extra)
+        self.results.append(result)
+        return result
+
+    def bench_workload(self, workload: str) -> None:
+        filename, strucut_name, kwargs = workloads[workload]
+        proto_parser = self.parser(filename)
+        rng = random.Random(self.seed)
+        obj_data = make_player(rng, strucut_name, proto_parser, **kwargs)
+        obj_bytes = proto_parser.dump_bytes(strucut_name, obj_data)
+        obj_hex = obj_bytes.hex()
+        num_byte = len(obj_bytes)
+        self.run_case(workload, "dumps", lambda: proto_parser.dumps(strucut_name, obj_data),
+                      num_byte)
+        self.run_case(workload, "loads", lambda: proto_parser.loads(strucut_name, obj_hex),
+                      num_byte)
+        self.run_case(workload, "dump_bytes",
+                      lambda: proto_parser.dump_bytes(strucut_name, obj_data), num_byte)
+        self.run_case(workload, "load_bytes",
+                      lambda: proto_parser.load_bytes(strucut_name, obj_bytes), num_byte)
+        for canonical in (False, True):
+            for binary in (False, True):
+                suffix = "{}{}".format("_canonical" if canonical else "",
+                                       "_binary" if binary else "")
+                data_compressed = proto_parser.dumpComp(strucut_name, obj_data,
+                                                        canonical, binary)
+                # the compressed input is the hex text unless binary
+                num_input = num_byte if binary else 2 * num_byte
+                ratio = len(data_compressed) / num_input
+                self.run_case(workload, "dumpComp" + suffix,
+                              lambda: proto_parser.dumpComp(strucut_name, obj_data,
+                                                            canonical, binary),
+                              num_byte, compressed_bytes=len(data_compressed),
+                              compression_ratio=ratio)
+                self.run_case(workload, "loadComp" + suffix,
+                              lambda: proto_parser.loadComp(strucut_name, data_compressed,
+                                                            canonical, binary),
+                              num_byte, compressed_bytes=len(data_compressed),
+                              compression_ratio=ratio)
+        self.bench_huffman(workload, obj_hex)
+        self.bench_bitarray(workload, num_byte * 8)
+
+    def bench_huffman(self, workload: str, text_input: str) -> None:
+        num_byte = len(text_input)
+        huffman_tree = Huffman.build_tree(text_input)
+        dict_code = Huffman.get_codes(huffman_tree)
+        text_encode = Huffman.encode_input(dict_code, text_input)
+
+        def decode():
+            text_encode.reset_read_head()
+            Huffman.decode_input(huffman_tree, text_encode)
+
+        self.run_case(workload, "huffman_build_tree",
+                      lambda: Huffman.build_tree(text_input), num_byte)
+        self.run_case(workload, "huffman_encode",
+                      lambda: Huffman.encode_input(dict_code, text_input), num_byte)
+        self.run_case(workload, "huffman_decode", decode, num_byte,
+                      compression_ratio=len(text_encode) / 8 / num_byte)
+
+    def bench_bitarray(self, workload: str, num_bit: int) -> None:
+        # 13-bit fields exercise values straddling byte boundaries
+        num_value = max(1, num_bit // 13)
+        bit_array = BitArray()
+        for idx in range(num_value):
+            bit_array.write_bits(idx & 0x1FFF, 13)
+
+        def write():
+            bit_array_w = BitArray()
+            for idx in range(num_value):
+                bit_array_w.write_bits(idx & 0x1FFF, 13)
+
+        def read():
+            bit_array.reset_read_head()
+            for _ in range(num_value):
+                bit_array.read_bits(13)
+
+        num_byte = (num_value * 13 + 7) // 8
+        self.run_case(workload, "bitarray_write_bits", write, num_byte)
+        self.run_case(workload, "bitarray_read_bits", read, num_byte)
+
+    def run(self) -> dict:
+        for workload in self.names:
+            self.bench_workload(workload)
+        return {
+            "python": sys.version,
+            "implementation": sys.implementation.name,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "min_time": self.min_time,
+            "seed": self.seed,
+            "results": self.results,
+        }
+
+
+def compare(baseline: dict, current: dict) -> list:
+    """
+    Speedup of `current` over `baseline` (ops/sec ratio) for every case of both runs
+    """
+    baseline_ops = {(result["workload"], result["case"]): result["ops_per_sec"]
+                    for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        key = (result["workload"], result["case"])
+        if key in baseline_ops:
+            rows.append((key[0], key[1], result["ops_per_sec"] / baseline_ops[key]))
+    return rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark ProtoParser")
+    arg_parser.add_argument("workloads", nargs="*",
+                            help="workloads to run, all by default: " + ", ".join(workloads))
+    arg_parser.add_argument("--min-time", type=float, default=ProtoBenchmark.MIN_TIME,
+                            help="minimum seconds spent on each case")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--no-memory", action="store_true",
+                            help="skip the peak memory measurements")
+    arg_parser.add_argument("--output", help="write the results to this JSON file")
+    arg_parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    args = arg_parser.parse_args()
+    for workload in args.workloads:
+        if workload not in workloads:
+            arg_parser.error("unknown workload: {}".format(workload))
+
+    benchmark = ProtoBenchmark(args.min_time, args.seed, args.workloads or None,
+                               not args.no_memory)
+    report = benchmark.run()
+    for result in report["results"]:
+        print("{:<14s} {:<28s} {:>12.1f} ops/s {:>9.2f} MB/s".format(
+            result["workload"], result["case"], result["ops_per_sec"], result["mb_per_sec"]))
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="UTF-8") as f:
+            baseline = json.load(f)
+        for workload, case, speedup in compare(baseline, report):
+            print("{:<14s} {:<28s} {:>6.2f}x".format(workload, case, speedup))
@@ -0,0 +1,89 @@
+import functools
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+import codec_plan
+import codegen
+import record_class
+from parsed_strucut import ParsedStruct
+
+
+@functools.lru_cache(maxsize=None)
+def generator_key() -> str:
+    """
+    SHA-256 of the sources the generated codec depends on, so that cached
+    code is not reused once the generator changes
+    """
+    digest = hashlib.sha256()
+    for module in (codegen, codec_plan, record_class):
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ProtoCache:
+    """
+    On-disk cache of compiled protocol descriptors, keyed by the SHA-256 of
+    the .proto file content and the compact mode of the parser. An entry
+    holds the parsed structs and, optionally, the compiled code object of
+    the generated codec; it is written with `marshal`, so it is only read
+    back by the same Python version, and only by the codec generator that
+    wrote it (see `generator_key`). Entries are replaced atomically,
+    several processes may share a cache directory.
+    """
+    MAGIC = b"PPDC"
+    VERSION = 2
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.generator = generator_key()
+
+    @staticmethod
+    def content_key(content: bytes, compact=False) -> str:
+        digest = hashlib.sha256(content)
+        if compact:
+            # the generated codec depends on the structs in compact mode
+            compact = compact if compact is True else sorted(compact)
+            digest.update(repr(compact).encode("UTF-8"))
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".ppc")
+
+    def load(self, key: str):
+        """
+        Return (parsed_structs, code) of the entry, code being None if the
+        codec was not cached, or None if there is no usable entry
+        """
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if data[:len(self.MAGIC)] != self.MAGIC:
+            return None
+        try:
+            version, cache_tag, generator, structs, code = marshal.loads(data[len(self.MAGIC):])
+        except (EOFError, ValueError, TypeError):
+            return None
+        if (version != self.VERSION or cache_tag != sys.implementation.cache_tag
+                or generator != self.generator):
+            return None
+        return [ParsedStruct.from_fields(name, fields) for name, fields in structs], code
+
+    def save(self, key: str, parsed_structs: list, code=None) -> None:
+        structs = [(parsed_struct.name, parsed_struct.fields) for parsed_struct in parsed_structs]
+        data = self.MAGIC + marshal.dumps(
+            (self.VERSION, sys.implementation.cache_tag, self.generator, structs, code))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, self.path(key))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
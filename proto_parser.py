@@ -1,126 +1,727 @@
+import marshal
+from operator import getitem
 import struct
-from huffman import Huffman
+import types
+from huffman import Huffman, HuffmanModel
 from parsed_strucut import ParsedStruct
-
-basic_structures = {
-    "int8": ("b", 1),
-    "uint8": ("B", 1),
-    "int16": ("h", 2),
-    "uint16": ("H", 2),
-    "int32": ("i", 4),
-    "uint32": ("I", 4),
-    "float": ("f", 4),
-    "double": ("d", 8),
-    "bool": ("?", 1)
-}
+from struct_view import StructView
+from record_class import Record, make_record_class
+from codegen import StructCodegen
+from compact_codec import CompactCodec
+from proto_cache import ProtoCache
+from proto_profile import ProtoProfiler, timed_stage
+from codec_plan import (StructPlan, basic_structures, length_codec,
+                        record_length_codec, scalar_layouts, flatten, unflatten,
+                        numpy_dtype, np)
 
 
 class ProtoParser:
-    def __init__(self) -> None:
+    def __init__(self, codegen: bool = True, compact=False) -> None:
+        """
+        With `codegen`, `buildDesc` generates and compiles specialized
+        codec functions for every struct (see codegen.StructCodegen),
+        otherwise the generic codec interprets the plans.
+        `compact` selects the compact wire format (see
+        compact_codec.CompactCodec) for every struct if True, or for the
+        structs of a given collection of names.
+        """
         self.protocol = {}
+        self.plans = {}
+        self.record_classes = {}
+        self.codegen = codegen
+        self.compact = compact if isinstance(compact, bool) else frozenset(compact)
+        self.compact_codec = CompactCodec(self)
+        self.profiler = None
+        self.codegen_source = None
+        self.codegen_code = None
+        self.huffman_models = {}  # {model_id: HuffmanModel}
+        self.struct_models = {}  # {strucut_name: HuffmanModel}
+
+    def buildDesc(self, filename, cache_dir: str | None = None):
+        """
+        Parse the .proto file and compile its structs.
+        With `cache_dir`, the parsed structs and the compiled codec are
+        cached there (see proto_cache.ProtoCache) and reused as long as
+        the file content does not change.
+        """
+        with open(filename, "rb") as f:
+            content = f.read()
+        cached = None
+        if cache_dir is not None:
+            cache = ProtoCache(cache_dir)
+            key = cache.content_key(content, self.compact)
+            cached = cache.load(key)
+        if cached is None:
+            parsed_structs = ParsedStruct.parse_protocol(content.decode("UTF-8"))
+            code = None
+        else:
+            parsed_structs, code = cached
+        code_compiled = self.load_protocol(parsed_structs, code)
+        # the cached codec covers this file only, not structs of previous files
+        own_codec = len(self.protocol) == len(parsed_structs)
+        if cache_dir is not None and (
+                cached is None or own_codec and code is None and code_compiled is not None):
+            cache.save(key, parsed_structs, code_compiled if own_codec else None)
+
+    def load_protocol(self, parsed_structs: list, code=None):
+        """
+        Add the parsed structs to the protocol and compile it. `code` is the
+        compiled codec of exactly these structs, if already known.
+        Return the compiled codec, or None without codegen.
+        A struct cannot be defined twice, in the same file or across files.
+        If the structs are rejected, the parser is left unchanged.
+        """
+        protocol = dict(self.protocol)
+        for parsed_struct in parsed_structs:
+            if parsed_struct.name in protocol:
+                raise ValueError("Duplicate struct {}".format(parsed_struct.name))
+            protocol[parsed_struct.name] = parsed_struct
+        self.plans = StructPlan.compile_protocol(protocol, self.compact)
+        self.protocol = protocol
+        self.record_classes = {}
+        self.codegen_code = None
+        if len(self.protocol) != len(parsed_structs):
+            code = None
+        if not self.codegen:
+            return None
+        return self.compile_codegen(code)
 
-    def buildDesc(self, filename):
-        with open(filename) as f:
-            str_proto = f.read()
-        while len(str_proto) > 0:
-            parsed_struct, str_proto = ParsedStruct.parse_struct(
-                str_proto)
-            self.protocol[parsed_struct.name] = parsed_struct
+    def __getstate__(self) -> dict:
+        """
+        A parser is pickled as its compiled protocol: the parsed structs,
+        the compiled codec and the registered Huffman models. The codec is
+        marshalled, so it can only be unpickled by the same Python version,
+        as in the workers of a process pool.
+        """
+        return {
+            "structs": [(name, parsed_struct.fields)
+                        for name, parsed_struct in self.protocol.items()],
+            "codegen": self.codegen,
+            "compact": self.compact,
+            "codegen_code": (marshal.dumps(self.codegen_code)
+                             if self.codegen_code is not None else None),
+            "huffman_models": [model.to_bytes() for model in self.huffman_models.values()],
+            "struct_models": {name: model.model_id for name, model in self.struct_models.items()},
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["codegen"], state["compact"])
+        code = state["codegen_code"]
+        self.load_protocol([ParsedStruct.from_fields(name, fields)
+                            for name, fields in state["structs"]],
+                           marshal.loads(code) if code is not None else None)
+        for model_bytes in state["huffman_models"]:
+            model = HuffmanModel.from_bytes(model_bytes)
+            self.huffman_models[model.model_id] = model
+        for name, model_id in state["struct_models"].items():
+            self.struct_models[name] = self.huffman_models[model_id]
+
+    def compile_codegen(self, code=None):
+        """
+        Generate the source of the specialized codecs and compile it, unless
+        the compiled `code` is given. Return the compiled code.
+        """
+        if code is None:
+            self.codegen_source = StructCodegen(self.plans).generate()
+            code = compile(self.codegen_source, "<proto_codegen>", "exec")
+        else:
+            self.codegen_source = None
+        module = types.ModuleType("proto_codegen")
+        exec(code, module.__dict__)
+        self.install_codegen(module)
+        self.codegen_code = code
+        return code
+
+    def write_codegen(self, filename: str) -> None:
+        """
+        Write the generated codec module to `filename`, so it can be imported
+        and passed to `install_codegen` instead of generated again
+        """
+        if self.codegen_source is None:
+            self.codegen_source = StructCodegen(self.plans).generate()
+        with open(filename, "w", encoding="UTF-8") as f:
+            f.write(self.codegen_source)
+
+    def install_codegen(self, module) -> None:
+        """
+        Use the codec functions of a generated module
+        """
+        if set(module.encode_funcs) != set(StructCodegen.codegen_structs(self.plans)):
+            raise ValueError("Generated codec does not match the protocol")
+        for name in module.encode_funcs:
+            plan = self.plans[name]
+            plan.size_func = module.size_funcs[name]
+            plan.encode_func = module.encode_funcs[name]
+            plan.size_record_func = module.size_record_funcs[name]
+            plan.encode_record_func = module.encode_record_funcs[name]
+            plan.decode_func = module.decode_funcs[name]
+            plan.decode_record_func = module.decode_record_funcs[name]
+        self.record_classes = module.record_classes
+
+    def enable_profiling(self, profiler: ProtoProfiler | None = None,
+                         callback=None) -> ProtoProfiler:
+        """
+        Record per-struct, per-field and per-stage counters and timings in
+        `profiler`, or in a new ProtoProfiler calling `callback`.
+        Return the profiler; see `ProtoProfiler.snapshot`.
+        """
+        self.profiler = profiler if profiler is not None else ProtoProfiler(callback)
+        return self.profiler
+
+    def disable_profiling(self) -> None:
+        self.profiler = None
+
+    def fixed_size(self, strucut_name: str) -> int | None:
+        """
+        Encoded size of the struct if it does not depend on the data, else None
+        """
+        plan = self.plans[strucut_name]
+        return plan.codec.size if plan.codec is not None else None
+
+    def record_class(self, strucut_name: str) -> type:
+        """
+        Record class (see record_class.Record) generated for the struct
+        """
+        if strucut_name not in self.record_classes:
+            self.record_classes[strucut_name] = make_record_class(
+                strucut_name, self.plans[strucut_name].field_names)
+        return self.record_classes[strucut_name]
 
     def dumps(self, strucut_name: str, obj_data: dict) -> str:
-        data_b = self.serialize_struct(obj_data, strucut_name)
-        return data_b.hex()
+        return self.dump_bytes(strucut_name, obj_data).hex()
+
+    def loads(self, strucut_name: str, serialized_data: str, record: bool = False) -> dict:
+        return self.load_bytes(strucut_name, bytes.fromhex(serialized_data), record)
 
-    def loads(self, strucut_name: str, serialized_data: str) -> dict:
-        self.data_s = bytes.fromhex(serialized_data)
-        rst = self.load_struct(strucut_name)
-        if len(self.data_s) != 0:
+    def dump_bytes(self, strucut_name: str, obj_data: dict) -> bytes:
+        return self.serialize_struct(obj_data, strucut_name)
+
+    def dump_into(self, strucut_name: str, obj_data: dict, buffer, offset: int = 0) -> int:
+        """
+        Serialize the object into the writable `buffer` at `offset`.
+        Return the offset right after the written data.
+        """
+        idx_r = offset + self.calc_size(obj_data, strucut_name)
+        if idx_r > len(buffer):
+            raise ValueError("Buffer too small: need {} bytes, got {}".format(
+                idx_r, len(buffer)))
+        return self.serialize_into(obj_data, strucut_name, buffer, offset)
+
+    def load_bytes(self, strucut_name: str, serialized_data, record: bool = False) -> dict:
+        """
+        Deserialize the object from bytes-like `serialized_data`.
+        With `record`, structs are returned as generated records instead of dicts.
+        """
+        data = memoryview(serialized_data)
+        rst, offset = self.load_struct(strucut_name, data, 0, record)
+        if offset != len(data):
             print("serialized_data has not been read completely")
         return rst
 
+    def load_lazy(self, strucut_name: str, serialized_data, offset: int = 0) -> StructView:
+        """
+        Return a lazy view of the struct serialized in bytes-like
+        `serialized_data` at `offset`; fields are decoded when accessed
+        """
+        return StructView(self, strucut_name, memoryview(serialized_data), offset)
+
+    def dumps_many(self, strucut_name: str, objs) -> bytes:
+        """
+        Serialize a sequence of objects of the same struct into one stream.
+        Fixed-size structs are written back to back with a fixed stride,
+        other structs are prefixed by their uint32 size.
+        """
+        objs = list(objs)
+        plan = self.plans[strucut_name]
+        codec = plan.codec
+        if codec is not None:
+            buffer = bytearray(codec.size * len(objs))
+            offset = 0
+            if plan.flat_names is not None:
+                names = plan.flat_names
+                for obj in objs:
+                    get = getattr if isinstance(obj, Record) else getitem
+                    codec.pack_into(buffer, offset, *[get(obj, name) for name in names])
+                    offset += codec.size
+            else:
+                layout = plan.layout
+                for obj in objs:
+                    values = []
+                    flatten(layout, obj, values)
+                    codec.pack_into(buffer, offset, *values)
+                    offset += codec.size
+            return bytes(buffer)
+        sizes = [self.calc_size(obj, strucut_name) for obj in objs]
+        buffer = bytearray(sum(sizes) + record_length_codec.size * len(objs))
+        offset = 0
+        for obj, size in zip(objs, sizes):
+            record_length_codec.pack_into(buffer, offset, size)
+            offset = self.serialize_into(obj, strucut_name, buffer,
+                                         offset + record_length_codec.size)
+        return bytes(buffer)
+
+    def loads_many(self, strucut_name: str, serialized_data, record: bool = False) -> list:
+        """
+        Deserialize a stream written by `dumps_many`
+        """
+        data = memoryview(serialized_data)
+        plan = self.plans[strucut_name]
+        codec = plan.codec
+        if codec is not None:
+            if len(data) % codec.size:
+                raise ValueError("Serialized data of {} bytes is not a multiple of "
+                                 "the record size {}".format(len(data), codec.size))
+            if plan.flat_names is not None:
+                if record:
+                    cls = self.record_class(strucut_name)
+                    return [cls(*values) for values in codec.iter_unpack(data)]
+                names = plan.flat_names
+                return [dict(zip(names, values)) for values in codec.iter_unpack(data)]
+            layout = plan.layout
+            record_class = self.record_class if record else None
+            return [unflatten(layout, values, 0, record_class)[0]
+                    for values in codec.iter_unpack(data)]
+        objs = []
+        offset = 0
+        while offset < len(data):
+            size = record_length_codec.unpack_from(data, offset)[0]
+            offset += record_length_codec.size
+            obj, idx_r = self.load_struct(strucut_name, data, offset, record)
+            if idx_r - offset != size:
+                raise ValueError("Record size {} does not match decoded size {}".format(
+                    size, idx_r - offset))
+            offset = idx_r
+            objs.append(obj)
+        return objs
+
+    def get_dtype(self, type_name: str):
+        """
+        Numpy dtype of a basic type or of a fixed-size struct
+        """
+        if type_name in basic_structures:
+            return numpy_dtype(scalar_layouts[basic_structures[type_name][0]])
+        layout = self.plans[type_name].layout
+        if layout is None:
+            raise ValueError("Struct {} is not fixed-size".format(type_name))
+        return numpy_dtype(layout)
+
+    def loads_array(self, type_name: str, serialized_data):
+        """
+        View a fixed-stride stream (as written by `dumps_many` or
+        `dumps_array`) as a numpy structured array without copying
+        """
+        return np.frombuffer(serialized_data, dtype=self.get_dtype(type_name))
+
+    def dumps_array(self, type_name: str, array) -> bytes:
+        """
+        Serialize a numpy (structured) array into a fixed-stride stream
+        """
+        return np.ascontiguousarray(array, dtype=self.get_dtype(type_name)).tobytes()
+
+    def load_list_array(self, type_name: str, list_size: int, data, offset: int = 0) -> tuple:
+        """
+        Same as `load_list`, but return a zero-copy numpy array view
+        """
+        dtype = self.get_dtype(type_name)
+        if not list_size:
+            list_size = length_codec.unpack_from(data, offset)[0]
+            offset += length_codec.size
+        array = np.frombuffer(data, dtype=dtype, count=list_size, offset=offset)
+        return array, offset + dtype.itemsize * list_size
+
     def serialize_struct(self, obj_data, type_name: str) -> bytes:
+        buffer = bytearray(self.calc_size(obj_data, type_name))
+        self.serialize_into(obj_data, type_name, buffer, 0)
+        return bytes(buffer)
+
+    def serialize_list(self, list_data, type_name: str, list_size: int) -> bytes:
+        buffer = bytearray(self.calc_list_size(list_data, type_name, list_size))
+        self.serialize_list_into(list_data, type_name, list_size, buffer, 0)
+        return bytes(buffer)
+
+    def calc_size(self, obj_data, type_name: str) -> int:
+        """
+        Compute the size in bytes of the serialized object
+        """
+        if type_name == "string":
+            if obj_data.isascii():
+                return 2 + len(obj_data)
+            return 2 + len(obj_data.encode(encoding="UTF-8", errors="strict"))
+        elif type_name in basic_structures:
+            return basic_structures[type_name][1]
+        elif type_name in self.plans:
+            return self.calc_plan_size(obj_data, self.plans[type_name])
+        else:
+            raise KeyError("Unrecognized strucut name: {}".format(type_name))
+
+    def calc_plan_size(self, obj_data, plan: StructPlan) -> int:
+        if plan.codec is not None:
+            return plan.static_size
+        if plan.size_func is not None:
+            if type(obj_data) is dict:
+                return plan.size_func(obj_data)
+            if isinstance(obj_data, Record):
+                try:
+                    return plan.size_record_func(obj_data)
+                except AttributeError:
+                    pass  # a record holding dicts: read by the interpreter
+        if plan.compact:
+            return self.compact_codec.calc_size(obj_data, plan)
+        size = plan.static_size
+        get = getattr if isinstance(obj_data, Record) else getitem
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "fixed":
+                continue
+            elif kind == "list":
+                size += self.calc_list_step_size(get(obj_data, step[1]), step)
+            elif kind == "string":
+                size += self.calc_size(get(obj_data, step[1]), "string")
+            else:
+                size += self.calc_plan_size(get(obj_data, step[1]), step[3])
+        return size
+
+    def list_step(self, type_name: str, list_size: int) -> tuple:
+        """
+        Resolved "list" step (see StructPlan) of a list of `type_name`
+        """
+        if (type_name != "string" and type_name not in basic_structures
+                and type_name not in self.plans):
+            raise KeyError("Unrecognized strucut name: {}".format(type_name))
+        return ("list", None, type_name, list_size, self.plans.get(type_name),
+                basic_structures.get(type_name))
+
+    def calc_list_size(self, list_data, type_name: str, list_size: int) -> int:
+        return self.calc_list_step_size(list_data, self.list_step(type_name, list_size))
+
+    def calc_list_step_size(self, list_data, step: tuple) -> int:
+        list_size, plan, basic = step[3], step[4], step[5]
+        size = 0 if list_size else length_codec.size
+        if basic is not None:
+            return size + basic[1] * len(list_data)
+        if plan is None:
+            for item in list_data:
+                size += self.calc_size(item, "string")
+            return size
+        if plan.codec is not None:
+            return size + plan.codec.size * len(list_data)
+        for item in list_data:
+            size += self.calc_plan_size(item, plan)
+        return size
+
+    def serialize_into(self, obj_data, type_name: str, buffer, offset: int) -> int:
+        """
+        Write the serialized object into `buffer` at `offset`, which must
+        have room for `calc_size` bytes.
+        Return the offset right after the written data.
+        """
         if type_name == "string":
             data_b = obj_data.encode(encoding="UTF-8", errors="strict")
             string_size = len(data_b)
-            data_s = struct.pack("<H", string_size) + data_b
-        elif type_name in basic_structures.keys():
-            type_code = basic_structures[type_name][0]
-            data_s = struct.pack("<{:s}".format(type_code), obj_data)
-        elif type_name in self.protocol.keys():
-            fields = self.protocol[type_name].fields
-            data_s = b""
-            for (var_name, type_name_, is_list, list_size) in fields:
-                var_data = obj_data[var_name]
-                if is_list:
-                    data_s += self.serialize_list(var_data,
-                                                  type_name_, list_size)
-                else:
-                    data_s += self.serialize_struct(var_data, type_name_)
+            length_codec.pack_into(buffer, offset, string_size)
+            offset += length_codec.size
+            buffer[offset:offset+string_size] = data_b
+            return offset + string_size
+        elif type_name in basic_structures:
+            type_code, type_size = basic_structures[type_name]
+            struct.pack_into("<{:s}".format(type_code), buffer, offset, obj_data)
+            return offset + type_size
+        elif type_name in self.plans:
+            return self.serialize_plan_into(obj_data, self.plans[type_name], buffer, offset)
         else:
             raise KeyError("Unrecognized strucut name: {}".format(type_name))
-        return data_s
 
-    def serialize_list(self, list_data, type_name: str, list_size: int) -> bytes:
-        data_s = b""
+    def serialize_plan_into(self, obj_data, plan: StructPlan, buffer, offset: int) -> int:
+        if self.profiler is not None:
+            return self.profiler.serialize_plan(self, obj_data, plan, buffer, offset)
+        if plan.encode_func is not None:
+            if type(obj_data) is dict:
+                return plan.encode_func(obj_data, buffer, offset)
+            if isinstance(obj_data, Record):
+                try:
+                    return plan.encode_record_func(obj_data, buffer, offset)
+                except AttributeError:
+                    pass  # a record holding dicts: read by the interpreter
+        if plan.compact:
+            return self.compact_codec.serialize_into(obj_data, plan, buffer, offset)
+        get = getattr if isinstance(obj_data, Record) else getitem
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "fixed":
+                values = []
+                for var_name, layout in step[2]:
+                    flatten(layout, get(obj_data, var_name), values)
+                codec = step[1]
+                codec.pack_into(buffer, offset, *values)
+                offset += codec.size
+            elif kind == "list":
+                offset = self.serialize_list_step_into(get(obj_data, step[1]), step,
+                                                       buffer, offset)
+            elif kind == "string":
+                offset = self.serialize_into(get(obj_data, step[1]), "string",
+                                             buffer, offset)
+            else:
+                offset = self.serialize_plan_into(get(obj_data, step[1]), step[3],
+                                                  buffer, offset)
+        return offset
+
+    def serialize_list_into(self, list_data, type_name: str, list_size: int,
+                            buffer, offset: int) -> int:
+        return self.serialize_list_step_into(list_data, self.list_step(type_name, list_size),
+                                             buffer, offset)
+
+    def serialize_list_step_into(self, list_data, step: tuple, buffer, offset: int) -> int:
+        list_size, plan, basic = step[3], step[4], step[5]
+        num = len(list_data)
         if not list_size:
-            num = len(list_data)
-            data_s += struct.pack("<H".format(num), num)
-        for i in range(len(list_data)):
-            data_s += self.serialize_struct(list_data[i], type_name)
-        return data_s
+            length_codec.pack_into(buffer, offset, num)
+            offset += length_codec.size
+        elif num != list_size:
+            raise ValueError("Expect list of size {}, got {}".format(list_size, num))
+        if basic is not None:
+            type_code, type_size = basic
+            struct.pack_into("<{:d}{:s}".format(num, type_code), buffer, offset,
+                             *list_data)
+            return offset + type_size * num
+        if plan is None:
+            for item in list_data:
+                offset = self.serialize_into(item, "string", buffer, offset)
+            return offset
+        for item in list_data:
+            offset = self.serialize_plan_into(item, plan, buffer, offset)
+        return offset
 
-    def load_struct(self, type_name: str):
+    def load_struct(self, type_name: str, data, offset: int = 0, record: bool = False) -> tuple:
+        """
+        Decode a value of `type_name` from the bytes-like `data` at `offset`.
+        Structs are decoded as dicts, or as generated records with `record`.
+        Return the value and the offset right after it.
+        """
         if type_name == "string":
-            string_size = struct.unpack("<H", self.data_s[:2])[0]
-            idx_r = 2+string_size
-            string_data_bytes = self.data_s[2:idx_r]
-            string_data = string_data_bytes.decode(
-                encoding="UTF-8", errors="strict")
-            self.data_s = self.data_s[idx_r:]
-            return string_data
+            string_size = length_codec.unpack_from(data, offset)[0]
+            offset += length_codec.size
+            idx_r = offset + string_size
+            if idx_r > len(data):
+                raise ValueError("String of {} bytes exceeds serialized data".format(
+                    string_size))
+            string_data = str(data[offset:idx_r], encoding="UTF-8", errors="strict")
+            return string_data, idx_r
         elif type_name in basic_structures.keys():
             type_code, type_size = basic_structures[type_name]
-            idx_r = type_size
-            var_data = struct.unpack("<{:s}".format(
-                type_code), self.data_s[:idx_r])[0]
-            self.data_s = self.data_s[idx_r:]
-            return var_data
-        elif type_name in self.protocol.keys():
-            fields = self.protocol[type_name].fields
-            var_data = {}
-            for (var_name, type_name_, is_list, list_size) in fields:
-                if is_list:
-                    var_data[var_name] = self.load_list(type_name_, list_size)
-                else:
-                    var_data[var_name] = self.load_struct(type_name_)
-            return var_data
+            var_data = struct.unpack_from("<{:s}".format(type_code), data, offset)[0]
+            return var_data, offset + type_size
+        elif type_name in self.plans:
+            return self.load_plan(self.plans[type_name], data, offset, record)
+        else:
+            raise KeyError("Unrecognized strucut name: {}".format(type_name))
+
+    def load_plan(self, plan: StructPlan, data, offset: int = 0, record: bool = False) -> tuple:
+        if self.profiler is not None:
+            return self.profiler.load_plan(self, plan, data, offset, record)
+        decode = plan.decode_record_func if record else plan.decode_func
+        if decode is not None:
+            return decode(data, offset)
+        if plan.compact:
+            return self.compact_codec.load(plan, data, offset, record)
+        record_class = self.record_class if record else None
+        values = []
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "fixed":
+                codec = step[1]
+                flat = codec.unpack_from(data, offset)
+                offset += codec.size
+                idx = 0
+                for _, layout in step[2]:
+                    value, idx = unflatten(layout, flat, idx, record_class)
+                    values.append(value)
+            elif kind == "list":
+                value, offset = self.load_list_step(step, data, offset, record)
+                values.append(value)
+            elif kind == "string":
+                value, offset = self.load_struct("string", data, offset)
+                values.append(value)
+            else:
+                value, offset = self.load_plan(step[3], data, offset, record)
+                values.append(value)
+        if record:
+            return self.record_class(plan.name)(*values), offset
+        return dict(zip(plan.field_names, values)), offset
+
+    def load_list(self, type_name: str, list_size: int, data, offset: int = 0,
+                  record: bool = False) -> tuple:
+        return self.load_list_step(self.list_step(type_name, list_size), data, offset, record)
+
+    def load_list_step(self, step: tuple, data, offset: int = 0, record: bool = False) -> tuple:
+        list_size, plan, basic = step[3], step[4], step[5]
+        if not list_size:
+            list_size = length_codec.unpack_from(data, offset)[0]
+            offset += length_codec.size
+        if basic is not None:
+            type_code, type_size = basic
+            list_data = struct.unpack_from("<{:d}{:s}".format(list_size, type_code),
+                                           data, offset)
+            return list_data, offset + type_size * list_size
+        self.check_list_fit(list_size, plan, data, offset)
+        list_data = []
+        if plan is None:
+            for _ in range(list_size):
+                item, offset = self.load_struct("string", data, offset)
+                list_data.append(item)
+            return tuple(list_data), offset
+        for _ in range(list_size):
+            item, offset = self.load_plan(plan, data, offset, record)
+            list_data.append(item)
+        return tuple(list_data), offset
+
+    def train_model(self, strucut_name: str, objs, model_id: int,
+                    binary: bool = False) -> HuffmanModel:
+        """
+        Train a Huffman model on sample objects of a struct.
+        With `binary`, the model codes the bytes of the binary serialization
+        instead of its hex text.
+        """
+        if binary:
+            corpus = (self.dump_bytes(strucut_name, obj_data) for obj_data in objs)
+            return HuffmanModel.train(model_id, corpus, Huffman.BYTE_ALPHABET)
+        corpus = (self.dumps(strucut_name, obj_data) for obj_data in objs)
+        return HuffmanModel.train(model_id, corpus)
+
+    def register_model(self, strucut_name: str, model: HuffmanModel) -> None:
+        """
+        Compress the struct with `model` from now on.
+        Messages referencing previously registered models can still be loaded,
+        but not messages compressed without a model: they carry no model id and
+        need a parser with no model registered for the struct.
+        """
+        if not 0 <= model.model_id <= 0xFFFF:
+            raise ValueError("Huffman model id must fit in uint16, got {}".format(
+                model.model_id))
+        self.huffman_models[model.model_id] = model
+        self.struct_models[strucut_name] = model
+
+    @staticmethod
+    def check_model_args(model: HuffmanModel, canonical: bool, binary: bool) -> None:
+        """
+        Reject compression arguments a message compressed with `model` cannot follow
+        """
+        if canonical or (binary and not model.binary):
+            raise ValueError("Huffman model {} is {}, got canonical={} binary={}".format(
+                model.model_id, "binary" if model.binary else "text", canonical, binary))
+
+    @staticmethod
+    def check_list_fit(list_size: int, plan: StructPlan | None, data, offset: int) -> None:
+        """
+        Reject a count of strings or structs that cannot fit in the rest of `data`
+        """
+        min_size = plan.min_size if plan is not None else length_codec.size
+        if list_size * min_size > len(data) - offset:
+            raise ValueError("List of {} items exceeds serialized data".format(list_size))
+
+    def skip_struct(self, type_name: str, data, offset: int = 0) -> int:
+        """
+        Return the offset right after the value of `type_name` at `offset`,
+        reading only the length prefixes
+        """
+        if type_name == "string":
+            return offset + length_codec.size + length_codec.unpack_from(data, offset)[0]
+        elif type_name in basic_structures:
+            return offset + basic_structures[type_name][1]
+        elif type_name in self.plans:
+            return self.skip_plan(self.plans[type_name], data, offset)
         else:
             raise KeyError("Unrecognized strucut name: {}".format(type_name))
 
-    def load_list(self, type_name: str, list_size: int) -> tuple:
+    def skip_plan(self, plan: StructPlan, data, offset: int = 0) -> int:
+        if plan.codec is not None:
+            return offset + plan.codec.size
+        if plan.compact:
+            return self.compact_codec.skip(plan, data, offset)
+        for step in plan.steps:
+            kind = step[0]
+            if kind == "fixed":
+                offset += step[1].size
+            elif kind == "list":
+                offset = self.skip_list_step(step, data, offset)
+            elif kind == "string":
+                offset = self.skip_struct("string", data, offset)
+            else:
+                offset = self.skip_plan(step[3], data, offset)
+        return offset
+
+    def skip_list(self, type_name: str, list_size: int, data, offset: int = 0) -> int:
+        return self.skip_list_step(self.list_step(type_name, list_size), data, offset)
+
+    def skip_list_step(self, step: tuple, data, offset: int = 0) -> int:
+        list_size, plan, basic = step[3], step[4], step[5]
         if not list_size:
-            list_size = struct.unpack("<H", self.data_s[:2])[0]
-            self.data_s = self.data_s[2:]
-        data = []
+            list_size = length_codec.unpack_from(data, offset)[0]
+            offset += length_codec.size
+        if basic is not None:
+            return offset + basic[1] * list_size
+        self.check_list_fit(list_size, plan, data, offset)
+        if plan is None:
+            for _ in range(list_size):
+                offset = self.skip_struct("string", data, offset)
+            return offset
+        if plan.codec is not None:
+            return offset + plan.codec.size * list_size
         for _ in range(list_size):
-            data.append(self.load_struct(type_name))
-        return tuple(data)
-
-    def dumpComp(self, strucut_name: str, obj_data: dict) -> bytes:
-        obj_serialized = self.dumps(strucut_name, obj_data)
-        huffman_tree = Huffman.build_tree(obj_serialized)
-        dict_code = Huffman.get_codes(huffman_tree)
-        text_encode_bitarray = Huffman.encode_input(dict_code, obj_serialized)
-        tree_encode_bitarray = Huffman.encode_tree(huffman_tree)
-        tree_text_packed = Huffman.pack_tree_and_text_bitarray(tree_encode_bitarray, text_encode_bitarray)
-        return tree_text_packed
-
-    def loadComp(self, strucut_name: str, data_compressed: bytes) -> dict:
-        tree_encode, text_encode = Huffman.unpack_tree_and_text_bitarray(data_compressed)
-        tree = Huffman.decode_tree(tree_encode)
-        data_serialized = Huffman.decode_input(tree, text_encode)
-        obj = self.loads(strucut_name, data_serialized)
-        return obj
+            offset = self.skip_plan(plan, data, offset)
+        return offset
+
+    def dumpComp(self, strucut_name: str, obj_data: dict, canonical: bool = False,
+                 binary: bool = False) -> bytes:
+        """
+        Serialize and Huffman compress the object.
+        If a model is registered for the struct, the message only references it
+        by id. Otherwise the tree is shipped with the message, or with
+        `canonical`, only the code lengths.
+        With `binary`, the bytes of the binary serialization are compressed
+        instead of its hex text.
+        With a model, the format is the model's: `canonical`, or `binary` on a
+        text model, raise ValueError.
+        """
+        model = self.struct_models.get(strucut_name)
+        if model is not None:
+            self.check_model_args(model, canonical, binary)
+            binary = model.binary
+        with timed_stage(self.profiler, "serialize", "encode") as stage:
+            if binary:
+                obj_serialized = self.dump_bytes(strucut_name, obj_data)
+            else:
+                obj_serialized = self.dumps(strucut_name, obj_data)
+            stage.num_byte = len(obj_serialized)
+        if model is not None:
+            with timed_stage(self.profiler, "encode", "encode") as stage:
+                data_compressed = model.compress(obj_serialized)
+                stage.num_byte = len(obj_serialized)
+            return struct.pack("<H", model.model_id) + data_compressed
+        return Huffman.compress(obj_serialized, canonical, self.profiler)
+
+    def loadComp(self, strucut_name: str, data_compressed: bytes, canonical: bool = False,
+                 binary: bool = False, record: bool = False) -> dict:
+        """
+        Inverse of `dumpComp`, with the same `canonical` and `binary`.
+        If a model is registered for the struct, the message must reference a
+        registered model by id, and the arguments are checked as in `dumpComp`.
+        """
+        if strucut_name in self.struct_models:
+            self.check_model_args(self.struct_models[strucut_name], canonical, binary)
+            model_id = struct.unpack("<H", data_compressed[0:2])[0]
+            if model_id not in self.huffman_models:
+                raise KeyError("Unregistered Huffman model id: {}".format(model_id))
+            with timed_stage(self.profiler, "decode", "decode") as stage:
+                data_serialized = self.huffman_models[model_id].decompress(data_compressed[2:])
+                stage.num_byte = len(data_serialized)
+        else:
+            data_serialized = Huffman.decompress(data_compressed, canonical, binary,
+                                                 self.profiler)
+        with timed_stage(self.profiler, "deserialize", "decode") as stage:
+            stage.num_byte = len(data_serialized)
+            if isinstance(data_serialized, bytes):
+                return self.load_bytes(strucut_name, data_serialized, record)
+            return self.loads(strucut_name, data_serialized, record)
 
         
         
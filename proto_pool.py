@@ -0,0 +1,144 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from codec_plan import record_length_codec
+from proto_parser import ProtoParser
+
+# the parser of a worker process, unpickled once by `init_worker`
+worker_parser = None
+
+
+def init_worker(proto_parser: ProtoParser) -> None:
+    global worker_parser
+    worker_parser = proto_parser
+
+
+def run_batch(method: str, strucut_name: str, items: list, kwargs: dict) -> list:
+    func = getattr(worker_parser, method)
+    return [func(strucut_name, item, **kwargs) for item in items]
+
+
+def run_stream(strucut_name: str, data: bytes, record: bool) -> list:
+    return worker_parser.loads_many(strucut_name, data, record)
+
+
+class ParallelParser:
+    """
+    Shard bulk encoding, compression and their inverse across a process
+    pool. The parser is shipped once to each worker as its compiled protocol
+    (see `ProtoParser.__getstate__`), so the structs and Huffman models
+    registered after the pool is created are not seen by the workers.
+    Work is sent in chunks of `chunk_size` items, with a bounded number of
+    chunks in flight, and results come back in input order.
+    """
+    CHUNK_SIZE = 256
+
+    def __init__(self, proto_parser: ProtoParser, max_workers: int | None = None,
+                 chunk_size: int = CHUNK_SIZE, mp_context=None):
+        self.proto_parser = proto_parser
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(self.max_workers, mp_context,
+                                            initializer=init_worker,
+                                            initargs=(proto_parser,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def map_ordered(self, func, tasks):
+        """
+        Yield `func(*task)` for each task, in order, keeping at most two
+        tasks per worker in flight
+        """
+        futures = deque()
+        for task in tasks:
+            if len(futures) >= 2 * self.max_workers:
+                yield futures.popleft().result()
+            futures.append(self.executor.submit(func, *task))
+        while futures:
+            yield futures.popleft().result()
+
+    def chunks(self, items):
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def map_method(self, method: str, strucut_name: str, items, **kwargs) -> list:
+        """
+        Return `[proto_parser.<method>(strucut_name, item, **kwargs) for item in items]`,
+        computed by the workers
+        """
+        tasks = ((method, strucut_name, chunk, kwargs) for chunk in self.chunks(items))
+        rst = []
+        for results in self.map_ordered(run_batch, tasks):
+            rst.extend(results)
+        return rst
+
+    def dump_all(self, strucut_name: str, objs) -> list:
+        return self.map_method("dump_bytes", strucut_name, objs)
+
+    def load_all(self, strucut_name: str, serialized_datas, record: bool = False) -> list:
+        return self.map_method("load_bytes", strucut_name, serialized_datas, record=record)
+
+    def compress_all(self, strucut_name: str, objs, canonical: bool = False,
+                     binary: bool = False) -> list:
+        return self.map_method("dumpComp", strucut_name, objs,
+                               canonical=canonical, binary=binary)
+
+    def decompress_all(self, strucut_name: str, datas_compressed, canonical: bool = False,
+                       binary: bool = False, record: bool = False) -> list:
+        return self.map_method("loadComp", strucut_name, datas_compressed,
+                               canonical=canonical, binary=binary, record=record)
+
+    def split_stream(self, strucut_name: str, serialized_data):
+        """
+        Cut a stream of records (see `ProtoParser.dumps_many`) into chunks of
+        `chunk_size` records, reading only the length prefixes
+        """
+        data = memoryview(serialized_data)
+        codec = self.proto_parser.plans[strucut_name].codec
+        if codec is not None:
+            stride = codec.size * self.chunk_size
+            for offset in range(0, len(data), stride):
+                yield bytes(data[offset:offset + stride])
+            return
+        idx_l = 0
+        offset = 0
+        num_record = 0
+        while offset < len(data):
+            if offset + record_length_codec.size > len(data):
+                break
+            offset += record_length_codec.size + record_length_codec.unpack_from(data, offset)[0]
+            num_record += 1
+            if num_record == self.chunk_size:
+                yield bytes(data[idx_l:offset])
+                idx_l = offset
+                num_record = 0
+        if idx_l < len(data):
+            # a truncated last record is reported by the worker decoding it
+            yield bytes(data[idx_l:])
+
+    def iter_stream(self, strucut_name: str, serialized_data, record: bool = False):
+        """
+        Decode a stream of records, as written by ProtoWriter or `dumps_many`,
+        e.g. the content or mmap of a file. Yield the records in order.
+        """
+        tasks = ((strucut_name, chunk, record)
+                 for chunk in self.split_stream(strucut_name, serialized_data))
+        for results in self.map_ordered(run_stream, tasks):
+            yield from results
+
+    def load_stream(self, strucut_name: str, serialized_data, record: bool = False) -> list:
+        return list(self.iter_stream(strucut_name, serialized_data, record))
@@ -0,0 +1,204 @@
+from operator import getitem
+from time import perf_counter
+
+from codec_plan import flatten, unflatten
+from record_class import Record
+
+
+class Stage:
+    """
+    Context manager timing one stage of a ProtoProfiler. Set `num_byte`
+    to the size of the data the stage works on.
+    """
+    __slots__ = ("profiler", "name", "op", "num_byte", "start")
+
+    def __init__(self, profiler, name: str, op: str):
+        self.profiler = profiler
+        self.name = name
+        self.op = op
+        self.num_byte = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.profiler.add_stage(self.name, self.op, self.num_byte,
+                                    perf_counter() - self.start)
+
+
+class NullStage:
+    """
+    Stage of a disabled profiler: records nothing
+    """
+    __slots__ = ("num_byte",)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+null_stage = NullStage()
+
+
+def timed_stage(profiler, name: str, op: str):
+    """
+    Stage `name` of direction `op` of `profiler`, or a stage recording
+    nothing if `profiler` is None
+    """
+    return profiler.stage(name, op) if profiler is not None else null_stage
+
+
+class ProtoProfiler:
+    """
+    Counters of an instrumented ProtoParser (see `ProtoParser.enable_profiling`)
+    and of the Huffman compression it runs:
+    - per struct and per field, and per direction ("encode" or "decode"):
+      number of values, bytes and cumulative seconds, nested structs
+      included in the time of their parent
+    - per stage and direction: the stages of `dumpComp` (serialize, stats,
+      tree_build, encode, pack) are "encode" ones, those of `loadComp`
+      (unpack, tree_build, decode, deserialize) "decode" ones: number of
+      runs, bytes and seconds. Canonical messages are encoded and packed in
+      the single "encode" stage, messages of a registered model skip the
+      stats and tree stages.
+    While profiling, structs are coded field by field by the interpreter
+    instead of the generated codecs, so that every field is timed; compact
+    structs are timed as a whole. Fixed-size nested structs are packed as
+    part of the field holding them, so they get no counters of their own:
+    Skill in `Pet.skill` is only counted as that field. The fixed-stride
+    paths of `dumps_many` and `loads_many` are not instrumented.
+    `callback(kind, name, op, num_byte, seconds)` is called on every
+    recorded event, `kind` being "struct", "field" or "stage", `name` the
+    struct, "struct.field" or stage name, and `op` the direction.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.structs = {}  # {(strucut_name, op): [count, bytes, seconds]}
+        self.fields = {}  # {(strucut_name, var_name, op): [count, bytes, seconds]}
+        self.stages = {}  # {(stage, op): [count, bytes, seconds]}
+
+    def reset(self) -> None:
+        self.structs.clear()
+        self.fields.clear()
+        self.stages.clear()
+
+    @staticmethod
+    def count(counters: dict, key, num_byte: int, seconds: float) -> None:
+        counter = counters.get(key)
+        if counter is None:
+            counters[key] = [1, num_byte, seconds]
+        else:
+            counter[0] += 1
+            counter[1] += num_byte
+            counter[2] += seconds
+
+    def add_struct(self, strucut_name: str, op: str, num_byte: int, seconds: float) -> None:
+        self.count(self.structs, (strucut_name, op), num_byte, seconds)
+        if self.callback is not None:
+            self.callback("struct", strucut_name, op, num_byte, seconds)
+
+    def add_field(self, strucut_name: str, var_name: str, op: str, num_byte: int,
+                  seconds: float) -> None:
+        self.count(self.fields, (strucut_name, var_name, op), num_byte, seconds)
+        if self.callback is not None:
+            self.callback("field", "{}.{}".format(strucut_name, var_name), op,
+                          num_byte, seconds)
+
+    def add_stage(self, name: str, op: str, num_byte: int, seconds: float) -> None:
+        self.count(self.stages, (name, op), num_byte, seconds)
+        if self.callback is not None:
+            self.callback("stage", name, op, num_byte, seconds)
+
+    def stage(self, name: str, op: str) -> Stage:
+        return Stage(self, name, op)
+
+    @staticmethod
+    def counter_dict(counter: list) -> dict:
+        return {"count": counter[0], "bytes": counter[1], "seconds": counter[2]}
+
+    def snapshot(self) -> dict:
+        """
+        Copy of the counters:
+        {"structs": {strucut_name: {op: counter}},
+         "fields": {"strucut_name.var_name": {op: counter}},
+         "stages": {stage: {op: counter}}},
+        each counter being {"count": int, "bytes": int, "seconds": float}
+        """
+        structs = {}
+        for (strucut_name, op), counter in self.structs.items():
+            structs.setdefault(strucut_name, {})[op] = self.counter_dict(counter)
+        fields = {}
+        for (strucut_name, var_name, op), counter in self.fields.items():
+            fields.setdefault("{}.{}".format(strucut_name, var_name), {})[op] = \
+                self.counter_dict(counter)
+        stages = {}
+        for (name, op), counter in self.stages.items():
+            stages.setdefault(name, {})[op] = self.counter_dict(counter)
+        return {"structs": structs, "fields": fields, "stages": stages}
+
+    def serialize_plan(self, proto_parser, obj_data, plan, buffer, offset: int) -> int:
+        """
+        Instrumented `ProtoParser.serialize_plan_into`
+        """
+        start = perf_counter()
+        offset_struct = offset
+        if plan.compact:
+            offset = proto_parser.compact_codec.serialize_into(obj_data, plan, buffer, offset)
+        else:
+            get = getattr if isinstance(obj_data, Record) else getitem
+            for var_name, type_name, is_list, list_size, codec, layout in plan.fields:
+                start_field = perf_counter()
+                offset_field = offset
+                value = get(obj_data, var_name)
+                if codec is not None:
+                    values = []
+                    flatten(layout, value, values)
+                    codec.pack_into(buffer, offset, *values)
+                    offset += codec.size
+                elif is_list:
+                    offset = proto_parser.serialize_list_into(value, type_name, list_size,
+                                                              buffer, offset)
+                else:
+                    offset = proto_parser.serialize_into(value, type_name, buffer, offset)
+                self.add_field(plan.name, var_name, "encode", offset - offset_field,
+                               perf_counter() - start_field)
+        self.add_struct(plan.name, "encode", offset - offset_struct, perf_counter() - start)
+        return offset
+
+    def load_plan(self, proto_parser, plan, data, offset: int, record: bool) -> tuple:
+        """
+        Instrumented `ProtoParser.load_plan`
+        """
+        start = perf_counter()
+        offset_struct = offset
+        if plan.compact:
+            obj_data, offset = proto_parser.compact_codec.load(plan, data, offset, record)
+        else:
+            record_class = proto_parser.record_class if record else None
+            values = []
+            for var_name, type_name, is_list, list_size, codec, layout in plan.fields:
+                start_field = perf_counter()
+                offset_field = offset
+                if codec is not None:
+                    value = unflatten(layout, codec.unpack_from(data, offset), 0,
+                                      record_class)[0]
+                    offset += codec.size
+                elif is_list:
+                    value, offset = proto_parser.load_list(type_name, list_size, data,
+                                                           offset, record)
+                else:
+                    value, offset = proto_parser.load_struct(type_name, data, offset, record)
+                values.append(value)
+                self.add_field(plan.name, var_name, "decode", offset - offset_field,
+                               perf_counter() - start_field)
+            if record:
+                obj_data = record_class(plan.name)(*values)
+            else:
+                obj_data = dict(zip(plan.field_names, values))
+        self.add_struct(plan.name, "decode", offset - offset_struct, perf_counter() - start)
+        return obj_data, offset
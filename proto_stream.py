@@ -0,0 +1,130 @@
+from codec_plan import record_length_codec
+from proto_parser import ProtoParser
+
+
+class ProtoWriter:
+    """
+    Append records of one struct to a binary file or pipe, in the stream
+    format of `ProtoParser.dumps_many`: fixed-size structs back to back,
+    other structs prefixed by their uint32 size.
+    Records are serialized into one reusable buffer which is written out
+    when full. The underlying file is not closed by `close`.
+    """
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, proto_parser: ProtoParser, strucut_name: str, file,
+                 buffer_size: int = BUFFER_SIZE):
+        self.proto_parser = proto_parser
+        self.strucut_name = strucut_name
+        self.file = file
+        self.plan = proto_parser.plans[strucut_name]
+        self.buffer = bytearray(buffer_size)
+        self.offset = 0
+        self.num_flushed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, obj_data: dict) -> None:
+        if self.plan.codec is not None:
+            size = self.plan.codec.size
+            size_record = size
+        else:
+            size = self.proto_parser.calc_size(obj_data, self.strucut_name)
+            size_record = record_length_codec.size + size
+        if self.offset + size_record > len(self.buffer):
+            self.flush_buffer()
+            if size_record > len(self.buffer):
+                self.buffer = bytearray(size_record)
+        offset = self.offset
+        if self.plan.codec is None:
+            record_length_codec.pack_into(self.buffer, offset, size)
+            offset += record_length_codec.size
+        self.offset = self.proto_parser.serialize_into(obj_data, self.strucut_name,
+                                                       self.buffer, offset)
+
+    def tell(self) -> int:
+        """
+        Offset in the stream where the next record starts
+        """
+        return self.num_flushed + self.offset
+
+    def write_many(self, objs) -> None:
+        for obj_data in objs:
+            self.write(obj_data)
+
+    def flush_buffer(self) -> None:
+        if self.offset:
+            with memoryview(self.buffer) as buffer_view:
+                self.file.write(buffer_view[:self.offset])
+            self.num_flushed += self.offset
+            self.offset = 0
+
+    def flush(self) -> None:
+        self.flush_buffer()
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+
+class ProtoReader:
+    """
+    Lazily decode the records written by ProtoWriter (or `dumps_many`) from
+    a binary file or pipe, reading ahead `readahead` bytes at a time so
+    memory stays bounded by the largest record.
+    """
+    READAHEAD = 1 << 16
+
+    def __init__(self, proto_parser: ProtoParser, strucut_name: str, file,
+                 readahead: int = READAHEAD):
+        self.proto_parser = proto_parser
+        self.strucut_name = strucut_name
+        self.file = file
+        self.plan = proto_parser.plans[strucut_name]
+        self.readahead = readahead
+
+    def __iter__(self):
+        load_struct = self.proto_parser.load_struct
+        strucut_name = self.strucut_name
+        codec = self.plan.codec
+        data = b""
+        offset = 0
+        num_need = self.readahead
+        while True:
+            chunk = self.file.read(num_need)
+            if chunk:
+                data = data[offset:] + chunk
+                offset = 0
+            elif offset == len(data):
+                return
+            data_view = memoryview(data)
+            num_byte = len(data)
+            num_need = self.readahead
+            while True:
+                if codec is not None:
+                    idx_r = offset + codec.size
+                    if idx_r > num_byte:
+                        break
+                    obj_data = load_struct(strucut_name, data_view, offset)[0]
+                else:
+                    if offset + record_length_codec.size > num_byte:
+                        break
+                    size = record_length_codec.unpack_from(data, offset)[0]
+                    idx_l = offset + record_length_codec.size
+                    idx_r = idx_l + size
+                    if idx_r > num_byte:
+                        num_need = max(self.readahead, idx_r - num_byte)
+                        break
+                    obj_data, idx_end = load_struct(strucut_name, data_view, idx_l)
+                    if idx_end != idx_r:
+                        raise ValueError("Record size {} does not match decoded size {}".format(
+                            size, idx_end - idx_l))
+                offset = idx_r
+                yield obj_data
+            if not chunk:
+                raise ValueError("Truncated record: {} trailing bytes".format(
+                    num_byte - offset))
@@ -0,0 +1,88 @@
+import keyword
+
+
+class Record:
+    """
+    Base of the record classes generated for each struct.
+    Fields are stored in `__slots__` in declaration order, which takes much
+    less memory than a dict per object (about half for the demo Player).
+    Records are about as fast as dicts to encode and decode, not faster.
+    Records are accepted by the serializer wherever a dict is, and
+    `record[var_name]` reads a field.
+    """
+    __slots__ = ()
+    __hash__ = None
+
+    def __getitem__(self, var_name: str):
+        if var_name not in self.__slots__:
+            raise KeyError(var_name)
+        return getattr(self, var_name)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        for var_name in self.__slots__:
+            if getattr(self, var_name) != getattr(other, var_name):
+                return False
+        return True
+
+    def __reduce__(self):
+        return (rebuild_record, (type(self).__name__, self.__slots__,
+                                 tuple(getattr(self, var_name) for var_name in self.__slots__)))
+
+    def __repr__(self) -> str:
+        fields = ", ".join("{}={!r}".format(var_name, getattr(self, var_name))
+                           for var_name in self.__slots__)
+        return "{}({})".format(type(self).__name__, fields)
+
+
+def is_attribute_name(var_name: str) -> bool:
+    return var_name.isidentifier() and not keyword.iskeyword(var_name)
+
+
+# {(name, field_names): record class}, so that every parser of a process
+# shares the class of a struct, and records can be pickled by definition
+record_classes = {}
+
+
+def make_record_class(name: str, field_names: tuple) -> type:
+    """
+    Generate a Record subclass with positional construction: `Skill(1, 10)`
+    """
+    key = (name, tuple(field_names))
+    if key in record_classes:
+        return record_classes[key]
+    for var_name in field_names:
+        if not is_attribute_name(var_name):
+            raise ValueError("Field {} of struct {} is not a valid attribute name".format(
+                var_name, name))
+    # positional parameters are numbered, so that no field name can clash with them
+    lines = ["def __init__(self{}):".format("".join(
+        ", _{:d}".format(idx) for idx in range(len(field_names))))]
+    lines += ["    self.{} = _{:d}".format(var_name, idx)
+              for idx, var_name in enumerate(field_names)]
+    lines.append("    pass")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    record_classes[key] = type(name, (Record,), {"__slots__": tuple(field_names),
+                                                 "__init__": namespace["__init__"]})
+    return record_classes[key]
+
+
+class LazyRecordClasses(dict):
+    """
+    {name: record class} making the record class of a struct on first
+    lookup, so that structs whose field names are not valid attribute
+    names only fail when decoded as records
+    """
+    def __init__(self, field_names: dict):
+        super().__init__()
+        self.field_names = field_names  # {name: field_names}
+
+    def __missing__(self, name: str) -> type:
+        record_class = self[name] = make_record_class(name, self.field_names[name])
+        return record_class
+
+
+def rebuild_record(name: str, field_names: tuple, values: tuple) -> Record:
+    return make_record_class(name, field_names)(*values)
@@ -0,0 +1,154 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+from codec_plan import record_length_codec
+from proto_parser import ProtoParser
+from proto_stream import ProtoWriter
+
+# footer of a record file of variable-size structs: index offset, number of records, magic
+index_trailer_codec = struct.Struct("<QQ4s")
+INDEX_MAGIC = b"PPIX"
+
+
+class RecordFileWriter(ProtoWriter):
+    """
+    Write a record file: the stream of ProtoWriter followed, for
+    variable-size structs, by a footer index of the record offsets
+    (uint64 each) and `index_trailer_codec`.
+    Fixed-size structs need no index, records are addressed by stride.
+    """
+    def __init__(self, proto_parser: ProtoParser, strucut_name: str, file,
+                 buffer_size: int = ProtoWriter.BUFFER_SIZE):
+        super().__init__(proto_parser, strucut_name, file, buffer_size)
+        self.offsets = array("Q")
+        self.closed = False
+
+    def write(self, obj_data: dict) -> None:
+        offset = self.tell()
+        super().write(obj_data)
+        if self.plan.codec is None:
+            self.offsets.append(offset)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.flush_buffer()
+        if self.plan.codec is None:
+            index_offset = self.num_flushed
+            offsets = self.offsets
+            if sys.byteorder == "big":
+                offsets = array("Q", offsets)
+                offsets.byteswap()
+            self.file.write(offsets.tobytes())
+            self.file.write(index_trailer_codec.pack(index_offset, len(offsets), INDEX_MAGIC))
+        self.file.flush()
+
+
+class RecordFile:
+    """
+    Random access to the records of a record file through a read-only mmap.
+    Records are decoded on demand: `record_file[i]`, `record_file[i:j]`;
+    `raw(i)` returns the encoded record as a zero-copy memoryview, which
+    must be released before `close`.
+    """
+    def __init__(self, proto_parser: ProtoParser, strucut_name: str, filename: str):
+        self.proto_parser = proto_parser
+        self.strucut_name = strucut_name
+        self.plan = proto_parser.plans[strucut_name]
+        self.file = open(filename, "rb")
+        file_size = os.fstat(self.file.fileno()).st_size
+        self.mmap = None
+        if file_size:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self.mmap)
+        else:
+            self.data = memoryview(b"")
+        self.index = None
+        codec = self.plan.codec
+        if codec is not None:
+            if file_size % codec.size:
+                self.close()
+                raise ValueError("File size {} is not a multiple of the record size {}".format(
+                    file_size, codec.size))
+            self.num_record = file_size // codec.size
+            return
+        if file_size < index_trailer_codec.size:
+            self.close()
+            raise ValueError("Record file too small for an index: {} bytes".format(file_size))
+        index_offset, self.num_record, magic = index_trailer_codec.unpack_from(
+            self.data, file_size - index_trailer_codec.size)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError("Record file has no index: {}".format(magic))
+        if index_offset + 8 * self.num_record != file_size - index_trailer_codec.size:
+            self.close()
+            raise ValueError("Corrupt record file index: {} records at offset {}".format(
+                self.num_record, index_offset))
+        index_data = self.data[index_offset:index_offset + 8 * self.num_record]
+        if sys.byteorder == "little":
+            self.index = index_data.cast("Q")
+        else:
+            self.index = array("Q", index_data)
+            self.index.byteswap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self.index, memoryview):
+            self.index.release()
+        self.index = None
+        self.data.release()
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.num_record
+
+    def record_range(self, idx: int) -> tuple:
+        """
+        Return the (start, end) offsets of the encoded record `idx`
+        """
+        if idx < 0:
+            idx += self.num_record
+        if not 0 <= idx < self.num_record:
+            raise IndexError("Record index out of range")
+        codec = self.plan.codec
+        if codec is not None:
+            return idx * codec.size, (idx + 1) * codec.size
+        offset = self.index[idx] + record_length_codec.size
+        size = record_length_codec.unpack_from(self.data, self.index[idx])[0]
+        return offset, offset + size
+
+    def raw(self, idx: int) -> memoryview:
+        idx_l, idx_r = self.record_range(idx)
+        return self.data[idx_l:idx_r]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.num_record)
+            codec = self.plan.codec
+            if codec is not None and step == 1:
+                stop = max(start, stop)
+                return self.proto_parser.loads_many(
+                    self.strucut_name, self.data[start * codec.size:stop * codec.size])
+            return [self[i] for i in range(start, stop, step)]
+        idx_l, idx_r = self.record_range(idx)
+        obj_data, idx_end = self.proto_parser.load_struct(self.strucut_name, self.data, idx_l)
+        if idx_end != idx_r:
+            raise ValueError("Record size {} does not match decoded size {}".format(
+                idx_r - idx_l, idx_end - idx_l))
+        return obj_data
+
+    def __iter__(self):
+        for idx in range(self.num_record):
+            yield self[idx]
@@ -0,0 +1,96 @@
+from codec_plan import unflatten
+
+
+class StructView:
+    """
+    Lazy view of a serialized struct: a field is decoded from the underlying
+    buffer only when accessed, then cached.
+    Offsets of the leading fixed-size fields are taken from the plan, the
+    following ones are found by skipping over the length prefixes of the
+    fields before them. Nested structs of variable size are views as well.
+    Structs in compact mode are decoded as a whole on first access.
+    """
+    __slots__ = ("proto_parser", "plan", "data", "offsets", "values")
+
+    def __init__(self, proto_parser, strucut_name: str, data, offset: int = 0):
+        self.proto_parser = proto_parser
+        self.plan = proto_parser.plans[strucut_name]
+        self.data = data
+        self.offsets = [offset + offset_field for offset_field in self.plan.prefix_offsets]
+        self.values = {}
+
+    def field_offset(self, idx: int) -> int:
+        """
+        Offset of field `idx`; `len(self)` gives the end of the struct
+        """
+        offsets = self.offsets
+        fields = self.plan.fields
+        while len(offsets) <= idx:
+            offset = offsets[-1]
+            var_name, type_name, is_list, list_size, codec, _ = fields[len(offsets) - 1]
+            if codec is not None:
+                offset += codec.size
+            elif is_list:
+                offset = self.proto_parser.skip_list(type_name, list_size, self.data, offset)
+            else:
+                offset = self.proto_parser.skip_struct(type_name, self.data, offset)
+            offsets.append(offset)
+        return offsets[idx]
+
+    def end_offset(self) -> int:
+        if self.plan.compact:
+            return self.proto_parser.skip_plan(self.plan, self.data, self.offsets[0])
+        return self.field_offset(len(self.plan.fields))
+
+    def __getitem__(self, var_name: str):
+        if var_name in self.values:
+            return self.values[var_name]
+        if self.plan.compact:
+            obj_data = self.proto_parser.load_plan(self.plan, self.data, self.offsets[0])[0]
+            self.values.update(obj_data)
+            return obj_data[var_name]
+        idx = self.plan.field_index[var_name]
+        _, type_name, is_list, list_size, codec, layout = self.plan.fields[idx]
+        offset = self.field_offset(idx)
+        if codec is not None:
+            value = unflatten(layout, codec.unpack_from(self.data, offset), 0)[0]
+        elif is_list:
+            value = self.proto_parser.load_list(type_name, list_size, self.data, offset)[0]
+        elif type_name == "string":
+            value = self.proto_parser.load_struct("string", self.data, offset)[0]
+        else:
+            value = StructView(self.proto_parser, type_name, self.data, offset)
+        self.values[var_name] = value
+        return value
+
+    def get(self, var_name: str, default=None):
+        if var_name not in self.plan.field_index:
+            return default
+        return self[var_name]
+
+    def __contains__(self, var_name: str) -> bool:
+        return var_name in self.plan.field_index
+
+    def __iter__(self):
+        return iter(self.plan.field_index)
+
+    def __len__(self) -> int:
+        return len(self.plan.fields)
+
+    def keys(self):
+        return self.plan.field_index.keys()
+
+    def to_dict(self) -> dict:
+        """
+        Decode every field, as `ProtoParser.load_struct` would
+        """
+        obj_data = {}
+        for var_name in self.plan.field_index:
+            value = self[var_name]
+            if isinstance(value, StructView):
+                value = value.to_dict()
+            obj_data[var_name] = value
+        return obj_data
+
+    def __repr__(self) -> str:
+        return "StructView({})".format(self.plan.name)
@@ -0,0 +1,86 @@
+import copy
+import os
+import struct
+import sys
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from proto_parser import ProtoParser  # noqa: E402
+
+PLAYER = {
+    "name": "骨精灵",
+    "id": 5201314,
+    "married": False,
+    "friends": (5201315, 244578811),
+    "position": (134.5, 0.0, 23.41),
+    "pet": {
+        "name": "骨精灵的小可爱",
+        "skill": (
+            {"id": 1, "level": 10},
+            {"id": 2, "level": 99}
+        )
+    }
+}
+
+
+def proto_path(filename: str) -> str:
+    return os.path.join(repo_dir, filename)
+
+
+def make_parser(filename: str, **kwargs) -> ProtoParser:
+    proto_parser = ProtoParser(**kwargs)
+    proto_parser.buildDesc(proto_path(filename))
+    return proto_parser
+
+
+def make_players(player: dict, num_player: int) -> list:
+    return [dict(player, id=idx, friends=tuple(range(idx))) for idx in range(num_player)]
+
+
+def make_skills(num_skill: int) -> list:
+    return [{"id": idx, "level": idx * 7} for idx in range(num_skill)]
+
+
+def write_proto(tmp_path, content: str) -> str:
+    filename = os.path.join(str(tmp_path), "test.proto")
+    with open(filename, "w", encoding="UTF-8") as f:
+        f.write(content)
+    return filename
+
+
+def float32(value: float) -> float:
+    return struct.unpack("<f", struct.pack("<f", value))[0]
+
+
+def decoded(obj_data: dict) -> dict:
+    """
+    `obj_data` as the parser decodes it: float fields rounded to float32
+    """
+    obj_data = copy.deepcopy(obj_data)
+    obj_data["position"] = tuple(float32(value) for value in obj_data["position"])
+    return obj_data
+
+
+@pytest.fixture
+def player():
+    return copy.deepcopy(PLAYER)
+
+
+@pytest.fixture
+def simple_player():
+    obj_data = copy.deepcopy(PLAYER)
+    del obj_data["pet"]
+    return obj_data
+
+
+@pytest.fixture(params=[True, False], ids=["codegen", "interpreter"])
+def player_parser(request):
+    return make_parser("player.proto", codegen=request.param)
+
+
+@pytest.fixture(params=[True, False], ids=["codegen", "interpreter"])
+def simple_parser(request):
+    return make_parser("simple.proto", codegen=request.param)
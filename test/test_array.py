@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import make_parser, make_skills
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def proto_parser():
+    return make_parser("player.proto")
+
+
+def test_dtype(proto_parser):
+    dtype = proto_parser.get_dtype("Skill")
+    assert dtype.names == ("id", "level")
+    assert dtype.itemsize == proto_parser.fixed_size("Skill") == 6
+    assert dtype["id"] == np.dtype("<i4")
+    assert dtype["level"] == np.dtype("<u2")
+    assert proto_parser.get_dtype("float") == np.dtype("<f4")
+
+
+def test_loads_array_view(proto_parser):
+    skills = make_skills(10)
+    data = bytearray(proto_parser.dumps_many("Skill", skills))
+    array = proto_parser.loads_array("Skill", data)
+    assert array.tolist() == [(obj_data["id"], obj_data["level"]) for obj_data in skills]
+    # the array shares the memory of the stream
+    data[6:10] = (-7).to_bytes(4, "little", signed=True)
+    assert array["id"][1] == -7
+
+
+def test_dumps_array(proto_parser):
+    array = np.zeros(5, dtype=proto_parser.get_dtype("Skill"))
+    array["id"] = np.arange(5) - 2
+    array["level"] = np.arange(5) * 100
+    data = proto_parser.dumps_array("Skill", array)
+    assert data == proto_parser.dumps_many(
+        "Skill", [{"id": idx - 2, "level": idx * 100} for idx in range(5)])
+    assert (proto_parser.loads_array("Skill", data) == array).all()
+    friends = np.array([1, -2, 3], dtype=np.int64)
+    assert proto_parser.dumps_array("int32", friends) == np.array([1, -2, 3], "<i4").tobytes()
+
+
+def test_load_list_array(proto_parser, player):
+    player = dict(player, friends=tuple(range(100)))
+    data = proto_parser.dump_bytes("Player", player)
+    view = proto_parser.load_lazy("Player", data)
+    offset = view.field_offset(proto_parser.plans["Player"].field_index["friends"])
+    friends, offset_end = proto_parser.load_list_array("int32", 0, data, offset)
+    assert friends.tolist() == list(player["friends"])
+    assert friends.base is not None
+    assert offset_end == view.field_offset(proto_parser.plans["Player"].field_index["position"])
+    position = proto_parser.load_list_array("float", 3, data, offset_end)[0]
+    assert position.tolist() == [134.5, 0.0, pytest.approx(23.41)]
+
+
+def test_not_fixed_size(proto_parser):
+    for type_name in ("Player", "Pet"):
+        with pytest.raises(ValueError):
+            proto_parser.get_dtype(type_name)
+        with pytest.raises(ValueError):
+            proto_parser.loads_array(type_name, b"")
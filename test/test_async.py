@@ -0,0 +1,165 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import decoded, make_parser, make_players, make_skills
+from proto_async import AsyncProtoReader, AsyncProtoWriter
+
+
+class PipeWriter:
+    """
+    In-memory StreamWriter feeding an asyncio StreamReader
+    """
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+        self.num_write = 0
+
+    def write(self, data: bytes) -> None:
+        self.num_write += 1
+        self.reader.feed_data(data)
+
+    async def drain(self) -> None:
+        pass
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(1)
+        self.num_submit = 0
+
+    def submit(self, *args, **kwargs):
+        self.num_submit += 1
+        return super().submit(*args, **kwargs)
+
+
+def encode_stream(proto_parser, strucut_name: str, objs, **kwargs) -> bytes:
+    async def run():
+        reader = asyncio.StreamReader()
+        writer = AsyncProtoWriter(proto_parser, strucut_name, PipeWriter(reader), **kwargs)
+        await writer.write_many(objs)
+        await writer.close()
+        reader.feed_eof()
+        return await reader.read()
+    return asyncio.run(run())
+
+
+def decode_stream(proto_parser, strucut_name: str, data: bytes, step: int = 0,
+                  **kwargs) -> list:
+    """
+    Decode `data` fed all at once, or `step` bytes at a time
+    """
+    async def run():
+        reader = asyncio.StreamReader()
+        proto_reader = AsyncProtoReader(proto_parser, strucut_name, reader, **kwargs)
+
+        async def feed():
+            for idx in range(0, len(data), step or max(1, len(data))):
+                reader.feed_data(data[idx:idx + (step or len(data))])
+                await asyncio.sleep(0)
+            reader.feed_eof()
+        task = asyncio.ensure_future(feed())
+        try:
+            return await proto_reader.read_all()
+        finally:
+            await task
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("compressed, canonical, binary", [
+    (False, False, False), (True, False, False), (True, True, False), (True, True, True)])
+def test_round_trip(player, compressed, canonical, binary):
+    proto_parser = make_parser("player.proto")
+    players = make_players(player, 30)
+    kwargs = {"compressed": compressed, "canonical": canonical, "binary": binary}
+    data = encode_stream(proto_parser, "Player", players, batch_size=100, **kwargs)
+    if not compressed:
+        assert data == proto_parser.dumps_many("Player", players)
+    objs = decode_stream(proto_parser, "Player", data, readahead=64, **kwargs)
+    assert objs == [decoded(obj_data) for obj_data in players]
+
+
+@pytest.mark.parametrize("strucut_name", ["Player", "Skill"])
+@pytest.mark.parametrize("compressed", [False, True])
+def test_byte_at_a_time(player, strucut_name, compressed):
+    proto_parser = make_parser("player.proto")
+    objs = make_players(player, 4) if strucut_name == "Player" else make_skills(6)
+    data = encode_stream(proto_parser, strucut_name, objs, compressed=compressed)
+    objs_decode = decode_stream(proto_parser, strucut_name, data, 1, compressed=compressed,
+                                readahead=1, record=True)
+    assert objs_decode == [proto_parser.load_bytes(strucut_name,
+                                                   proto_parser.dump_bytes(strucut_name, obj),
+                                                   record=True) for obj in objs]
+
+
+@pytest.mark.parametrize("strucut_name", ["Player", "Skill"])
+@pytest.mark.parametrize("compressed", [False, True])
+def test_truncated(player, strucut_name, compressed):
+    proto_parser = make_parser("player.proto")
+    objs = make_players(player, 3) if strucut_name == "Player" else make_skills(3)
+    data = encode_stream(proto_parser, strucut_name, objs, compressed=compressed)
+    for size in (len(data) - 1, 3):
+        with pytest.raises(ValueError):
+            decode_stream(proto_parser, strucut_name, data[:size], compressed=compressed)
+
+
+def test_batches(player):
+    proto_parser = make_parser("player.proto")
+
+    async def run():
+        reader = asyncio.StreamReader()
+        pipe = PipeWriter(reader)
+        writer = AsyncProtoWriter(proto_parser, "Player", pipe, batch_size=1 << 20)
+        await writer.write_many(make_players(player, 10))
+        assert pipe.num_write == 0
+        await writer.close()
+        assert pipe.num_write == 1
+    asyncio.run(run())
+
+
+def test_offload(player):
+    proto_parser = make_parser("player.proto")
+    players = make_players(player, 20)
+    data = encode_stream(proto_parser, "Player", players)
+    executor = CountingExecutor()
+    with executor:
+        objs = decode_stream(proto_parser, "Player", data, 256, offload_size=0,
+                             executor=executor)
+    assert objs == [decoded(obj_data) for obj_data in players]
+    assert executor.num_submit > 0
+    executor = CountingExecutor()
+    with executor:
+        decode_stream(proto_parser, "Player", data, executor=executor)
+    assert executor.num_submit == 0
+
+
+def test_tcp(player):
+    proto_parser = make_parser("player.proto")
+    players = make_players(player, 50)
+
+    async def run():
+        received = []
+        finished = asyncio.Event()
+
+        async def handle(reader, writer):
+            try:
+                received.extend(await AsyncProtoReader(proto_parser, "Player", reader,
+                                                       compressed=True).read_all())
+            finally:
+                writer.close()
+                finished.set()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        proto_writer = AsyncProtoWriter(proto_parser, "Player", writer, compressed=True,
+                                        batch_size=512)
+        await proto_writer.write_many(players)
+        await proto_writer.close()
+        writer.close()
+        await writer.wait_closed()
+        await finished.wait()
+        server.close()
+        await server.wait_closed()
+        return received
+    assert asyncio.run(run()) == [decoded(obj_data) for obj_data in players]
@@ -0,0 +1,102 @@
+import struct
+
+import pytest
+
+from conftest import decoded, make_parser
+
+# output of the original implementation, the wire format must not change
+PLAYER_HEX = (
+    "0900e9aaa8e7b2bee781b5a25d4f00000200a35d4f00fbf9930e0080064300000000ae47bb41"
+    "1500e9aaa8e7b2bee781b5e79a84e5b08fe58fafe788b1010000000a00020000006300")
+SIMPLE_HEX = "0900e9aaa8e7b2bee781b5a25d4f00000200a35d4f00fbf9930e0080064300000000ae47bb41"
+PLAYER_COMP = bytes.fromhex(
+    "9500000026058534992c53805926d339ba6b6659539988f301000038372223e965b6d2fed48ba8156002c1"
+    "23502ac2dafba26070855100004ca96657fd06e4447d2cb6da5fdab4f23ab530f7a9ed2f4bbb79e000200b"
+    "00086200")
+SIMPLE_COMP = bytes.fromhex(
+    "95000000260596c2b1267311349caccb24d89c4dd329a80601000024125557135b991371edebdf68a00381"
+    "5df68a0a6a9970818178700002a46b343c")
+
+
+def test_dumps_baseline(player_parser, simple_parser, player, simple_player):
+    assert player_parser.dumps("Player", player) == PLAYER_HEX
+    assert simple_parser.dumps("Player", simple_player) == SIMPLE_HEX
+
+
+def test_loads_baseline(player_parser, simple_parser, player, simple_player):
+    assert player_parser.loads("Player", PLAYER_HEX) == decoded(player)
+    assert simple_parser.loads("Player", SIMPLE_HEX) == decoded(simple_player)
+
+
+def test_bytes(player_parser, player):
+    data = player_parser.dump_bytes("Player", player)
+    assert data == bytes.fromhex(PLAYER_HEX)
+    assert player_parser.load_bytes("Player", data) == decoded(player)
+    assert player_parser.load_bytes("Player", memoryview(data)) == decoded(player)
+
+
+def test_dump_into(player_parser, player):
+    buffer = bytearray(4 + len(PLAYER_HEX) // 2)
+    assert player_parser.dump_into("Player", player, buffer, 4) == len(buffer)
+    assert bytes(buffer[4:]).hex() == PLAYER_HEX
+
+
+def test_load_comp_baseline(player_parser, simple_parser, player, simple_player):
+    assert player_parser.loadComp("Player", PLAYER_COMP) == decoded(player)
+    assert simple_parser.loadComp("Player", SIMPLE_COMP) == decoded(simple_player)
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+@pytest.mark.parametrize("binary", [False, True])
+def test_comp_round_trip(player_parser, player, canonical, binary):
+    data_compressed = player_parser.dumpComp("Player", player, canonical, binary)
+    assert player_parser.loadComp("Player", data_compressed, canonical, binary) == \
+        decoded(player)
+
+
+def test_comp_model(player_parser, player):
+    model = player_parser.train_model("Player", [player], 7, binary=True)
+    player_parser.register_model("Player", model)
+    data_compressed = player_parser.dumpComp("Player", player)
+    assert data_compressed[:2] == b"\x07\x00"
+    assert player_parser.loadComp("Player", data_compressed) == decoded(player)
+    assert player_parser.loadComp("Player", data_compressed, binary=True) == decoded(player)
+    with pytest.raises(ValueError):
+        player_parser.loadComp("Player", data_compressed, canonical=True)
+    with pytest.raises(ValueError):
+        player_parser.dumpComp("Player", player, canonical=True)
+
+
+def test_record(player_parser, player):
+    record = player_parser.loads("Player", PLAYER_HEX, record=True)
+    assert record.name == player["name"]
+    assert record.pet.skill[1].level == 99
+    assert player_parser.dumps("Player", record) == PLAYER_HEX
+
+
+def test_many(player_parser, player):
+    player_b = dict(player, name="", friends=())
+    data = player_parser.dumps_many("Player", [player, player_b])
+    assert player_parser.loads_many("Player", data) == [decoded(player), decoded(player_b)]
+
+
+def test_many_fixed():
+    proto_parser = make_parser("player.proto")
+    skills = [{"id": idx, "level": idx * 3} for idx in range(5)]
+    data = proto_parser.dumps_many("Skill", skills)
+    assert len(data) == 5 * proto_parser.fixed_size("Skill")
+    assert proto_parser.loads_many("Skill", data) == skills
+
+
+def test_lazy(player_parser, player):
+    view = player_parser.load_lazy("Player", bytes.fromhex(PLAYER_HEX))
+    assert view["friends"] == player["friends"]
+    assert view["pet"]["name"] == player["pet"]["name"]
+    assert view.to_dict() == decoded(player)
+
+
+@pytest.mark.parametrize("num_cut", [1, 5, 30])
+def test_truncated(player_parser, num_cut):
+    data = bytes.fromhex(PLAYER_HEX)
+    with pytest.raises((ValueError, struct.error)):
+        player_parser.load_bytes("Player", data[:-num_cut])
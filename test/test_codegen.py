@@ -0,0 +1,167 @@
+import importlib
+import sys
+
+import pytest
+
+from conftest import make_parser
+from parsed_strucut import ParsedStruct
+from proto_parser import ProtoParser
+
+RECURSIVE_PROTO = """
+Item { int32 id; string tag; };
+Node { string name; Node[] children; Item[2] items; string[] tags; };
+Big { Item[3] x; double[20] d; Pos[12] ps; bool[] flags; Pos[] pts; };
+Pos { int8 a; int16 b; };
+"""
+# struct names clashing with the globals of the generated module
+NAMES_PROTO = """
+classes { int32 x; };
+record_classes { int8 y; classes c; };
+size_struct0 { record_classes r; string s; };
+"""
+ITEM = {"id": 1, "tag": "x"}
+NODE = {"name": "r", "children": ({"name": "c", "children": (), "items": (ITEM, ITEM),
+                                   "tags": ("a", "bb")},),
+        "items": (ITEM, ITEM), "tags": ()}
+BIG = {"x": (ITEM,) * 3, "d": tuple(float(idx) for idx in range(20)),
+       "ps": ({"a": 1, "b": 2},) * 12, "flags": (True, False), "pts": ({"a": 3, "b": -4},) * 5}
+
+
+def make_parsers(content: str) -> tuple:
+    parsed_structs = ParsedStruct.parse_protocol(content)
+    proto_parser = ProtoParser()
+    proto_parser.load_protocol(parsed_structs)
+    interpreter = ProtoParser(codegen=False)
+    interpreter.load_protocol(parsed_structs)
+    return proto_parser, interpreter
+
+
+def check_parity(proto_parser: ProtoParser, interpreter: ProtoParser, strucut_name: str,
+                 obj_data: dict) -> None:
+    data = interpreter.dump_bytes(strucut_name, obj_data)
+    assert proto_parser.dump_bytes(strucut_name, obj_data) == data
+    assert proto_parser.load_bytes(strucut_name, data) == interpreter.load_bytes(strucut_name, data)
+    record = proto_parser.load_bytes(strucut_name, data, record=True)
+    assert repr(record) == repr(interpreter.load_bytes(strucut_name, data, record=True))
+    assert proto_parser.dump_bytes(strucut_name, record) == data
+    assert interpreter.dump_bytes(strucut_name, record) == data
+
+
+def test_compiled():
+    proto_parser = make_parser("player.proto")
+    interpreter = make_parser("player.proto", codegen=False)
+    assert all(plan.decode_func is not None for plan in proto_parser.plans.values())
+    assert all(plan.decode_func is None for plan in interpreter.plans.values())
+
+
+def test_player(player):
+    check_parity(make_parser("player.proto"), make_parser("player.proto", codegen=False),
+                 "Player", player)
+
+
+@pytest.mark.parametrize("strucut_name, obj_data", [("Node", NODE), ("Big", BIG)])
+def test_recursive(strucut_name, obj_data):
+    check_parity(*make_parsers(RECURSIVE_PROTO), strucut_name, obj_data)
+
+
+def test_struct_names():
+    obj_data = {"r": {"y": 1, "c": {"x": 3}}, "s": "abc"}
+    proto_parser, interpreter = make_parsers(NAMES_PROTO)
+    check_parity(proto_parser, interpreter, "size_struct0", obj_data)
+    record = proto_parser.load_bytes("size_struct0",
+                                     proto_parser.dump_bytes("size_struct0", obj_data), True)
+    assert record.r.c.x == 3
+
+
+def test_keyword_field_names():
+    proto_parser, interpreter = make_parsers("A { int32 x; string self; };")
+    check_parity(proto_parser, interpreter, "A", {"x": 1, "self": "s"})
+    proto_parser, interpreter = make_parsers("B { int32 class; };")
+    data = proto_parser.dump_bytes("B", {"class": 5})
+    assert proto_parser.load_bytes("B", data) == interpreter.load_bytes("B", data) == {"class": 5}
+    with pytest.raises(ValueError):
+        proto_parser.load_bytes("B", data, record=True)
+
+
+def test_record_classes_shared():
+    proto_parser = make_parser("player.proto")
+    assert proto_parser.record_class("Skill")(1, 10).level == 10
+    assert proto_parser.record_class("Skill") is proto_parser.record_class("Skill")
+
+
+def test_errors(player):
+    proto_parser = make_parser("player.proto")
+    with pytest.raises(ValueError):
+        proto_parser.dump_bytes("Player", dict(player, position=(1.0, 2.0)))
+    with pytest.raises(ValueError):
+        proto_parser.load_bytes("Player", proto_parser.dump_bytes("Player", player)[:5])
+
+
+def test_write_codegen(tmp_path, monkeypatch):
+    proto_parser, interpreter = make_parsers(RECURSIVE_PROTO)
+    proto_parser.write_codegen(str(tmp_path / "gen_recursive.py"))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module("gen_recursive")
+    try:
+        installed = ProtoParser(codegen=False)
+        installed.load_protocol(ParsedStruct.parse_protocol(RECURSIVE_PROTO))
+        installed.install_codegen(module)
+        check_parity(installed, interpreter, "Big", BIG)
+        check_parity(installed, interpreter, "Node", NODE)
+    finally:
+        del sys.modules["gen_recursive"]
+
+
+@pytest.mark.parametrize("content, strucut_name, obj_data", [
+    (RECURSIVE_PROTO, "Node", NODE),
+    (RECURSIVE_PROTO, "Big", BIG),
+    (NAMES_PROTO, "size_struct0", {"r": {"y": 1, "c": {"x": 3}}, "s": "abc"}),
+])
+def test_encode_record(content, strucut_name, obj_data):
+    proto_parser, interpreter = make_parsers(content)
+    assert proto_parser.plans[strucut_name].encode_record_func is not None
+    data = interpreter.dump_bytes(strucut_name, obj_data)
+    record = interpreter.load_bytes(strucut_name, data, record=True)
+    plan = proto_parser.plans[strucut_name]
+    assert plan.size_record_func(record) == len(data)
+    buffer = bytearray(len(data))
+    assert plan.encode_record_func(record, buffer, 0) == len(data)
+    assert buffer == data
+    assert proto_parser.dump_bytes(strucut_name, record) == data
+
+
+def test_encode_record_holding_dicts(player):
+    proto_parser = make_parser("player.proto")
+    data = proto_parser.dump_bytes("Player", player)
+    record = proto_parser.load_bytes("Player", data, record=True)
+    record.pet = player["pet"]
+    assert proto_parser.dump_bytes("Player", record) == data
+    record.pet = proto_parser.record_class("Pet")(player["pet"]["name"], player["pet"]["skill"])
+    assert proto_parser.dump_bytes("Player", record) == data
+
+
+def test_decode_record_binds_classes():
+    proto_parser, interpreter = make_parsers(RECURSIVE_PROTO)
+    data = interpreter.dump_bytes("Node", NODE)
+    record = proto_parser.plans["Node"].decode_record_func(memoryview(data), 0)[0]
+    assert type(record) is proto_parser.record_class("Node")
+    assert type(record.items[0]) is proto_parser.record_class("Item")
+    assert record == interpreter.load_bytes("Node", data, record=True)
+    assert proto_parser.load_bytes("Node", data, record=True) == record
+
+
+@pytest.mark.parametrize("strucut_name, var_name", [("Node", "children"), ("Node", "tags"),
+                                                    ("Big", "pts")])
+@pytest.mark.parametrize("codegen", [True, False])
+def test_list_count_exceeds_data(strucut_name, var_name, codegen):
+    proto_parser = ProtoParser(codegen=codegen)
+    proto_parser.load_protocol(ParsedStruct.parse_protocol(RECURSIVE_PROTO))
+    obj_data = {"Node": NODE, "Big": BIG}[strucut_name]
+    data = bytearray(proto_parser.dump_bytes(strucut_name, dict(obj_data, **{var_name: ()})))
+    view = proto_parser.load_lazy(strucut_name, data)
+    offset = view.field_offset(proto_parser.plans[strucut_name].field_index[var_name])
+    data[offset:offset + 2] = b"\xff\xff"
+    with pytest.raises(ValueError, match="List of 65535 items"):
+        proto_parser.load_bytes(strucut_name, data)
+    with pytest.raises(ValueError, match="List of 65535 items"):
+        proto_parser.skip_struct(strucut_name, data)
@@ -0,0 +1,107 @@
+import pickle
+import struct
+
+import pytest
+
+from conftest import decoded, make_parser, proto_path
+from parsed_strucut import ParsedStruct
+from proto_parser import ProtoParser
+
+FLAGS_PROTO = """
+Flags { bool a; int8 b; bool c; uint8[] d; bool[] e; bool[3] f; int16[2] g; double h;
+        uint32 i; int32 j; string[] k; uint16[] l; };
+Outer { Flags f; Flags[] fl; string big; int32[] big_list; };
+"""
+FLAGS = {"a": True, "b": -5, "c": True, "d": (1, 2, 255), "e": (True, False) * 5 + (True,),
+         "f": (False, True, True), "g": (-32768, 32767), "h": 1.5, "i": 4294967295,
+         "j": -2147483648, "k": ("x", "", "é"), "l": (0, 65535)}
+
+
+def make_compact_parser(content: str, codegen: bool = True) -> ProtoParser:
+    proto_parser = ProtoParser(codegen=codegen, compact=True)
+    proto_parser.load_protocol(ParsedStruct.parse_protocol(content))
+    return proto_parser
+
+
+@pytest.mark.parametrize("compact", [True, {"Player"}, {"Skill"}, {"Pet", "Skill"}],
+                         ids=["all", "player", "skill", "pet_skill"])
+@pytest.mark.parametrize("codegen", [True, False])
+def test_round_trip(player, compact, codegen):
+    proto_parser = make_parser("player.proto", codegen=codegen, compact=compact)
+    data = proto_parser.dump_bytes("Player", player)
+    assert proto_parser.load_bytes("Player", data) == decoded(player)
+    record = proto_parser.load_bytes("Player", data, record=True)
+    assert proto_parser.dump_bytes("Player", record) == data
+    assert proto_parser.skip_struct("Player", data) == len(data)
+    view = proto_parser.load_lazy("Player", data)
+    assert view.to_dict() == decoded(player)
+    assert view.end_offset() == len(data)
+    data_many = proto_parser.dumps_many("Player", [player] * 3)
+    assert proto_parser.loads_many("Player", data_many) == [decoded(player)] * 3
+    data_compressed = proto_parser.dumpComp("Player", player, True, True)
+    assert proto_parser.loadComp("Player", data_compressed, True, True) == decoded(player)
+
+
+def test_pickle(player):
+    proto_parser = make_parser("player.proto", compact=True)
+    proto_parser_load = pickle.loads(pickle.dumps(proto_parser))
+    data = proto_parser.dump_bytes("Player", player)
+    assert proto_parser_load.dump_bytes("Player", player) == data
+    assert proto_parser_load.load_bytes("Player", data) == decoded(player)
+
+
+def test_smaller(player):
+    data = make_parser("player.proto").dump_bytes("Player", player)
+    data_compact = make_parser("player.proto", compact=True).dump_bytes("Player", player)
+    assert len(data_compact) < len(data)
+
+
+@pytest.mark.parametrize("codegen", [True, False])
+def test_all_types(codegen):
+    proto_parser = make_compact_parser(FLAGS_PROTO, codegen)
+    obj_data = {"f": FLAGS, "fl": (FLAGS, FLAGS), "big": "a" * 70000,
+                "big_list": tuple(range(-40000, 40000))}
+    data = proto_parser.dump_bytes("Outer", obj_data)
+    assert proto_parser.load_bytes("Outer", data) == obj_data
+    assert proto_parser.skip_struct("Outer", data) == len(data)
+    with pytest.raises((ValueError, struct.error)):
+        proto_parser.load_bytes("Outer", data[:100])
+
+
+@pytest.mark.parametrize("var_name, value", [("i", -1), ("j", 1 << 31), ("g", (0, 1 << 15))])
+def test_out_of_range(var_name, value):
+    proto_parser = make_compact_parser(FLAGS_PROTO)
+    with pytest.raises(struct.error):
+        proto_parser.dump_bytes("Flags", dict(FLAGS, **{var_name: value}))
+
+
+@pytest.mark.parametrize("obj_data", [{"a": 70000, "b": ()}, {"a": 0, "b": (70000,)}])
+def test_decode_out_of_range(obj_data):
+    data = make_compact_parser("Small { uint32 a; uint32[] b; };").dump_bytes("Small", obj_data)
+    proto_parser = make_compact_parser("Small { uint16 a; int16[] b; };")
+    with pytest.raises(ValueError):
+        proto_parser.load_bytes("Small", data)
+
+
+def test_truncated_varint():
+    proto_parser = make_compact_parser("Small { uint32 a; };")
+    data = proto_parser.dump_bytes("Small", {"a": 70000})
+    with pytest.raises(ValueError, match="Varint exceeds serialized data"):
+        proto_parser.load_bytes("Small", data[:-1])
+
+
+def test_unknown_struct():
+    with pytest.raises(KeyError):
+        make_parser("player.proto", compact={"Nope"})
+
+
+def test_cache_per_mode(player, tmp_path):
+    cache_dir = str(tmp_path)
+    sizes = []
+    for compact in (False, True, False, True):
+        proto_parser = ProtoParser(compact=compact)
+        proto_parser.buildDesc(proto_path("player.proto"), cache_dir)
+        data = proto_parser.dump_bytes("Player", player)
+        assert proto_parser.load_bytes("Player", data) == decoded(player)
+        sizes.append(len(data))
+    assert sizes[0] == sizes[2] != sizes[1] == sizes[3]
@@ -0,0 +1,170 @@
+import io
+import struct
+
+import pytest
+
+from bitarray import BitArray, SimpleArray
+from huffman import Huffman, HuffmanModel, HuffmanStreamReader, HuffmanStreamWriter
+
+TEXTS = [
+    "AAAAAABCCCCCCDDEEEEE",
+    "A Huffman code is a type of optimal prefix code that is used for compressing data.",
+    "0900e9aaa8e7b2bee781b5a25d4f0000",
+    "aaaa",
+    "ab",
+]
+DATAS = [
+    bytes(range(256)) * 3,
+    b"\x00" * 10 + b"\xff",
+    b"\x7f",
+]
+
+
+@pytest.mark.parametrize("text_input", TEXTS)
+@pytest.mark.parametrize("to_bitarray", [False, True])
+def test_tree_round_trip(text_input, to_bitarray):
+    huffman_tree = Huffman.build_tree(text_input)
+    dict_code = Huffman.get_codes(huffman_tree)
+    text_encode = Huffman.encode_input(dict_code, text_input, to_bitarray)
+    tree_encode = Huffman.encode_tree(huffman_tree, to_bitarray)
+    text_encode.reset_read_head()
+    tree_encode.reset_read_head()
+    huffman_tree_decode = Huffman.decode_tree(tree_encode)
+    assert Huffman.decode_input(huffman_tree_decode, text_encode) == text_input
+
+
+@pytest.mark.parametrize("text_input", TEXTS + DATAS)
+def test_canonical_round_trip(text_input):
+    binary = isinstance(text_input, bytes)
+    huffman_tree = Huffman.build_tree(text_input)
+    code_lengths = Huffman.get_code_lengths(huffman_tree)
+    packed = Huffman.pack_canonical(code_lengths, text_input)
+    code_lengths_decode, text_encode = Huffman.unpack_canonical(packed, binary)
+    assert code_lengths_decode == code_lengths
+    assert Huffman.decode_canonical(code_lengths_decode, text_encode) == text_input
+
+
+def test_canonical_codes_prefix_free():
+    code_lengths = Huffman.get_code_lengths(Huffman.build_tree(TEXTS[1]))
+    codes = Huffman.canonical_codes(code_lengths)
+    bit_strings = sorted("{:0{}b}".format(code, num_bit) for code, num_bit in codes.values())
+    for bits_l, bits_r in zip(bit_strings, bit_strings[1:]):
+        assert not bits_r.startswith(bits_l)
+
+
+@pytest.mark.parametrize("text_input", TEXTS + DATAS)
+@pytest.mark.parametrize("canonical", [False, True])
+def test_compress_round_trip(text_input, canonical):
+    binary = isinstance(text_input, bytes)
+    data_compressed = Huffman.compress(text_input, canonical)
+    assert Huffman.decompress(data_compressed, canonical, binary) == text_input
+
+
+@pytest.mark.parametrize("text_input", ["0123abcd", "ffff", "0"])
+def test_model_round_trip(text_input):
+    model = HuffmanModel.train(3, ["00ff00ff", "0123456789abcdef"])
+    assert model.decompress(model.compress(text_input)) == text_input
+    model_load = HuffmanModel.from_bytes(model.to_bytes())
+    assert model_load.model_id == 3
+    assert not model_load.binary
+    assert model_load.decompress(model.compress(text_input)) == text_input
+
+
+def test_model_binary(tmp_path):
+    model = HuffmanModel.train(4, DATAS, Huffman.BYTE_ALPHABET)
+    assert model.binary
+    filename = str(tmp_path / "model.bin")
+    model.save(filename)
+    model_load = HuffmanModel.load(filename)
+    for data in DATAS + [b""]:
+        assert model_load.decompress(model.compress(data)) == data
+
+
+def test_model_unknown_char():
+    model = HuffmanModel.train(5, ["0123"])
+    with pytest.raises(ValueError):
+        model.compress("xyz")
+
+
+@pytest.mark.parametrize("frame_size", [1, 7, 1 << 16])
+def test_stream_round_trip(frame_size):
+    data = b"".join(DATAS) * 5
+    file = io.BytesIO()
+    with HuffmanStreamWriter(file, frame_size) as writer:
+        writer.write(data[:100])
+        writer.write(data[100:])
+    file.seek(0)
+    frames = list(HuffmanStreamReader(file))
+    assert b"".join(frames) == data
+    assert all(len(frame) <= frame_size for frame in frames)
+
+
+def test_stream_model():
+    model = HuffmanModel.train(9, DATAS, Huffman.BYTE_ALPHABET)
+    file = io.BytesIO()
+    with HuffmanStreamWriter(file, 64, model) as writer:
+        writer.write(DATAS[0])
+    file.seek(0)
+    assert HuffmanStreamReader(file, {9: model}).read() == DATAS[0]
+    file.seek(0)
+    with pytest.raises(KeyError):
+        HuffmanStreamReader(file).read()
+
+
+def test_stream_errors():
+    with pytest.raises(ValueError):
+        HuffmanStreamWriter(io.BytesIO(), model=HuffmanModel.train(1, ["0"]))
+    with pytest.raises(ValueError):
+        HuffmanStreamReader(io.BytesIO(b"ABCD"))
+    file = io.BytesIO()
+    with HuffmanStreamWriter(file) as writer:
+        writer.write(DATAS[0])
+    data = file.getvalue()
+    for size in (len(data) - 1, 6):
+        with pytest.raises(ValueError):
+            HuffmanStreamReader(io.BytesIO(data[:size])).read()
+
+
+# canonical headers after the 3 padding bits: max length 0 (no code), three
+# codes of 1 bit (Kraft inequality broken), two codes of 1 bit for the same char
+CORRUPT_CANONICAL = [b"\x00\x00", b"\x01\xc0\x00", b"\x01\x98\x58\x40"]
+
+
+@pytest.mark.parametrize("corrupt", CORRUPT_CANONICAL)
+def test_canonical_corrupt(corrupt):
+    with pytest.raises(ValueError):
+        Huffman.decompress(corrupt, canonical=True, binary=True)
+    file = io.BytesIO(HuffmanStreamWriter.MAGIC + struct.pack("<BI", 0, len(corrupt)) + corrupt)
+    with pytest.raises(ValueError):
+        HuffmanStreamReader(file).read()
+    with pytest.raises(ValueError):
+        Huffman.DecodeTable({})
+
+
+@pytest.mark.parametrize("array_class", [BitArray, SimpleArray])
+def test_bits_round_trip(array_class):
+    values = [(idx * 37) & 0x1FFF for idx in range(50)]
+    bit_array = array_class()
+    bit_array.write_bit(1)
+    for value in values:
+        bit_array.write_bits(value, 13)
+    bit_array.write_char("Z")
+    bit_array.reset_read_head()
+    assert bit_array.read_bit() == 1
+    assert [bit_array.read_bits(13) for _ in values] == values
+    assert bit_array.read_char() == "Z"
+    with pytest.raises(IndexError):
+        bit_array.read_bit()
+
+
+def test_write_bits_mask():
+    bit_array = BitArray()
+    bit_array.write_bits(0b101, 2)
+    bit_array.write_bits(0xFFF, 3)
+    bit_array.write_bits(0, 3)
+    assert bit_array.to_bytes() == bytes([0b01111000])
+    assert len(bit_array) == 8
+    bit_array.write_bits(-1, 12)
+    bit_array.reset_read_head()
+    assert bit_array.read_bits(8) == 0b01111000
+    assert bit_array.read_bits(12) == 0xFFF
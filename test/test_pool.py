@@ -0,0 +1,76 @@
+import pickle
+import struct
+
+import pytest
+
+from conftest import decoded, make_parser, make_players, make_skills
+from proto_pool import ParallelParser
+
+
+@pytest.fixture(scope="module")
+def proto_parser():
+    return make_parser("player.proto")
+
+
+@pytest.fixture(scope="module")
+def pool(proto_parser):
+    with ParallelParser(proto_parser, 2, chunk_size=7) as parallel_parser:
+        yield parallel_parser
+
+
+@pytest.fixture
+def players(player):
+    return make_players(player, 40)
+
+
+def test_dump_load(proto_parser, pool, players):
+    datas = pool.dump_all("Player", players)
+    assert datas == [proto_parser.dump_bytes("Player", obj_data) for obj_data in players]
+    assert pool.load_all("Player", datas) == [decoded(obj_data) for obj_data in players]
+    assert pool.load_all("Player", datas, record=True) == \
+        [proto_parser.load_bytes("Player", data, record=True) for data in datas]
+
+
+@pytest.mark.parametrize("canonical, binary", [(False, False), (True, False), (True, True)])
+def test_compress_decompress(proto_parser, pool, players, canonical, binary):
+    datas_compressed = pool.compress_all("Player", players, canonical, binary)
+    assert datas_compressed == [proto_parser.dumpComp("Player", obj_data, canonical, binary)
+                                for obj_data in players]
+    assert pool.decompress_all("Player", datas_compressed, canonical, binary) == \
+        [decoded(obj_data) for obj_data in players]
+    assert pool.decompress_all("Player", datas_compressed, canonical, binary, True) == \
+        [proto_parser.loadComp("Player", data, canonical, binary, True)
+         for data in datas_compressed]
+
+
+@pytest.mark.parametrize("record", [False, True])
+def test_load_stream(proto_parser, pool, players, record):
+    stream = proto_parser.dumps_many("Player", players)
+    assert pool.load_stream("Player", stream, record) == \
+        proto_parser.loads_many("Player", stream, record)
+    skills = make_skills(50)
+    stream = proto_parser.dumps_many("Skill", skills)
+    assert pool.load_stream("Skill", stream, record) == \
+        proto_parser.loads_many("Skill", stream, record)
+    assert pool.load_stream("Player", b"") == []
+
+
+def test_load_stream_truncated(proto_parser, pool, players):
+    stream = proto_parser.dumps_many("Player", players)
+    with pytest.raises((ValueError, struct.error)):
+        pool.load_stream("Player", stream[:-3])
+
+
+def test_pickle_parser(player, players):
+    proto_parser = make_parser("player.proto")
+    proto_parser.register_model("Player", proto_parser.train_model("Player", players, 7, True))
+    proto_parser_load = pickle.loads(pickle.dumps(proto_parser))
+    assert proto_parser_load.codegen_code is not None
+    assert proto_parser_load.plans["Player"].decode_func is not None
+    assert proto_parser_load.struct_models["Player"].model_id == 7
+    data_compressed = proto_parser.dumpComp("Player", player)
+    assert proto_parser_load.dumpComp("Player", player) == data_compressed
+    assert proto_parser_load.loadComp("Player", data_compressed) == decoded(player)
+    record = proto_parser_load.load_bytes("Player", proto_parser.dump_bytes("Player", player),
+                                          record=True)
+    assert pickle.loads(pickle.dumps(record)) == record
@@ -0,0 +1,119 @@
+import pytest
+
+from conftest import decoded, make_parser
+from proto_profile import ProtoProfiler
+
+ENCODE_STAGES = {"serialize", "stats", "tree_build", "encode", "pack"}
+DECODE_STAGES = {"unpack", "tree_build", "decode", "deserialize"}
+
+
+def counts(counters: dict) -> dict:
+    return {name: {op: counter["count"] for op, counter in ops.items()}
+            for name, ops in counters.items()}
+
+
+@pytest.mark.parametrize("codegen", [True, False])
+def test_struct_and_field_counters(player, codegen):
+    proto_parser = make_parser("player.proto", codegen=codegen)
+    data = proto_parser.dump_bytes("Player", player)
+    profiler = proto_parser.enable_profiling()
+    assert proto_parser.dump_bytes("Player", player) == data
+    assert proto_parser.load_bytes("Player", data) == decoded(player)
+    snapshot = profiler.snapshot()
+    assert counts(snapshot["structs"]) == {"Player": {"encode": 1, "decode": 1},
+                                           "Pet": {"encode": 1, "decode": 1}}
+    assert snapshot["structs"]["Player"]["encode"]["bytes"] == len(data)
+    assert snapshot["structs"]["Player"]["decode"]["bytes"] == len(data)
+    # fixed-size Skill is only counted as the field holding it
+    assert "Skill" not in snapshot["structs"]
+    assert set(snapshot["fields"]) == {
+        "Player.name", "Player.id", "Player.married", "Player.friends", "Player.position",
+        "Player.pet", "Pet.name", "Pet.skill"}
+    assert snapshot["fields"]["Player.friends"]["encode"]["bytes"] == 2 + 4 * 2
+    assert snapshot["fields"]["Pet.skill"]["decode"] == {
+        "count": 1, "bytes": 12, "seconds": snapshot["fields"]["Pet.skill"]["decode"]["seconds"]}
+    assert snapshot["stages"] == {}
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+def test_stage_counters(player, canonical):
+    proto_parser = make_parser("player.proto")
+    profiler = proto_parser.enable_profiling()
+    data_compressed = proto_parser.dumpComp("Player", player, canonical)
+    assert proto_parser.loadComp("Player", data_compressed, canonical) == decoded(player)
+    stages = profiler.snapshot()["stages"]
+    encode_stages = {name for name, ops in stages.items() if "encode" in ops}
+    decode_stages = {name for name, ops in stages.items() if "decode" in ops}
+    if canonical:
+        assert encode_stages == ENCODE_STAGES - {"pack"}
+        assert decode_stages == DECODE_STAGES - {"tree_build"}
+    else:
+        assert encode_stages == ENCODE_STAGES
+        assert decode_stages == DECODE_STAGES
+    # tree_build and encode/decode run in both directions, counted apart
+    assert stages["encode"]["encode"]["count"] == 1
+    assert stages["decode"]["decode"]["count"] == 1
+    assert stages["serialize"]["encode"]["bytes"] == \
+        2 * len(proto_parser.dump_bytes("Player", player))
+    assert stages["deserialize"]["decode"]["bytes"] == stages["serialize"]["encode"]["bytes"]
+    assert all(counter["seconds"] >= 0 for ops in stages.values() for counter in ops.values())
+
+
+def test_model_stages(player):
+    proto_parser = make_parser("player.proto")
+    proto_parser.register_model("Player", proto_parser.train_model("Player", [player], 3))
+    profiler = proto_parser.enable_profiling()
+    proto_parser.loadComp("Player", proto_parser.dumpComp("Player", player))
+    assert counts(profiler.snapshot()["stages"]) == {
+        "serialize": {"encode": 1}, "encode": {"encode": 1},
+        "decode": {"decode": 1}, "deserialize": {"decode": 1}}
+
+
+def test_callback(player):
+    proto_parser = make_parser("player.proto")
+    events = []
+    profiler = proto_parser.enable_profiling(callback=lambda *event: events.append(event))
+    proto_parser.dumpComp("Player", player)
+    kinds = {(kind, name, op) for kind, name, op, _, _ in events}
+    assert ("struct", "Player", "encode") in kinds
+    assert ("field", "Player.pet", "encode") in kinds
+    assert ("stage", "serialize", "encode") in kinds
+    assert all(num_byte >= 0 and seconds >= 0 for _, _, _, num_byte, seconds in events)
+    snapshot = profiler.snapshot()
+    assert len(events) == sum(counter["count"] for key in ("structs", "fields", "stages")
+                              for ops in snapshot[key].values() for counter in ops.values())
+
+
+def test_shared_profiler_and_reset(player):
+    profiler = ProtoProfiler()
+    for filename in ("player.proto", "simple.proto"):
+        proto_parser = make_parser(filename)
+        assert proto_parser.enable_profiling(profiler) is profiler
+        proto_parser.dumps("Player", player if filename == "player.proto" else
+                           {key: value for key, value in player.items() if key != "pet"})
+    assert profiler.snapshot()["structs"]["Player"]["encode"]["count"] == 2
+    profiler.reset()
+    assert profiler.snapshot() == {"structs": {}, "fields": {}, "stages": {}}
+
+
+def test_disable_profiling(player):
+    proto_parser = make_parser("player.proto")
+    profiler = proto_parser.enable_profiling()
+    proto_parser.dumps("Player", player)
+    snapshot = profiler.snapshot()
+    proto_parser.disable_profiling()
+    assert proto_parser.profiler is None
+    data_compressed = proto_parser.dumpComp("Player", player)
+    assert proto_parser.loadComp("Player", data_compressed) == decoded(player)
+    assert profiler.snapshot() == snapshot
+
+
+def test_compact(player):
+    proto_parser = make_parser("player.proto", compact=True)
+    profiler = proto_parser.enable_profiling()
+    data = proto_parser.dump_bytes("Player", player)
+    assert proto_parser.load_bytes("Player", data) == decoded(player)
+    snapshot = profiler.snapshot()
+    assert snapshot["structs"]["Player"]["decode"]["bytes"] == len(data)
+    # compact structs are timed as a whole
+    assert snapshot["fields"] == {}
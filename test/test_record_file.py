@@ -0,0 +1,91 @@
+import pytest
+
+from conftest import decoded, make_parser, make_players, make_skills
+from record_file import INDEX_MAGIC, RecordFile, RecordFileWriter, index_trailer_codec
+
+
+def write_record_file(proto_parser, strucut_name: str, objs, filename: str) -> None:
+    with open(filename, "wb") as f:
+        with RecordFileWriter(proto_parser, strucut_name, f, 32) as writer:
+            writer.write_many(objs)
+
+
+def test_record_file(player_parser, player, tmp_path):
+    players = make_players(player, 12)
+    filename = str(tmp_path / "players.rec")
+    write_record_file(player_parser, "Player", players, filename)
+    with RecordFile(player_parser, "Player", filename) as record_file:
+        assert len(record_file) == 12
+        assert record_file[3] == decoded(players[3])
+        assert record_file[-1] == decoded(players[-1])
+        assert record_file[2:9:3] == [decoded(obj_data) for obj_data in players[2:9:3]]
+        assert list(record_file) == [decoded(obj_data) for obj_data in players]
+        raw = record_file.raw(5)
+        assert bytes(raw) == player_parser.dump_bytes("Player", players[5])
+        raw.release()
+        with pytest.raises(IndexError):
+            record_file[12]
+
+
+def test_record_file_fixed(tmp_path):
+    proto_parser = make_parser("player.proto")
+    skills = make_skills(10)
+    filename = str(tmp_path / "skills.rec")
+    write_record_file(proto_parser, "Skill", skills, filename)
+    with open(filename, "rb") as f:
+        assert f.read() == proto_parser.dumps_many("Skill", skills)
+    with RecordFile(proto_parser, "Skill", filename) as record_file:
+        assert len(record_file) == 10
+        assert record_file[7] == skills[7]
+        assert record_file[2:5] == skills[2:5]
+        assert record_file[5:2] == []
+
+
+def test_record_file_empty(player_parser, tmp_path):
+    filename = str(tmp_path / "empty.rec")
+    write_record_file(player_parser, "Player", [], filename)
+    with RecordFile(player_parser, "Player", filename) as record_file:
+        assert len(record_file) == 0
+        assert list(record_file) == []
+
+
+@pytest.mark.parametrize("strucut_name", ["Player", "Skill"])
+def test_record_file_truncated(player, strucut_name, tmp_path):
+    proto_parser = make_parser("player.proto")
+    objs = make_players(player, 3) if strucut_name == "Player" else make_skills(3)
+    filename = str(tmp_path / "objs.rec")
+    write_record_file(proto_parser, strucut_name, objs, filename)
+    with open(filename, "rb") as f:
+        data = f.read()
+    for size in (len(data) - 1, 5):
+        with open(filename, "wb") as f:
+            f.write(data[:size])
+        with pytest.raises(ValueError):
+            RecordFile(proto_parser, strucut_name, filename)
+
+
+def test_record_file_failed_write(player, tmp_path):
+    proto_parser = make_parser("player.proto")
+    filename = str(tmp_path / "players.rec")
+    with open(filename, "wb") as f:
+        with RecordFileWriter(proto_parser, "Player", f) as writer:
+            writer.write(dict(player, id=1))
+            bad = dict(player, id=2)
+            del bad["pet"]
+            with pytest.raises(KeyError):
+                writer.write(bad)
+            writer.write(dict(player, id=3))
+    with RecordFile(proto_parser, "Player", filename) as record_file:
+        assert [obj_data["id"] for obj_data in record_file] == [1, 3]
+
+
+@pytest.mark.parametrize("index_offset, num_record", [(0, 3), (1, 3), (0, 1 << 40)])
+def test_record_file_corrupt_trailer(player, tmp_path, index_offset, num_record):
+    proto_parser = make_parser("player.proto")
+    filename = str(tmp_path / "players.rec")
+    write_record_file(proto_parser, "Player", make_players(player, 3), filename)
+    with open(filename, "r+b") as f:
+        f.seek(-index_trailer_codec.size, 2)
+        f.write(index_trailer_codec.pack(index_offset, num_record, INDEX_MAGIC))
+    with pytest.raises(ValueError):
+        RecordFile(proto_parser, "Player", filename)
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from conftest import decoded, make_parser, make_players, make_skills
+from proto_stream import ProtoReader, ProtoWriter
+
+
+class ChunkedFile(io.BytesIO):
+    """
+    Pipe-like file returning at most 5 bytes per read
+    """
+    def read(self, size=-1):
+        return super().read(5 if size < 0 else min(size, 5))
+
+
+@pytest.mark.parametrize("buffer_size", [1, 64, 1 << 16])
+@pytest.mark.parametrize("readahead", [1, 16, 1 << 16])
+def test_stream_round_trip(player_parser, player, buffer_size, readahead):
+    players = make_players(player, 20)
+    file = io.BytesIO()
+    with ProtoWriter(player_parser, "Player", file, buffer_size) as writer:
+        writer.write_many(players)
+        assert writer.tell() == len(player_parser.dumps_many("Player", players))
+    assert file.getvalue() == player_parser.dumps_many("Player", players)
+    file.seek(0)
+    reader = ProtoReader(player_parser, "Player", file, readahead)
+    assert list(reader) == [decoded(obj_data) for obj_data in players]
+
+
+@pytest.mark.parametrize("readahead", [1, 5, 1 << 16])
+def test_stream_fixed(readahead):
+    proto_parser = make_parser("player.proto")
+    skills = make_skills(30)
+    file = io.BytesIO()
+    with ProtoWriter(proto_parser, "Skill", file, 10) as writer:
+        writer.write_many(skills)
+    assert file.getvalue() == proto_parser.dumps_many("Skill", skills)
+    file.seek(0)
+    assert list(ProtoReader(proto_parser, "Skill", file, readahead)) == skills
+
+
+def test_stream_short_reads(player_parser, player):
+    players = make_players(player, 5)
+    file = ChunkedFile(player_parser.dumps_many("Player", players))
+    assert list(ProtoReader(player_parser, "Player", file)) == \
+        [decoded(obj_data) for obj_data in players]
+
+
+def test_stream_empty(player_parser):
+    assert list(ProtoReader(player_parser, "Player", io.BytesIO())) == []
+
+
+@pytest.mark.parametrize("strucut_name", ["Player", "Skill"])
+def test_stream_truncated(player, strucut_name):
+    proto_parser = make_parser("player.proto")
+    objs = make_players(player, 3) if strucut_name == "Player" else make_skills(3)
+    data = proto_parser.dumps_many(strucut_name, objs)
+    for size in (len(data) - 1, 3):
+        reader = ProtoReader(proto_parser, strucut_name, io.BytesIO(data[:size]))
+        with pytest.raises(ValueError):
+            list(reader)
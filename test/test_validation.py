@@ -0,0 +1,94 @@
+import pytest
+
+from conftest import make_parser, proto_path, write_proto
+from parsed_strucut import ParsedStruct
+from proto_parser import ProtoParser
+
+
+def load(content: str, **kwargs) -> ProtoParser:
+    proto_parser = ProtoParser(**kwargs)
+    proto_parser.load_protocol(ParsedStruct.parse_protocol(content))
+    return proto_parser
+
+
+@pytest.mark.parametrize("content, error", [
+    ("A { int32 x; Missing m; };", KeyError),
+    ("A { int32 x; int8 x; };", ValueError),
+    ("A { int32 x; A a; };", ValueError),
+    ("A { B[2] b; }; B { A a; };", ValueError),
+    ("A { int32 x; }; A { int8 y; };", ValueError),
+    ("A { };", ValueError),
+    ("A { int32 x; }; B { };", ValueError),
+])
+@pytest.mark.parametrize("codegen", [True, False])
+def test_invalid_protocol(content, error, codegen):
+    with pytest.raises(error):
+        load(content, codegen=codegen)
+
+
+@pytest.mark.parametrize("content", [
+    "A { int32 x; A[] children; };",
+    "A { B[] b; }; B { A a; };",
+])
+def test_recursive_through_variable_list(content):
+    proto_parser = load(content)
+    assert "A" in proto_parser.plans
+
+
+@pytest.mark.parametrize("content", [
+    "A { int32 x; }",
+    "A { int32 x };",
+    "A { int32; };",
+    "A { int32 x; }; garbage",
+    "{ int32 x; };",
+])
+def test_syntax_error(content):
+    with pytest.raises(ValueError):
+        ParsedStruct.parse_protocol(content)
+
+
+def test_duplicate_across_files(tmp_path):
+    proto_parser = make_parser("player.proto")
+    with pytest.raises(ValueError):
+        proto_parser.buildDesc(write_proto(tmp_path, "Skill { int8 id; };"))
+    assert proto_parser.protocol["Skill"].fields[0] == ("id", "int32", False, 0)
+    proto_parser.buildDesc(write_proto(tmp_path, "Team { Player[] players; };"))
+    assert list(proto_parser.plans) == ["Skill", "Pet", "Player", "Team"]
+
+
+def test_duplicate_reload():
+    proto_parser = make_parser("player.proto")
+    with pytest.raises(ValueError):
+        proto_parser.buildDesc(proto_path("player.proto"))
+
+
+def test_unknown_struct():
+    proto_parser = make_parser("player.proto")
+    with pytest.raises(KeyError):
+        proto_parser.dumps("Nope", {})
+    with pytest.raises(KeyError):
+        proto_parser.loads("Nope", "00")
+
+
+def test_list_size(player):
+    proto_parser = make_parser("player.proto", codegen=False)
+    with pytest.raises(ValueError):
+        proto_parser.dumps("Player", dict(player, position=(1.0, 2.0, 3.0, 4.0)))
+
+
+@pytest.mark.parametrize("content", [
+    "Bad { Missing m; };",
+    "Bad { Bad b; };",
+    "Bad { };",
+    "Skill { int8 id; };",
+])
+def test_rejected_file_leaves_parser_unchanged(tmp_path, player, content):
+    proto_parser = make_parser("player.proto")
+    plans = proto_parser.plans
+    with pytest.raises((KeyError, ValueError)):
+        proto_parser.buildDesc(write_proto(tmp_path, content))
+    assert list(proto_parser.protocol) == ["Skill", "Pet", "Player"]
+    assert proto_parser.plans is plans
+    proto_parser.buildDesc(write_proto(tmp_path, "Team { Player[] players; };"))
+    data = proto_parser.dump_bytes("Team", {"players": (player,)})
+    assert proto_parser.load_bytes("Team", data)["players"][0]["id"] == player["id"]